@@ -0,0 +1,353 @@
+"""
+Offline benchmark of the PDF/OCR ingestion pipeline.
+
+Generates synthetic PDFs (text only, image heavy and scanned), replaces
+tesseract and the vision model by stubs with a fixed latency, and reports
+pages per second, ocr calls per page, peak RSS and the time per parsing
+stage. Needs no network access and no API key.
+
+    python -m benchmarks.ingestion
+    python -m benchmarks.ingestion --pages 64 --workers 4 --vision-latency 1.5
+    python -m benchmarks.ingestion --warm --json .logs/bench.json
+    python -m benchmarks.ingestion --kinds scanned --pages 500 --low-memory
+
+Every scenario runs in a fresh process, so peak RSS is its own. Stage
+seconds are summed over the page workers, the vision stage runs alongside
+them and is wall time.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import types
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+
+def _offline_config():
+    """Stands in for the project config, which creates the Gemini clients."""
+    if "config" in sys.modules:
+        return
+    config = types.ModuleType("config")
+    config.vision_llm_model = "benchmark-vision"
+    config.genai_client = None
+    config.embedding = None
+    config.llm = None
+    sys.modules["config"] = config
+
+
+_offline_config()
+
+from PIL import Image  # noqa: E402
+
+from rag.lib.readers import GenericReader  # noqa: E402
+from rag.lib.readers.parsers import PDFParser  # noqa: E402
+from rag.lib.readers.parsers.pdf_parser import PageCheckpoints, ParseStats  # noqa: E402
+from rag.lib.utils.ocr import OCRCache, OCRService  # noqa: E402
+from rag.lib.utils.ocr_router import OCRRouter  # noqa: E402
+from rag.lib.utils.tesseract_pool import TesseractPool  # noqa: E402
+
+KINDS = ("text", "images", "scanned")
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+WORDS = (
+    "pump valve pressure flow seal bearing motor shaft impeller casing inlet "
+    "outlet gasket maintenance inspection torque alignment vibration"
+).split()
+
+
+class StubTesseractPool(TesseractPool):
+    """
+    Sleeps `latency` seconds per image. About `vision_ratio` of the images
+    come back with a low confidence, so the router sends them to vision.
+    """
+
+    def __init__(self, latency: float, vision_ratio: float, size: int = 4):
+        super().__init__(size=size)
+        self.latency = latency
+        self.vision_ratio = vision_ratio
+
+    def _recognize(self, image: Image.Image):
+        time.sleep(self.latency)
+        if zlib.crc32(image.tobytes()) % 100 < self.vision_ratio * 100:
+            return "handwritten or low contrast text " * 4, 40.0
+        return "printed text read by tesseract", 95.0
+
+
+class StubOCRService(OCRService):
+    """Answers every vision request after `latency` seconds."""
+
+    def __init__(self, latency: float, **kwargs):
+        super().__init__(model="benchmark-vision", **kwargs)
+        self.latency = latency
+        self.requests = 0
+        self.images = 0
+
+    async def _request(self, images: List[Image.Image]) -> List[Optional[str]]:
+        await asyncio.sleep(self.latency)
+        self.requests += 1
+        self.images += len(images)
+        return [f"vision text {i}" for i in range(len(images))]
+
+
+def generate_pdfs(directory: str, pages: int, images_per_page: int) -> Dict[str, str]:
+    import pymupdf
+
+    rng = random.Random(0)
+    files = {}
+    for kind in KINDS:
+        doc = pymupdf.open()
+        logo_xref = 0
+        for number in range(pages):
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            if kind == "text":
+                _insert_text(page, rng, 400)
+            elif kind == "images":
+                _insert_text(page, rng, 80, bottom=200)
+                # A logo repeated on every page and an icon under the size cutoff
+                logo = page.insert_image(
+                    pymupdf.Rect(460, 20, 560, 60),
+                    stream=None if logo_xref else _noise_png(rng, 200, 80),
+                    xref=logo_xref,
+                )
+                logo_xref = logo_xref or logo
+                page.insert_image(
+                    pymupdf.Rect(20, 20, 36, 36), stream=_noise_png(rng, 16, 16)
+                )
+                for i in range(images_per_page):
+                    top = 220 + i * 150
+                    page.insert_image(
+                        pymupdf.Rect(40, top, 340, top + 140),
+                        stream=_noise_png(rng, 400, 200),
+                    )
+            else:
+                page.insert_image(page.rect, stream=_scanned_page(pymupdf, rng))
+        path = os.path.join(directory, f"{kind}.pdf")
+        doc.save(path, garbage=3, deflate=True)
+        doc.close()
+        files[kind] = path
+    return files
+
+
+def _insert_text(page, rng: random.Random, words: int, bottom: float = PAGE_HEIGHT):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    page.insert_textbox((40, 40, PAGE_WIDTH - 40, bottom - 40), text, fontsize=9)
+
+
+def _noise_png(rng: random.Random, width: int, height: int) -> bytes:
+    image = Image.frombytes("L", (width, height), rng.randbytes(width * height))
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def _scanned_page(pymupdf, rng: random.Random) -> bytes:
+    source = pymupdf.open()
+    page = source.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    _insert_text(page, rng, 400)
+    pixmap = page.get_pixmap(dpi=150, colorspace=pymupdf.csGRAY)
+    source.close()
+    return pixmap.tobytes("jpeg")
+
+
+def build_parser(args, cache_path: str) -> PDFParser:
+    service = StubOCRService(
+        args.vision_latency,
+        max_concurrency=args.vision_concurrency,
+        batch_size=args.vision_batch_size,
+    )
+    return PDFParser(
+        num_workers=args.workers,
+        pages_per_task=args.pages_per_task,
+        ocr_service=service,
+        ocr_cache=OCRCache(service.version, path=cache_path),
+        checkpoints=PageCheckpoints(path=cache_path),
+        low_memory=args.low_memory,
+        text_engine=args.text_engine,
+        ocr_router=OCRRouter(
+            tesseract_pool=StubTesseractPool(
+                args.tesseract_latency, args.vision_ratio, args.tesseract_threads
+            )
+        ),
+    )
+
+
+def run_file(args, kind: str, path: str, cache_path: str) -> List[dict]:
+    """Parses one file, twice with `--warm` to measure the ocr cache."""
+    parser = build_parser(args, cache_path)
+    results = []
+    for run in ("cold", "warm") if args.warm else ("cold",):
+        service = parser.ocr_service
+        service.requests = service.images = 0
+        started = time.perf_counter()
+        documents = parser.load_data(path)
+        seconds = time.perf_counter() - started
+        stats = parser.stats[os.path.basename(path)]
+        results.append(
+            _result(f"{kind}/{run}", len(documents), seconds, stats, service)
+        )
+    return results
+
+
+def run_directory(args, directory: str, cache_path: str) -> List[dict]:
+    """All files through GenericReader, `--file-workers` files at a time."""
+    parser = build_parser(args, cache_path)
+    reader = GenericReader(
+        directory,
+        file_extractor={".pdf": parser},
+        num_workers=args.file_workers,
+    )
+    started = time.perf_counter()
+    pages = sum(len(documents) for _, documents in reader.iter_files())
+    seconds = time.perf_counter() - started
+    # Ocr stats stay in the file workers, only throughput is reported
+    return [_result(f"directory/x{args.file_workers}", pages, seconds)]
+
+
+def _result(
+    name: str,
+    pages: int,
+    seconds: float,
+    stats: Optional[ParseStats] = None,
+    service: Optional[StubOCRService] = None,
+) -> dict:
+    result = {
+        "scenario": name,
+        "pages": pages,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds if seconds else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    if stats is not None:
+        result.update(
+            tesseract_per_page=stats.ocr.tesseract / pages,
+            vision_requests_per_page=service.requests / pages,
+            vision_images_per_page=service.images / pages,
+            skipped=stats.ocr.skipped,
+            cached=stats.ocr.cached,
+            upload_mb=stats.ocr.upload_bytes / 2**20,
+            text_seconds=stats.text_seconds,
+            image_seconds=stats.image_seconds,
+            tesseract_seconds=stats.tesseract_seconds,
+            vision_seconds=stats.vision_seconds,
+            boilerplate_chars=stats.boilerplate.chars,
+        )
+    return result
+
+
+def _peak_rss_mb() -> float:
+    """Peak RSS of this process plus its largest finished child."""
+    scale = 1 if sys.platform == "darwin" else 1024  # bytes on macOS, else KiB
+    peak = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        peak += resource.getrusage(who).ru_maxrss * scale
+    return peak / 2**20
+
+
+def _isolated(function, *args) -> List[dict]:
+    # A fresh process per scenario keeps the peak RSS of the others out
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(function, *args).result()
+
+
+# Result key, header, width and number format of the table columns
+COLUMNS = [
+    ("scenario", "scenario", 16, ""),
+    ("pages", "pages", 6, "d"),
+    ("seconds", "seconds", 8, ".2f"),
+    ("pages_per_second", "pages/s", 8, ".1f"),
+    ("tesseract_per_page", "tess/p", 7, ".2f"),
+    ("vision_requests_per_page", "vreq/p", 7, ".2f"),
+    ("vision_images_per_page", "vimg/p", 7, ".2f"),
+    ("cached", "cached", 7, "d"),
+    ("peak_rss_mb", "rss MB", 7, ".0f"),
+    ("text_seconds", "text s", 7, ".2f"),
+    ("image_seconds", "image s", 8, ".2f"),
+    ("tesseract_seconds", "tess s", 7, ".2f"),
+    ("vision_seconds", "vision s", 8, ".2f"),
+]
+
+
+def print_table(results: List[dict]):
+    rows = [{key: header for key, header, _, _ in COLUMNS}, *results]
+    for row in rows:
+        cells = []
+        for key, _, width, spec in COLUMNS:
+            value = row.get(key, "-")
+            if not isinstance(value, str):
+                value = format(value, spec)
+            cells.append(
+                value.ljust(width) if key == "scenario" else value.rjust(width)
+            )
+        print(" ".join(cells))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--pages", type=int, default=32, help="pages per pdf")
+    parser.add_argument("--images-per-page", type=int, default=3)
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    parser.add_argument("--file-workers", type=int, default=2)
+    parser.add_argument(
+        "--text-engine", choices=("pdfplumber", "pymupdf"), default="pdfplumber"
+    )
+    parser.add_argument("--tesseract-latency", type=float, default=0.05)
+    parser.add_argument("--tesseract-threads", type=int, default=4)
+    parser.add_argument(
+        "--vision-ratio",
+        type=float,
+        default=0.3,
+        help="share of images tesseract fails to read",
+    )
+    parser.add_argument("--vision-latency", type=float, default=1.0)
+    parser.add_argument("--vision-concurrency", type=int, default=8)
+    parser.add_argument("--vision-batch-size", type=int, default=4)
+    parser.add_argument(
+        "--warm", action="store_true", help="parse every file again, ocr cached"
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="parse in the bounded memory mode of PDFParser",
+    )
+    parser.add_argument(
+        "--no-directory",
+        action="store_true",
+        help="skip the GenericReader run over all files",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results: List[dict] = []
+    with tempfile.TemporaryDirectory(prefix="ingestion-bench-") as workdir:
+        input_dir = os.path.join(workdir, "input")
+        os.makedirs(input_dir)
+        files = generate_pdfs(input_dir, args.pages, args.images_per_page)
+        for kind in args.kinds:
+            cache_path = os.path.join(workdir, f"{kind}.sqlite")
+            results += _isolated(run_file, args, kind, files[kind], cache_path)
+        if not args.no_directory:
+            cache_path = os.path.join(workdir, "directory.sqlite")
+            results += _isolated(run_directory, args, input_dir, cache_path)
+
+    print_table(results)
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
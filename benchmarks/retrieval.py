@@ -0,0 +1,266 @@
+"""
+Offline benchmark of vector search in NumpyVectorStore.
+
+Scores queries exhaustively, from float16 and int8 quantized vectors with
+and without re-scoring, and through an IVF index with several values of
+nprobe, and reports the latency of one query and of a batch of queries, the
+memory scanned and the recall@k of every setting against exact search, so
+the quantization, `lists` and `nprobe` are picked with real numbers. Vectors are generated in clusters,
+or read from a persisted index with `--storage`; queries are stored vectors
+with noise added. Needs no network access and no API key.
+
+    python -m benchmarks.retrieval
+    python -m benchmarks.retrieval --vectors 1000000 --dim 768 --nprobe 8 32 128
+    python -m benchmarks.retrieval --storage .storage --lists 2048 --json .logs/ann.json
+    python -m benchmarks.retrieval --quantization int8 --rescore 2 4 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+from typing import List
+
+import numpy as np
+
+
+def _offline_config():
+    """Stands in for the project config, which creates the Gemini clients."""
+    if "config" in sys.modules:
+        return
+    config = types.ModuleType("config")
+    config.vision_llm_model = "benchmark-vision"
+    config.genai_client = None
+    config.embedding = None
+    config.llm = None
+    sys.modules["config"] = config
+
+
+_offline_config()
+
+from llama_index.core.vector_stores.types import VectorStoreQuery  # noqa: E402
+
+from rag.lib.stores import NumpyVectorStore, recall_at_k  # noqa: E402
+from rag.lib.stores.numpy_store import VectorBlock, normalize  # noqa: E402
+
+
+def generate_vectors(
+    directory: str, count: int, dim: int, clusters: int, spread: float, seed: int
+) -> NumpyVectorStore:
+    """
+    A store of `count` vectors around `clusters` random centers, at
+    `spread` times the norm of the centers from them.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    path = os.path.join(directory, "vectors.npy")
+    matrix = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.float32, shape=(count, dim)
+    )
+    for start in range(0, count, 65536):
+        size = min(65536, count - start)
+        noise = rng.standard_normal((size, dim), dtype=np.float32)
+        matrix[start : start + size] = normalize(
+            centers[rng.integers(0, clusters, size)] + spread * noise
+        )
+    matrix.flush()
+    del matrix
+    block = VectorBlock.open(path, [f"v{i}" for i in range(count)])
+    return NumpyVectorStore.from_blocks([block], {}, {})
+
+
+def lay_out_by_list(store: NumpyVectorStore, directory: str):
+    """Writes the vectors of `store` again ordered by list, as compactions do."""
+    node_ids = list(store.rows)
+    lists = store.lists_of(node_ids)
+    order = np.argsort(lists, kind="stable")
+    ordered = [node_ids[i] for i in order]
+    path = os.path.join(directory, "by_list.npy")
+    matrix = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.float32, shape=(len(ordered), store.dim)
+    )
+    for start in range(0, len(ordered), 65536):
+        chunk = ordered[start : start + 65536]
+        matrix[start : start + len(chunk)] = store.vectors(chunk)
+    matrix.flush()
+    del matrix
+    store.seal(path, ordered, lists[order])
+
+
+def read_vectors(storage: str) -> NumpyVectorStore:
+    import rag.lib.index
+
+    index = rag.lib.index.read_index(storage)
+    if index is None or not isinstance(index.vector_store, NumpyVectorStore):
+        raise SystemExit(f"No index with a NumpyVectorStore in {storage}")
+    return index.vector_store
+
+
+def sample_queries(
+    store: NumpyVectorStore, count: int, noise: float, seed: int
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    node_ids = list(store.rows)
+    picked = [node_ids[i] for i in rng.choice(len(node_ids), count, replace=False)]
+    vectors = store.vectors(picked)
+    scale = noise / np.sqrt(vectors.shape[1])
+    return normalize(vectors + scale * rng.standard_normal(vectors.shape))
+
+
+def measure(store: NumpyVectorStore, queries: np.ndarray, args, **kwargs) -> dict:
+    """Milliseconds per query, alone and in batches of `args.batch`."""
+    single = [
+        VectorStoreQuery(query_embedding=q.tolist(), similarity_top_k=args.k)
+        for q in queries
+    ]
+    started = time.perf_counter()
+    for query in single:
+        store.batch_query([query], **kwargs)
+    query_ms = 1000 * (time.perf_counter() - started) / len(single)
+
+    batches = [
+        single[start : start + args.batch]
+        for start in range(0, len(single), args.batch)
+    ]
+    started = time.perf_counter()
+    for batch in batches:
+        store.batch_query(batch, **kwargs)
+    batch_ms = 1000 * (time.perf_counter() - started) / len(batches)
+    return {"query_ms": query_ms, "batch_ms": batch_ms}
+
+
+def run(args) -> List[dict]:
+    with tempfile.TemporaryDirectory(prefix="retrieval-bench-") as workdir:
+        if args.storage:
+            store = read_vectors(args.storage)
+        else:
+            store = generate_vectors(
+                workdir, args.vectors, args.dim, args.clusters, args.spread, args.seed
+            )
+        queries = sample_queries(store, args.queries, args.noise, args.seed)
+        float32_mb = store.memory_usage()["float32"] / 2**20
+        results = [
+            {
+                "scenario": "exact",
+                **measure(store, queries, args, exact=True),
+                "memory_mb": float32_mb,
+                "recall": 1.0,
+            }
+        ]
+
+        for kind in args.quantization:
+            store.quantize(kind)
+            memory_mb = store.memory_usage()["scanned"] / 2**20
+            for rescore in [0, *args.rescore]:
+                results.append(
+                    {
+                        "scenario": f"{kind} rescore={rescore}",
+                        **measure(store, queries, args, rescore=rescore),
+                        "memory_mb": memory_mb,
+                        "recall": recall_at_k(store, queries, args.k, rescore=rescore),
+                    }
+                )
+        store.quantize(None)
+
+        started = time.perf_counter()
+        ivf = store.train_ivf(args.lists, seed=args.seed)
+        train_seconds = time.perf_counter() - started
+        lay_out_by_list(store, workdir)
+        print(
+            f"{len(store.rows)} vectors of {store.dim} dimensions, "
+            f"{ivf.lists} lists trained in {train_seconds:.1f} s"
+        )
+        for nprobe in args.nprobe:
+            results.append(
+                {
+                    "scenario": f"ivf nprobe={nprobe}",
+                    **measure(store, queries, args, nprobe=nprobe),
+                    "memory_mb": float32_mb,
+                    "recall": recall_at_k(store, queries, args.k, nprobe=nprobe),
+                }
+            )
+        # Drops the memory maps before the directory is removed
+        store.clear()
+        return results
+
+
+COLUMNS = [
+    ("scenario", "scenario", 18, ""),
+    ("query_ms", "query ms", 9, ".2f"),
+    ("batch_ms", "batch ms", 9, ".2f"),
+    ("memory_mb", "MB", 8, ".1f"),
+    ("recall", "recall@k", 9, ".3f"),
+]
+
+
+def print_table(results: List[dict]):
+    rows = [{key: header for key, header, _, _ in COLUMNS}, *results]
+    for row in rows:
+        cells = []
+        for key, _, width, spec in COLUMNS:
+            value = row.get(key, "-")
+            if not isinstance(value, str):
+                value = format(value, spec)
+            cells.append(
+                value.ljust(width) if key == "scenario" else value.rjust(width)
+            )
+        print(" ".join(cells))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--vectors", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument(
+        "--spread",
+        type=float,
+        default=2.0,
+        help="distance of generated vectors to their cluster center",
+    )
+    parser.add_argument(
+        "--storage", help="benchmark the vectors of the index persisted here"
+    )
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument(
+        "--noise", type=float, default=0.5, help="norm of the noise added to queries"
+    )
+    parser.add_argument("--batch", type=int, default=5, help="queries per batch")
+    parser.add_argument("-k", type=int, default=10, help="results per query")
+    parser.add_argument(
+        "--lists", type=int, help="IVF lists, the square root of the vectors by default"
+    )
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument(
+        "--quantization",
+        nargs="*",
+        default=["float16", "int8"],
+        choices=["float16", "int8"],
+    )
+    parser.add_argument(
+        "--rescore",
+        type=int,
+        nargs="+",
+        default=[4],
+        help="candidates re-scored with the float32 vectors, per result",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    print_table(results)
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
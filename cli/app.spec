@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('./.dependencies/*', './.dependencies/')],
-    hiddenimports=['tiktoken_ext.openai_public', 'tiktoken_ext'],
+    hiddenimports=['tiktoken_ext.openai_public', 'tiktoken_ext', 'tesserocr'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -10,7 +10,7 @@ import lib.agent.run as agentic_rag
 app = typer.Typer(help="A RAG-based conversational agent CLI.")
 
 
-async def async_chat_loop():
+async def async_chat_loop(watch: bool = False):
     """
     Handles the asynchronous conversation loop with the RAG agent.
     """
@@ -19,6 +19,7 @@ async def async_chat_loop():
         agentic_rag.build_index(
             input_dir="input",
             index_dir=".index",
+            watch=watch,
         )
     )
     ctx = agentic_rag.Context(agent)
@@ -53,11 +54,17 @@ async def async_chat_loop():
 # The @app.callback decorator is the standard Typer entry point.
 # It uses 'typer.run' internally to handle the async call.
 @app.command()
-def run():
+def run(
+    watch: bool = typer.Option(
+        False,
+        "--watch",
+        help="Keep indexing files added, changed or removed in the input directory.",
+    ),
+):
     """
     Main entry point for the RAG Agent CLI.
     """
-    asyncio.run(async_chat_loop())
+    asyncio.run(async_chat_loop(watch))
 
 
 main = app
@@ -19,9 +19,13 @@ from ..rag.retriever import hybrid_search_retriever
 from .flow import AgenticWorkflow
 
 
-def build_index(input_dir: str, index_dir: str) -> BaseIndex:
+def build_index(input_dir: str, index_dir: str, watch: bool = False) -> BaseIndex:
     Settings.embed_model = config.embedding
     index_manager = VectorMemoryIndexManager(index_dir)
+    if watch:
+        # Keeps ingesting new, changed and removed input files in the background
+        index_manager.watch(input_dir)
+        return index_manager.load_index()
     index = index_manager.load_index()
     if index_manager.has_data() == False:
         reader = GenericReader(input_dir)
@@ -1,3 +1,10 @@
-from .setup import add_path
+import os
+
+from .setup import add_path, dependency_path
 
 add_path("tesseract")
+
+# Lets the pooled engines (tesserocr) find the bundled language data
+tessdata = os.path.join(dependency_path("tesseract"), "tessdata")
+if os.path.isdir(tessdata):
+    os.environ.setdefault("TESSDATA_PREFIX", tessdata)
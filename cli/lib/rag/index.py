@@ -1,12 +1,25 @@
-from typing import Optional
+import logging
+import os
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Iterable, List, Optional, Sequence, Tuple
 
 from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
 from llama_index.core.base.base_query_engine import BaseQueryEngine
 from llama_index.core.indices.base import BaseIndex
+from llama_index.core.indices.utils import embed_nodes
+from llama_index.core.ingestion import run_transformations
 from llama_index.core.node_parser import SentenceSplitter, TextSplitter
+from llama_index.core.schema import Document, TransformComponent
+from llama_index.core.vector_stores.simple import (
+    SimpleVectorStore,
+    SimpleVectorStoreData,
+)
 
+from lib.rag.manifest import IngestionManifest, ManifestDiff
 from lib.rag.reader import DocumentReader
 
+logger = logging.getLogger(__name__)
+
 
 def default_splitter(
     chunk_size: int = 256,
@@ -50,6 +63,107 @@ def create_index(
     return index
 
 
+def sync_documents(
+    index: BaseIndex,
+    manifest: IngestionManifest,
+    files: Sequence[str],
+    load_files: Callable[[List[str]], Iterable[Tuple[str, List[Document]]]],
+    transformations: Optional[List[TransformComponent]] = None,
+    lock: Optional[ContextManager] = None,
+) -> ManifestDiff:
+    """
+    Applies the difference between `files` and `manifest` to `index`.
+    `load_files` yields the documents of every file it could load, files it
+    skips are tried again on the next sync.
+
+    Files are parsed and embedded outside of `lock`, which only serializes
+    the changes to `index`. Queries served from other threads meanwhile see
+    each file appear at once, see `staged_vector_store`.
+    """
+    lock = lock or nullcontext()
+    diff = manifest.diff(files)
+    with lock, staged_vector_store(index):
+        for file in diff.removed + diff.changed:
+            _delete_documents(index, manifest.remove(file)["doc_ids"])
+        if diff.added:
+            # Left over by an interrupted sync, persisted without its manifest
+            by_file = documents_by_file(index)
+            for file in diff.added:
+                _delete_documents(index, by_file.get(file, []))
+
+    if transformations is None:
+        transformations = index._transformations
+    for file, documents in load_files(diff.added + diff.changed):
+        nodes = run_transformations(documents, transformations)
+        embeddings = embed_nodes(nodes, index._embed_model)
+        for node in nodes:
+            node.embedding = embeddings[node.node_id]
+        with lock, staged_vector_store(index):
+            index.insert_nodes(nodes)
+            for document in documents:
+                index.docstore.set_document_hash(document.id_, document.hash)
+        manifest.record(
+            file,
+            [document.id_ for document in documents],
+            [node.node_id for node in nodes],
+        )
+
+    logger.info(
+        "Synced index: %d added, %d changed, %d removed, %d unchanged files",
+        len(diff.added),
+        len(diff.changed),
+        len(diff.removed),
+        len(diff.unchanged),
+    )
+    return diff
+
+
+@contextmanager
+def staged_vector_store(index: BaseIndex):
+    """
+    Applies the vector store changes made to `index` inside the block to a
+    copy of its in-memory data, swapped in on exit. Retrievers querying the
+    store from another thread keep iterating over the previous data instead
+    of failing on a dictionary changed during iteration.
+    """
+    live = index.vector_store
+    if not isinstance(live, SimpleVectorStore):
+        yield
+        return
+    staged = SimpleVectorStore(
+        data=SimpleVectorStoreData(
+            embedding_dict=dict(live.data.embedding_dict),
+            text_id_to_ref_doc_id=dict(live.data.text_id_to_ref_doc_id),
+            metadata_dict=dict(live.data.metadata_dict),
+        )
+    )
+    index._vector_store = staged
+    try:
+        yield
+        live.data = staged.data
+    finally:
+        index._vector_store = live
+
+
+def documents_by_file(index: BaseIndex) -> dict[str, List[str]]:
+    by_file: dict[str, List[str]] = {}
+    for doc_id, info in index.ref_doc_info.items():
+        file = (info.metadata or {}).get("file_path")
+        if file:
+            by_file.setdefault(file, []).append(doc_id)
+    return by_file
+
+
+def persisted_at(storage: str) -> Optional[float]:
+    docstore = os.path.join(storage, "docstore.json")
+    return os.path.getmtime(docstore) if os.path.exists(docstore) else None
+
+
+def _delete_documents(index: BaseIndex, doc_ids: Iterable[str]):
+    for doc_id in doc_ids:
+        index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+
 def index_from_engine(engine: BaseQueryEngine) -> BaseIndex:
     return engine._retriever._index
 
@@ -1,4 +1,6 @@
+import logging
 import os
+import threading
 from typing import List
 
 from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
@@ -7,6 +9,10 @@ from llama_index.core.schema import Document
 
 from ... import rag as rag
 from .. import types as t
+from ..manifest import IngestionManifest, ManifestDiff
+from ..watcher import IndexWatcher
+
+logger = logging.getLogger(__name__)
 
 
 class VectorMemoryIndexManager(t.BaseIndexManager):
@@ -15,6 +21,7 @@ class VectorMemoryIndexManager(t.BaseIndexManager):
         self._persist_dir = persist_dir
         self._splitter = rag.index.default_splitter()
         self._documents = None
+        self._sync_lock = threading.RLock()
 
     def add_document(self, document):
         super().add_document(document)
@@ -29,9 +36,48 @@ class VectorMemoryIndexManager(t.BaseIndexManager):
         os.makedirs(self._persist_dir, exist_ok=True)
         self._index = self._create_index(documents)
         self._persist(self._index)
+        manifest = IngestionManifest(self._persist_dir)
+        manifest.bootstrap(self._index)
+        manifest.save()
         self._documents = documents
         return self._index
 
+    def sync(self, input_dir: str) -> ManifestDiff:
+        """
+        Parses and embeds only the files of `input_dir` added or changed
+        since the last sync, and deletes the nodes of removed files.
+        """
+        with self._sync_lock:
+            index = self.load_index()
+            manifest = IngestionManifest(self._persist_dir)
+            if not manifest.exists():
+                manifest.bootstrap(index, rag.index.persisted_at(self._persist_dir))
+
+            diff = rag.index.sync_documents(
+                index,
+                manifest,
+                self._list_files(input_dir),
+                self._load_files,
+                [self._splitter],
+            )
+            if diff.has_changes():
+                self._persist(index)
+                self._documents = None
+            manifest.save()
+            return diff
+
+    def watch(self, input_dir: str, debounce_ms: int = 2000) -> IndexWatcher:
+        """
+        Syncs `input_dir` once, then keeps syncing it in a background thread
+        whenever files are added, changed or removed. The index returned by
+        `load_index` stays usable for queries meanwhile.
+        """
+        self.sync(input_dir)
+        watcher = IndexWatcher(
+            input_dir, lambda _: self.sync(input_dir), debounce_ms=debounce_ms
+        )
+        return watcher.start()
+
     def has_data(self) -> bool | None:
         if self._documents is None:
             return None
@@ -61,3 +107,23 @@ class VectorMemoryIndexManager(t.BaseIndexManager):
 
     def _persist(self, index: BaseIndex):
         index.storage_context.persist(self._persist_dir)
+
+    def _list_files(self, input_dir: str) -> List[str]:
+        try:
+            reader = rag.readers.GenericReader(input_dir)
+        except ValueError:
+            # Missing or empty directory
+            return []
+        return [str(file) for file in reader.input_files]
+
+    def _load_files(self, files: List[str]):
+        for file in files:
+            try:
+                documents = rag.readers.GenericReader(
+                    input_files=[file], raise_on_error=True
+                ).load_data()
+            except Exception as e:
+                # Not recorded in the manifest, tried again on the next sync
+                logger.warning("Failed to load %s: %s", file, e)
+                continue
+            yield file, documents
@@ -11,9 +11,13 @@ from PIL.ImageFile import ImageFile
 from tenacity import retry, stop_after_attempt
 
 from lib.rag.utils.ocr import ocr
+from lib.rag.utils.tesseract_pool import TesseractPool
 
 RETRY_TIMES = 3
 
+# Shared by every parser, keeps the tesseract engines loaded between files
+TESSERACT_POOL = TesseractPool()
+
 
 class PDFParser(BaseReader):
 
@@ -65,8 +69,10 @@ class PDFParser(BaseReader):
                     text = page.extract_text()
 
                     page_ocr = ""
-                    for image in self._extract_images(meta_page, pdf_meta):
-                        ocr = self._parse_image(image)
+                    images = self._extract_images(meta_page, pdf_meta)
+                    local = PDFParser._parse_images_local(images)
+                    for image, local_text in zip(images, local):
+                        ocr = self._parse_image(image, local_text)
                         page_ocr += ocr
 
                     if not page_ocr and not text:
@@ -115,8 +121,9 @@ class PDFParser(BaseReader):
             images.append(pil_image)
         return images
 
-    def _parse_image(self, image: ImageFile) -> str:
-        text = PDFParser._parse_image_local(image)
+    def _parse_image(self, image: ImageFile, text: Optional[str] = None) -> str:
+        if text is None:
+            text = PDFParser._parse_image_local(image)
         if len(text) < 10:
             return text
         else:
@@ -124,12 +131,10 @@ class PDFParser(BaseReader):
 
     @staticmethod
     def _parse_image_local(image: ImageFile) -> str:
-        try:
-            import pytesseract
-        except ImportError:
-            raise ImportError(
-                "pytesseract is required to read PDF files: `pip install pytesseract`"
-                "Also install tesseract: `https://tesseract-ocr.github.io/tessdoc/Installation.html`"
-            )
-        ocr = pytesseract.image_to_string(image, lang="eng")
-        return ocr.strip()
+        return PDFParser._parse_images_local([image])[0]
+
+    @staticmethod
+    def _parse_images_local(images: List[ImageFile]) -> List[str]:
+        # The whole batch runs on the pooled engines, no process per image
+        results = TESSERACT_POOL.recognize_batch(images)
+        return [text for text, _ in results]
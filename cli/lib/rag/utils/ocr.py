@@ -1,13 +1,10 @@
-import os
-import secrets
-import string
-from pathlib import Path
-
 from google import genai
 from PIL.ImageFile import ImageFile
 
 import config
 
+from .artifacts import ArtifactWriter
+
 IMAGE_PROMPT_TEMPLATE = """
 You are an AI assistant. You have been given an image of a document.
 Extract and summarize all meaningful information 
@@ -19,15 +16,8 @@ If the image is a graphic and not a document then skip and Return nothing.
 Don't add any markdown.
 """
 
-PIL_FORMAT_TO_MIME = {
-    "JPEG": "image/jpeg",
-    "JPG": "image/jpeg",
-    "PNG": "image/png",
-    "GIF": "image/gif",
-    "BMP": "image/bmp",
-    "TIFF": "image/tiff",
-    "WEBP": "image/webp",
-}
+# Debug copies of the ocred images and their text
+ARTIFACT_WRITER = ArtifactWriter.from_env()
 
 
 def ocr(image: ImageFile) -> str | None:
@@ -40,21 +30,5 @@ def ocr(image: ImageFile) -> str | None:
     )
 
     text = response.text
-    filepath = save_file(image, ".logs/images")
-    textpath = filepath.with_suffix(".txt")
-    with textpath.open("w", encoding="utf+8") as out:
-        out.write(text)
+    ARTIFACT_WRITER.submit(image, text)
     return text
-
-
-def save_file(image: ImageFile, save_dir: str):
-    filename = image.filename or "".join(
-        secrets.choice(string.ascii_letters + string.digits) for _ in range(6)
-    )
-    img_format = image.format or "JPEG"
-    mime = PIL_FORMAT_TO_MIME.get(img_format.upper(), PIL_FORMAT_TO_MIME["JPEG"])
-    ext = mime.split("/")[-1]
-    filepath = Path(os.path.join(save_dir, f"{filename}.{ext}"))
-    filepath.parent.mkdir(parents=True, exist_ok=True)
-    image.save(filepath, format=image.format)
-    return filepath
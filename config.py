@@ -15,7 +15,18 @@ debug_handler = RagDebugger()
 callback_manager = CallbackManager([debug_handler])
 Settings.callback_manager = callback_manager
 
-embedding = GoogleGenAIEmbedding(model_name="gemini-embedding-001")
+# Dimensions of the embeddings, gemini-embedding-001 returns 3072 by default
+# and any prefix of them is an embedding too, see rag.truncate for indexes
+# built with more
+embedding_dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+embedding = GoogleGenAIEmbedding(
+    model_name="gemini-embedding-001",
+    embedding_config=(
+        {"output_dimensionality": embedding_dimensions}
+        if embedding_dimensions
+        else None
+    ),
+)
 llm = GoogleGenAI(model="gemini-2.0-flash")
 
 vision_llm_model = "gemini-2.5-flash"
@@ -11,14 +11,14 @@ from .. import lib as rag
 from .flow import AgenticWorkflow
 
 
-def build_index(input_dir: str, index_dir: str) -> BaseIndex:
+def build_index(input_dir: str, index_dir: str, watch: bool = False) -> BaseIndex:
     Settings.embed_model = config.embedding
     index_manager = rag.indexes.VectorMemoryIndexManager(index_dir)
-    index = index_manager.load_index()
-    if index_manager.has_data() == False:
-        reader = rag.readers.GenericReader(input_dir)
-        documents = reader.read()
-        index_manager.add_documents(documents)
+    # Only new or changed input files get parsed and embedded
+    if watch:
+        index_manager.watch(input_dir)
+    else:
+        index_manager.sync(input_dir)
     index = index_manager.load_index()
     return index
 
@@ -51,7 +51,7 @@ def build_agent(index: BaseIndex):
 
 
 def setup():
-    return build_agent(build_index("data/store/indexes/test", "data/input/test"))
+    return build_agent(build_index("data/input/test", "data/store/indexes/test"))
 
 
 async def _main():
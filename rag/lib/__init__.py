@@ -7,3 +7,4 @@ import rag.lib.reader as reader
 import rag.lib.readers as readers
 import rag.lib.reranker as reranker
 import rag.lib.retriever as retriever
+import rag.lib.stores as stores
@@ -0,0 +1,241 @@
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from llama_index.core.node_parser import TextSplitter
+from llama_index.core.schema import Document
+from llama_index.core.utils import get_tokenizer
+
+from rag.lib.utils.disk_cache import DiskCache
+
+DEDUPE_FILE = "dedupe.sqlite"
+DEDUPE_THRESHOLD = 0.9
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+# Shingles hashed per step, bounds the (shingles x num_perm) matrix
+HASH_CHUNK = 4096
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SHINGLE_BASE = np.uint64(1_000_003)
+_WORD = re.compile(r"\w+")
+
+
+@dataclass
+class DedupeStats:
+    documents: int = 0
+    duplicates: int = 0
+    tokens_saved: int = 0
+    nodes_saved: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.duplicates} of {self.documents} documents were near duplicates, "
+            f"saved {self.tokens_saved} tokens and {self.nodes_saved} embedding calls"
+        )
+
+
+class DuplicateFilter:
+    """
+    Drops documents that are near duplicates of a document seen before, so
+    they are not embedded.
+
+    Documents are compared by the Jaccard similarity of their word
+    `shingle_size`-grams, estimated from `num_perm` MinHash values.
+    Candidates come from LSH band buckets, every document is only compared
+    with the few that share a bucket, never with all the others. A document
+    at least `threshold` similar to a kept one is a duplicate.
+
+    With `collapse` the kept document lists the file and page of its
+    duplicates in its `duplicates` metadata, when both are in the same
+    `filter` call. It is not embedded but the LLM sees it, so answers can
+    point to the pages that were skipped. Savings are counted in `stats`,
+    embedding calls with `splitter`.
+
+    Signatures of kept documents are saved to `store`, `seed` loads them
+    back so later batches are compared with the documents already indexed.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEDUPE_THRESHOLD,
+        num_perm: int = NUM_PERM,
+        shingle_size: int = SHINGLE_SIZE,
+        collapse: bool = True,
+        splitter: Optional[TextSplitter] = None,
+        store: Optional[DiskCache] = None,
+        seed: int = 1,
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = max(1, shingle_size)
+        self.collapse = collapse
+        self.splitter = splitter
+        self.store = store
+        self.stats = DedupeStats()
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.sources: Dict[str, Optional[str]] = {}
+        # Duplicate document id -> id of the kept document
+        self.duplicates: Dict[str, str] = {}
+        # File -> files of the kept documents its duplicates were dropped for
+        self.duplicate_of: Dict[str, Set[str]] = {}
+        self._buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(self.bands)]
+
+    @classmethod
+    def for_index(cls, persist_dir: str, **kwargs) -> "DuplicateFilter":
+        """A filter keeping its signatures next to the index storage."""
+        store = DiskCache(os.path.join(persist_dir, DEDUPE_FILE), table="minhash")
+        return cls(store=store, **kwargs)
+
+    def filter(self, documents: Sequence[Document]) -> List[Document]:
+        """Returns the documents that are not near duplicates, in order."""
+        kept: List[Document] = []
+        by_id: Dict[str, Document] = {}
+        for document in documents:
+            self.stats.documents += 1
+            signature = self.signature(document.text)
+            original = None if signature is None else self._match(signature)
+            if original is None:
+                kept.append(document)
+                by_id[document.id_] = document
+                if signature is not None:
+                    self.add(document.id_, signature, _source(document))
+                continue
+
+            self.duplicates[document.id_] = original
+            source, original_source = _source(document), self.sources[original]
+            if source and original_source and source != original_source:
+                self.duplicate_of.setdefault(source, set()).add(original_source)
+            self._count_saved(document)
+            if self.collapse and original in by_id:
+                metadata = by_id[original].metadata
+                metadata.setdefault("duplicates", []).append(_describe(document))
+                _exclude_from_embedding(by_id[original], "duplicates")
+
+        if self.store is not None:
+            self.store.set_many(
+                (doc_id, self.signatures[doc_id].tobytes())
+                for doc_id in by_id
+                if doc_id in self.signatures
+            )
+        return kept
+
+    def seed(self, doc_sources: Dict[str, str]):
+        """Loads the stored signatures of indexed documents, by id -> file."""
+        if self.store is None or not doc_sources:
+            return
+        for doc_id, value in self.store.get_many(list(doc_sources)).items():
+            signature = np.frombuffer(value, dtype=np.uint64)
+            if len(signature) == self.num_perm:
+                self.add(doc_id, signature, doc_sources[doc_id])
+
+    def forget(self, doc_ids: Iterable[str]):
+        """Drops stored signatures of documents deleted from the index."""
+        doc_ids = list(doc_ids)
+        if self.store is not None and doc_ids:
+            self.store.delete_many(doc_ids)
+
+    def add(self, doc_id: str, signature: np.ndarray, source: Optional[str] = None):
+        self.signatures[doc_id] = signature
+        self.sources[doc_id] = source
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, []).append(doc_id)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash of the word shingles of `text`, None if it has no words."""
+        hashes = self._shingle_hashes(text)
+        if not len(hashes):
+            return None
+        signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(hashes), HASH_CHUNK):
+            chunk = hashes[start : start + HASH_CHUNK, None]
+            # Universal hashing, uint64 overflow wraps like in datasketch
+            permuted = (chunk * self._a + self._b) % _MERSENNE_PRIME & _MAX_HASH
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+        return signature
+
+    def similarity(self, first: np.ndarray, second: np.ndarray) -> float:
+        """Estimated Jaccard similarity of two signatures."""
+        return float(np.count_nonzero(first == second)) / self.num_perm
+
+    def _match(self, signature: np.ndarray) -> Optional[str]:
+        candidates = dict.fromkeys(
+            doc_id
+            for band, key in enumerate(self._band_keys(signature))
+            for doc_id in self._buckets[band].get(key, ())
+        )
+        best, best_similarity = None, self.threshold
+        for doc_id in candidates:
+            similarity = self.similarity(signature, self.signatures[doc_id])
+            if similarity >= best_similarity:
+                best, best_similarity = doc_id, similarity
+        return best
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[bytes]:
+        for band in range(self.bands):
+            yield signature[band * self.rows : (band + 1) * self.rows].tobytes()
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        if not words:
+            return np.empty(0, dtype=np.uint64)
+        word_hashes = np.fromiter(
+            (zlib.crc32(word.encode()) for word in words),
+            dtype=np.uint64,
+            count=len(words),
+        )
+        # Polynomial hash of every run of `size` consecutive words
+        size = min(self.shingle_size, len(words))
+        count = len(words) - size + 1
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(size):
+            hashes = hashes * _SHINGLE_BASE + word_hashes[offset : offset + count]
+        return np.unique(hashes & _MAX_HASH)
+
+    def _count_saved(self, document: Document):
+        self.stats.duplicates += 1
+        self.stats.tokens_saved += len(get_tokenizer()(document.text))
+        if self.splitter is not None:
+            nodes = self.splitter.get_nodes_from_documents([document])
+            self.stats.nodes_saved += len(nodes)
+
+
+def lsh_params(
+    threshold: float, num_perm: int, recall: float = 0.95
+) -> Tuple[int, int]:
+    """
+    Bands and rows per band for the LSH index. Two documents share a bucket
+    with probability 1 - (1 - s^rows)^bands for a similarity s. Picks the
+    most rows per band, i.e. the fewest false candidates to verify, that
+    still make a document exactly at `threshold` a candidate with
+    probability `recall`.
+    """
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold**rows) ** bands >= recall:
+            return bands, rows
+    return num_perm, 1
+
+
+def _source(document: Document) -> Optional[str]:
+    return document.metadata.get("file_path")
+
+
+def _describe(document: Document) -> str:
+    name = document.metadata.get("file_name") or document.id_
+    page = document.metadata.get("page_label")
+    return f"{name} p.{page}" if page else name
+
+
+def _exclude_from_embedding(document: Document, key: str):
+    if key not in document.excluded_embed_metadata_keys:
+        document.excluded_embed_metadata_keys.append(key)
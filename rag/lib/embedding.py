@@ -0,0 +1,121 @@
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from rag.lib.utils.disk_cache import DiskCache
+
+EMBEDDING_CACHE_PATH = ".cache/embeddings.sqlite"
+# Dimensions of the embeddings of models without an output dimensionality
+NATIVE_DIMENSIONS = {"gemini-embedding-001": 3072}
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    An embedding model whose text embeddings are kept in a local sqlite
+    file, keyed by the model, its output dimensionality and a hash of the
+    text. Rebuilding an index embeds only the chunks never embedded before,
+    an unchanged directory makes no embedding calls at all. Queries are
+    embedded by the model every time. Use `path=":memory:"` to only reuse
+    embeddings within the current process.
+    """
+
+    embed_model: BaseEmbedding
+    _cache: DiskCache = PrivateAttr()
+
+    def __init__(
+        self, embed_model: BaseEmbedding, path: str = EMBEDDING_CACHE_PATH, **kwargs
+    ):
+        kwargs.setdefault("callback_manager", embed_model.callback_manager)
+        super().__init__(
+            embed_model=embed_model,
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+        self._cache = DiskCache(path, table="embeddings")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def key(self, text: str) -> str:
+        dimensions = output_dimensionality(self.embed_model) or "default"
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        return f"{self.embed_model.model_name}/{dimensions}/{digest}"
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self.embed_model._get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self.embed_model._aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            embeddings = self.embed_model._get_text_embeddings(list(missing.values()))
+            found.update(self._remember(list(missing), embeddings))
+        return [found[key] for key in keys]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            embeddings = await self.embed_model._aget_text_embeddings(
+                list(missing.values())
+            )
+            found.update(self._remember(list(missing), embeddings))
+        return [found[key] for key in keys]
+
+    def _lookup(self, texts: Sequence[str]):
+        """
+        The keys of `texts`, the embeddings cached for them and the texts
+        missing, by key, each once.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {
+            key: np.frombuffer(value, dtype=np.float32).tolist()
+            for key, value in self._cache.get_many(keys).items()
+        }
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        return keys, found, missing
+
+    def _remember(
+        self, keys: List[str], embeddings: List[Embedding]
+    ) -> Dict[str, Embedding]:
+        self._cache.set_many(
+            (key, np.asarray(embedding, dtype=np.float32).tobytes())
+            for key, embedding in zip(keys, embeddings)
+        )
+        return dict(zip(keys, embeddings))
+
+
+def cached_embedding(
+    embed_model: Optional[BaseEmbedding] = None, path: str = EMBEDDING_CACHE_PATH
+) -> CachedEmbedding:
+    """`embed_model`, Settings.embed_model by default, with a cache in `path`."""
+    embed_model = embed_model or Settings.embed_model
+    if isinstance(embed_model, CachedEmbedding):
+        return embed_model
+    return CachedEmbedding(embed_model, path)
+
+
+def output_dimensionality(embed_model: Any) -> Optional[int]:
+    """
+    The dimensions of the embeddings of `embed_model`: its output
+    dimensionality if configured, the native one of known models otherwise,
+    None if unknown.
+    """
+    config = getattr(embed_model, "embedding_config", None) or {}
+    if not isinstance(config, dict):
+        config = dict(config)
+    native = NATIVE_DIMENSIONS.get(getattr(embed_model, "model_name", None))
+    return config.get("output_dimensionality") or native
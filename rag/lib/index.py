@@ -1,6 +1,12 @@
-from typing import Callable, Optional
+import logging
+import os
+import shutil
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Iterable, List, Optional, Sequence, Tuple
+from llama_index.core.indices.utils import embed_nodes
+from llama_index.core.ingestion import run_transformations
 from llama_index.core.node_parser import SentenceSplitter, TextSplitter
-from llama_index.core.schema import Document
+from llama_index.core.schema import BaseNode, Document, TransformComponent
 from llama_index.core.indices.base import BaseIndex
 from llama_index.core import (
     StorageContext,
@@ -8,8 +14,27 @@ from llama_index.core import (
     load_index_from_storage,
 )
 from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.vector_stores.simple import (
+    SimpleVectorStore,
+    SimpleVectorStoreData,
+)
+from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
 
+from rag.lib.dedupe import DuplicateFilter
+from rag.lib.embedding import CachedEmbedding, cached_embedding, output_dimensionality
+from rag.lib.manifest import IngestionManifest, ManifestDiff
+from rag.lib.pipeline import StreamingIngestion
 from rag.lib.reader import DocumentReader
+from rag.lib.stores import NumpyVectorStore, SegmentedStorage
+from rag.lib.stores.segmented import SEGMENTS_DIR, SEGMENTS_MANIFEST
+
+logger = logging.getLogger(__name__)
+
+# Storage files are written here first, then moved in place once complete
+STAGING_DIR = ".staging"
+COMMIT_MARKER = "COMMITTED"
+# Vectors from which an index is searched through an IVF index
+ANN_MIN_VECTORS = 50_000
 
 
 def default_splitter(
@@ -25,35 +50,424 @@ def load_index(
     reader: DocumentReader,
     storage: str,
     splitter: Optional[TextSplitter] = None,
+    dedupe: Optional[DuplicateFilter] = None,
 ) -> BaseIndex:
-    index = read_index(storage) or create_index(reader, storage, splitter)
+    index = read_index(storage) or create_index(reader, storage, splitter, dedupe)
     return index
 
 
 def read_index(storage: str) -> BaseIndex:
     try:
+        segments = SegmentedStorage.for_dir(storage)
+        if segments.exists():
+            return _opened(segments.load())
+        recover_storage(storage)
         storage_context = StorageContext.from_defaults(persist_dir=storage)
-        return load_index_from_storage(storage_context)
+        index = load_index_from_storage(storage_context)
     except Exception as e:
         return None
+    if SegmentedStorage.supports(index):
+        # Parsed once, opened as matrices from now on
+        logger.info("Migrating %s to segments", storage)
+        try:
+            segments.save(index)
+            return _opened(segments.load())
+        except OSError:
+            logger.exception("Failed to migrate %s", storage)
+    return _opened(index)
+
+
+def _opened(index: Optional[BaseIndex]) -> Optional[BaseIndex]:
+    """
+    `index` read back, embedding nodes through the embedding cache, see
+    CachedEmbedding, and with the dimensions of its vectors.
+    """
+    if index is not None and hasattr(index, "_embed_model"):
+        index._embed_model = cached_embedding(index._embed_model)
+    return match_embedding(index)
+
+
+def match_embedding(index: Optional[BaseIndex]) -> Optional[BaseIndex]:
+    """
+    Makes `index` embed queries and nodes with the dimensions of its
+    vectors, recorded with them, when its embedding model takes an output
+    dimensionality. An index truncated by `truncate_index` then keeps
+    working with the embedding model of the config.
+    """
+    store = getattr(index, "vector_store", None)
+    dimensions = store.dim if isinstance(store, NumpyVectorStore) else None
+    embed_model = getattr(index, "_embed_model", None)
+    cached = isinstance(embed_model, CachedEmbedding)
+    model = embed_model.embed_model if cached else embed_model
+    if dimensions is None or not isinstance(model, GoogleGenAIEmbedding):
+        return index
+    if output_dimensionality(model) != dimensions:
+        config = dict(model.embedding_config or {})
+        config["output_dimensionality"] = dimensions
+        model = model.model_copy(update={"embedding_config": config})
+        if cached:
+            model = embed_model.model_copy(update={"embed_model": model})
+        index._embed_model = model
+    return index
+
+
+def truncate_index(storage: str, dimensions: int) -> BaseIndex:
+    """
+    Cuts the vectors of the index persisted in `storage` to their first
+    `dimensions`, in place and without calling the embedding API, see
+    SegmentedStorage.truncate. Its IVF index is trained again and its
+    quantized vectors written again. Queries are embedded with as many
+    dimensions once it is read back, see `match_embedding`.
+    """
+    index = read_index(storage)
+    if index is None or not isinstance(index.vector_store, NumpyVectorStore):
+        raise ValueError(f"No index with a NumpyVectorStore in {storage}")
+    store = index.vector_store
+    before, retrain = store.dim, store.ivf is not None
+    SegmentedStorage.for_dir(storage).truncate(index, dimensions)
+    logger.info(
+        "Truncated the vectors of %s from %s to %d dimensions",
+        storage,
+        before,
+        dimensions,
+    )
+    if build_ann_index(index, min_vectors=0 if retrain else ANN_MIN_VECTORS):
+        persist_index(index, storage)
+    return match_embedding(index)
+
+
+def new_index(
+    documents: Sequence[Document] = (),
+    transformations: Optional[List[TransformComponent]] = None,
+    show_progress: bool = False,
+    quantization: Optional[str] = None,
+) -> BaseIndex:
+    """
+    A VectorStoreIndex of `documents` keeping its vectors in a
+    NumpyVectorStore, scored from vectors quantized to `quantization` once
+    persisted, see `quantize_index`. Chunks embedded before, by any index,
+    are read from the embedding cache, see CachedEmbedding.
+    """
+    vector_store = NumpyVectorStore()
+    vector_store.quantize(quantization)
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    return VectorStoreIndex.from_documents(
+        list(documents),
+        storage_context=storage_context,
+        embed_model=cached_embedding(),
+        transformations=transformations,
+        show_progress=show_progress,
+    )
 
 
 def create_index(
     reader: DocumentReader,
     storage: str,
     splitter: Optional[TextSplitter] = None,
+    dedupe: Optional[DuplicateFilter] = None,
+    quantization: Optional[str] = None,
+) -> BaseIndex:
+    """
+    Builds the index of the reader directory from scratch. Files stream
+    through parsing, splitting and embedding, see StreamingIngestion, so
+    the documents of the whole directory are never in memory at once.
+    Near duplicate documents are skipped before embedding with `dedupe`,
+    vectors are searched quantized with `quantization`.
+    """
+    transformations = [splitter] if splitter else []
+    index = new_index(transformations=transformations, quantization=quantization)
+    manifest = IngestionManifest(storage)
+    # Entries of a previous build would be taken as already indexed
+    manifest.entries.clear()
+    sync_documents(
+        index,
+        manifest,
+        reader.list_files(),
+        reader.iter_files,
+        transformations,
+        dedupe=dedupe,
+    )
+    build_ann_index(index)
+    persist_index(index, storage)
+    manifest.save()
+    return index
+
+
+def sync_index(
+    reader: DocumentReader,
+    storage: str,
+    splitter: Optional[TextSplitter] = None,
+    dedupe: Optional[DuplicateFilter] = None,
 ) -> BaseIndex:
-    documents = reader.read_documents()
-    transformers = []
-    if splitter:
-        transformers.append(splitter)
-    index = VectorStoreIndex.from_documents(
-        documents, transformations=transformers, show_progress=True
+    """
+    Brings the index in `storage` up to date with the reader directory.
+    Only added or changed files are parsed and embedded, the nodes of
+    changed and removed files are deleted.
+    """
+    transformations = [splitter] if splitter else []
+    index = read_index(storage) or new_index(transformations=transformations)
+    manifest = IngestionManifest(storage)
+    if not manifest.exists():
+        manifest.bootstrap(index, built_at=persisted_at(storage))
+
+    diff = sync_documents(
+        index,
+        manifest,
+        reader.list_files(),
+        reader.iter_files,
+        transformations,
+        dedupe=dedupe,
     )
-    index.storage_context.persist(storage)
+    if diff.has_changes() or not os.path.exists(storage):
+        build_ann_index(index)
+        persist_index(index, storage)
+    manifest.save()
     return index
 
 
+def sync_documents(
+    index: BaseIndex,
+    manifest: IngestionManifest,
+    files: Sequence[str],
+    load_files: Callable[[List[str]], Iterable[Tuple[str, List[Document]]]],
+    transformations: Optional[List[TransformComponent]] = None,
+    lock: Optional[ContextManager] = None,
+    dedupe: Optional[DuplicateFilter] = None,
+) -> ManifestDiff:
+    """
+    Applies the difference between `files` and `manifest` to `index`.
+    `load_files` yields the documents of every file it could load, files it
+    skips are tried again on the next sync. With `dedupe`, documents near
+    duplicate of an indexed one or of one loaded before are skipped.
+
+    Files are parsed, split and embedded by a StreamingIngestion pipeline,
+    while the files before them are inserted. This runs outside of `lock`,
+    which only serializes the changes to `index`. Queries served from other
+    threads meanwhile see each file appear at once, see
+    `staged_vector_store`.
+    """
+    lock = lock or nullcontext()
+    diff = manifest.diff(files)
+    with lock, staged_vector_store(index):
+        for file in diff.removed + diff.changed:
+            doc_ids = manifest.remove(file)["doc_ids"]
+            _delete_documents(index, doc_ids)
+            if dedupe is not None:
+                dedupe.forget(doc_ids)
+        if diff.added:
+            # Left over by an interrupted sync, persisted without its manifest
+            by_file = documents_by_file(index)
+            for file in diff.added:
+                _delete_documents(index, by_file.get(file, []))
+
+    if dedupe is not None:
+        dedupe.seed(
+            {
+                doc_id: file
+                for file in diff.unchanged
+                for doc_id in manifest.entries[file]["doc_ids"]
+            }
+        )
+    if transformations is None:
+        transformations = index._transformations
+    pipeline = StreamingIngestion(transformations, index._embed_model, dedupe=dedupe)
+    # Ids of the parts of the current file, a streamed file comes in several
+    entry: Optional[dict] = None
+    for ingested in pipeline.run(load_files(diff.added + diff.changed)):
+        with lock, staged_vector_store(index):
+            index.insert_nodes(ingested.nodes)
+            for doc_id, doc_hash in ingested.doc_hashes.items():
+                index.docstore.set_document_hash(doc_id, doc_hash)
+        if entry is not None and entry["file"] != ingested.file:
+            manifest.record(**entry)
+            entry = None
+        if entry is None:
+            entry = dict(
+                file=ingested.file, doc_ids=[], node_ids=[], duplicate_of=set()
+            )
+        entry["doc_ids"].extend(ingested.doc_hashes)
+        entry["node_ids"].extend(node.node_id for node in ingested.nodes)
+        entry["duplicate_of"].update(ingested.duplicate_of)
+    if entry is not None:
+        manifest.record(**entry)
+
+    logger.info(
+        "Synced index: %d added, %d changed, %d removed, %d unchanged files",
+        len(diff.added),
+        len(diff.changed),
+        len(diff.removed),
+        len(diff.unchanged),
+    )
+    if dedupe is not None and dedupe.stats.duplicates:
+        logger.info("Near duplicates: %s", dedupe.stats)
+    return diff
+
+
+def insert_documents(
+    index: BaseIndex,
+    documents: Sequence[Document],
+    transformations: Optional[List[TransformComponent]] = None,
+    lock: Optional[ContextManager] = None,
+) -> List[BaseNode]:
+    """
+    Inserts `documents` into `index` in bulk. Their nodes are embedded
+    together, in batches of the embedding model, then inserted at once
+    under `lock`. Nothing is inserted if splitting or embedding fails.
+    """
+    if transformations is None:
+        transformations = index._transformations
+    nodes = run_transformations(documents, transformations, show_progress=True)
+    embeddings = embed_nodes(nodes, index._embed_model, show_progress=True)
+    for node in nodes:
+        node.embedding = embeddings[node.node_id]
+    with lock or nullcontext(), staged_vector_store(index):
+        index.insert_nodes(nodes)
+        for document in documents:
+            index.docstore.set_document_hash(document.id_, document.hash)
+    return nodes
+
+
+@contextmanager
+def staged_vector_store(index: BaseIndex):
+    """
+    Applies the vector store changes made to `index` inside the block to a
+    copy of its in-memory data, swapped in on exit. Retrievers querying the
+    store from another thread keep iterating over the previous data instead
+    of failing on a dictionary changed during iteration. A NumpyVectorStore
+    is safe to query while it changes and is used as it is.
+    """
+    live = index.vector_store
+    if not isinstance(live, SimpleVectorStore):
+        yield
+        return
+    staged = SimpleVectorStore(
+        data=SimpleVectorStoreData(
+            embedding_dict=dict(live.data.embedding_dict),
+            text_id_to_ref_doc_id=dict(live.data.text_id_to_ref_doc_id),
+            metadata_dict=dict(live.data.metadata_dict),
+        )
+    )
+    index._vector_store = staged
+    try:
+        yield
+        live.data = staged.data
+    finally:
+        index._vector_store = live
+
+
+def build_ann_index(
+    index: BaseIndex,
+    lists: Optional[int] = None,
+    min_vectors: int = ANN_MIN_VECTORS,
+    retrain: bool = False,
+) -> bool:
+    """
+    Trains an IVF index over the vectors of `index` once it holds at least
+    `min_vectors`, returns whether it did. Queries then score the vectors of
+    the `nprobe` lists nearest to them instead of all, see `rag.retriever`
+    and `benchmarks.retrieval` to pick `lists` and `nprobe`. It is persisted
+    with the index, vectors inserted later are assigned to its lists. With
+    `retrain`, an index that has one gets new centroids.
+    """
+    store = index.vector_store
+    if not isinstance(store, NumpyVectorStore):
+        return False
+    if (store.ivf is not None and not retrain) or len(store.rows) < min_vectors:
+        return False
+    ivf = store.train_ivf(lists)
+    logger.info(
+        "Trained an IVF index of %d lists on %d vectors", ivf.lists, len(store.rows)
+    )
+    return True
+
+
+def quantize_index(index: BaseIndex, quantization: Optional[str]) -> bool:
+    """
+    Searches the vectors of `index` quantized to `quantization`, "float16"
+    or "int8", or as float32 with None, returns whether it changed. The
+    best candidates of quantized scores are re-scored with the float32
+    vectors, which stay on disk, see NumpyVectorStore.quantize and
+    `benchmarks.retrieval` for the memory saved and the recall lost.
+    """
+    store = index.vector_store
+    if not isinstance(store, NumpyVectorStore) or store.quantization == quantization:
+        return False
+    store.quantize(quantization)
+    usage = store.memory_usage()
+    logger.info(
+        "Vectors quantized to %s: %.1f MB scanned instead of %.1f MB",
+        quantization or "float32",
+        usage["scanned"] / 2**20,
+        usage["float32"] / 2**20,
+    )
+    return True
+
+
+def persist_index(index: BaseIndex, storage: str):
+    """
+    Persists `index` to `storage` as a single commit.
+
+    An index with in-memory stores is saved as segments, only what changed
+    since its last persist is written, see SegmentedStorage. Json storage
+    left by earlier versions is migrated on the first persist.
+    Other indexes are persisted as json: the storage files are written to a
+    staging directory and only moved in place once all are complete, so a
+    crash leaves either the previous or the new files, see `recover_storage`.
+    """
+    if SegmentedStorage.supports(index):
+        SegmentedStorage.for_dir(storage).save(index)
+        return
+    staging = os.path.join(storage, STAGING_DIR)
+    shutil.rmtree(staging, ignore_errors=True)
+    index.storage_context.persist(staging)
+    open(os.path.join(staging, COMMIT_MARKER), "w").close()
+    _commit_staging(storage, staging)
+    # Segments would be read instead of the new files
+    shutil.rmtree(os.path.join(storage, SEGMENTS_DIR), ignore_errors=True)
+
+
+def recover_storage(storage: str):
+    """Completes a persist interrupted after it was staged, or discards it."""
+    staging = os.path.join(storage, STAGING_DIR)
+    if not os.path.isdir(staging):
+        return
+    if os.path.exists(os.path.join(staging, COMMIT_MARKER)):
+        logger.warning("Completing an interrupted persist of %s", storage)
+        _commit_staging(storage, staging)
+    else:
+        logger.warning("Discarding an incomplete persist of %s", storage)
+        shutil.rmtree(staging)
+
+
+def _commit_staging(storage: str, staging: str):
+    for name in os.listdir(staging):
+        if name != COMMIT_MARKER:
+            os.replace(os.path.join(staging, name), os.path.join(storage, name))
+    shutil.rmtree(staging)
+
+
+def documents_by_file(index: BaseIndex) -> dict[str, List[str]]:
+    by_file: dict[str, List[str]] = {}
+    for doc_id, info in index.ref_doc_info.items():
+        file = (info.metadata or {}).get("file_path")
+        if file:
+            by_file.setdefault(file, []).append(doc_id)
+    return by_file
+
+
+def persisted_at(storage: str) -> Optional[float]:
+    for name in (os.path.join(SEGMENTS_DIR, SEGMENTS_MANIFEST), "docstore.json"):
+        path = os.path.join(storage, name)
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+    return None
+
+
+def _delete_documents(index: BaseIndex, doc_ids: Iterable[str]):
+    for doc_id in doc_ids:
+        index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+
 def index_from_engine(engine: BaseQueryEngine) -> BaseIndex:
     return engine._retriever._index
 
@@ -61,9 +475,8 @@ def index_from_engine(engine: BaseQueryEngine) -> BaseIndex:
 def print_index_data(index: BaseIndex):
     print("Printing all vector data:")
     storage_context = index.storage_context
-    vector_store = storage_context.vector_store
     docstore = storage_context.docstore
-    for node_id, vector in vector_store.data.embedding_dict.items():
+    for node_id in index.index_struct.nodes_dict:
         node = docstore.get_node(node_id)
         print(f"Node ID: {node_id}")
         print(node.text)
@@ -1,63 +1,176 @@
+import logging
 import os
-from typing import List
+import threading
+from typing import List, Optional
 
-from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
 from llama_index.core.indices.base import BaseIndex
 from llama_index.core.schema import Document
 
 from ... import lib as rag
 from .. import types as t
+from ..dedupe import DuplicateFilter
+from ..manifest import IngestionManifest, ManifestDiff
+from ..watcher import IndexWatcher
+
+logger = logging.getLogger(__name__)
 
 
 class VectorMemoryIndexManager(t.BaseIndexManager):
-    def __init__(self, persist_dir: str):
+    def __init__(
+        self, persist_dir: str, dedupe: bool = False, quantization: Optional[str] = None
+    ):
+        """
+        With `dedupe`, off by default, near duplicate documents are skipped
+        before they are embedded, see DuplicateFilter. Documents are pages
+        for PDFs, so similar pages of the same or other files are skipped.
+        With `quantization`, "float16" or "int8", vectors are searched
+        quantized, see `rag.index.quantize_index`, otherwise as the
+        persisted index was.
+        """
         super().__init__()
         self._persist_dir = persist_dir
         self._splitter = rag.index.default_splitter()
-        self._documents = None
+        # Documents in the index, None while unknown
+        self._document_count: Optional[int] = None
+        self._sync_lock = threading.RLock()
+        self._dedupe = dedupe
+        self._quantization = quantization
 
     def add_document(self, document):
-        super().add_document(document)
-        self._persist(self._index)
-        if self._documents is not None:
-            self._documents.append(document)
+        with self._sync_lock:
+            super().add_document(document)
+            self._persist(self._index)
+        if self._document_count is not None:
+            self._document_count += 1
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Inserts `documents` in bulk: their nodes are embedded in batches
+        across documents and the index is persisted once. Nothing is
+        inserted if splitting or embedding fails, and a crash while
+        persisting leaves the previous storage, see `rag.index.persist_index`.
+        """
+        dedupe = self._duplicate_filter()
+        if dedupe is not None:
+            documents = dedupe.filter(documents)
+            logger.info("Near duplicates: %s", dedupe.stats)
+        if not documents:
+            return
+        with self._sync_lock:
+            index = self.load_index()
+            rag.index.insert_documents(index, documents, [self._splitter])
+            self._persist(index)
+        if self._document_count is not None:
+            self._document_count += len(documents)
 
     def create_index(self, documents: List[Document]) -> BaseIndex:
         import shutil
 
         shutil.rmtree(self._persist_dir)
         os.makedirs(self._persist_dir, exist_ok=True)
+        dedupe = self._duplicate_filter()
+        if dedupe is not None:
+            documents = dedupe.filter(documents)
+            logger.info("Near duplicates: %s", dedupe.stats)
         self._index = self._create_index(documents)
         self._persist(self._index)
-        self._documents = documents
+        manifest = IngestionManifest(self._persist_dir)
+        manifest.bootstrap(
+            self._index, duplicate_of=dedupe.duplicate_of if dedupe else None
+        )
+        manifest.save()
+        self._document_count = len(documents)
         return self._index
 
+    def sync(self, input_dir: str) -> ManifestDiff:
+        """
+        Parses and embeds only the files of `input_dir` added or changed
+        since the last sync, and deletes the nodes of removed files. Files
+        are streamed through the pipeline, see StreamingIngestion.
+        """
+        with self._sync_lock:
+            index = self.load_index()
+            manifest = IngestionManifest(self._persist_dir)
+            if not manifest.exists():
+                manifest.bootstrap(index, rag.index.persisted_at(self._persist_dir))
+
+            diff = rag.index.sync_documents(
+                index,
+                manifest,
+                self._list_files(input_dir),
+                self._load_files,
+                [self._splitter],
+                dedupe=self._duplicate_filter(),
+            )
+            if diff.has_changes():
+                self._persist(index)
+            manifest.save()
+            self._document_count = sum(
+                len(entry["doc_ids"]) for entry in manifest.entries.values()
+            )
+            return diff
+
+    def watch(self, input_dir: str, debounce_ms: int = 2000) -> IndexWatcher:
+        """
+        Syncs `input_dir` once, then keeps syncing it in a background thread
+        whenever files are added, changed or removed. The index returned by
+        `load_index` stays usable for queries meanwhile.
+        """
+        self.sync(input_dir)
+        watcher = IndexWatcher(
+            input_dir, lambda _: self.sync(input_dir), debounce_ms=debounce_ms
+        )
+        return watcher.start()
+
     def has_data(self) -> bool | None:
-        if self._documents is None:
+        if self._document_count is None:
             return None
         else:
-            return len(self._documents) > 0
+            return self._document_count > 0
 
     def _load_index(self) -> BaseIndex:
-        try:
-            storage_context = StorageContext.from_defaults(
-                persist_dir=self._persist_dir
-            )
-            return load_index_from_storage(storage_context)
-        except Exception as e:
-            self._documents = []
-            return VectorStoreIndex.from_documents(
-                self._documents,
+        index = rag.index.read_index(self._persist_dir)
+        if index is None:
+            self._document_count = 0
+            index = rag.index.new_index(
                 transformations=[self._splitter],
                 show_progress=True,
+                quantization=self._quantization,
             )
+        elif self._quantization is not None and rag.index.quantize_index(
+            index, self._quantization
+        ):
+            rag.index.persist_index(index, self._persist_dir)
+        return index
 
     def _create_index(self, documents: List[Document]) -> BaseIndex:
-        return VectorStoreIndex.from_documents(
+        return rag.index.new_index(
             documents,
             transformations=[self._splitter],
             show_progress=True,
+            quantization=self._quantization,
         )
 
     def _persist(self, index: BaseIndex):
-        index.storage_context.persist(self._persist_dir)
+        rag.index.build_ann_index(index)
+        rag.index.persist_index(index, self._persist_dir)
+
+    def _list_files(self, input_dir: str) -> List[str]:
+        try:
+            reader = rag.readers.GenericReader(input_dir)
+        except ValueError:
+            # Missing or empty directory
+            return []
+        return [str(file) for file in reader.input_files]
+
+    def _load_files(self, files: List[str]):
+        if not files:
+            return
+        reader = rag.readers.GenericReader(input_files=files)
+        for file, documents in reader.iter_files(show_progress=True):
+            yield str(file), documents
+
+    def _duplicate_filter(self) -> Optional[DuplicateFilter]:
+        if not self._dedupe:
+            return None
+        return DuplicateFilter.for_index(self._persist_dir, splitter=self._splitter)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from llama_index.core.indices.base import BaseIndex
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+
+
+@dataclass
+class ManifestDiff:
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+    def has_changes(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+class IngestionManifest:
+    """
+    Records, per ingested file, its size, mtime, content hash and the ids of
+    the documents and nodes it produced. Stored next to the index storage.
+    """
+
+    def __init__(self, persist_dir: str):
+        self.path = os.path.join(persist_dir, MANIFEST_FILE)
+        self.entries: Dict[str, dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)["files"]
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def diff(self, files: Iterable[str]) -> ManifestDiff:
+        diff = ManifestDiff()
+        files = [str(file) for file in files]
+        for file in files:
+            entry = self.entries.get(file)
+            if entry is None:
+                diff.added.append(file)
+            elif self._is_current(file, entry):
+                diff.unchanged.append(file)
+            else:
+                diff.changed.append(file)
+        current = set(files)
+        diff.removed = [file for file in self.entries if file not in current]
+
+        # Documents skipped as duplicates of these files need indexing again
+        gone = set(diff.removed + diff.changed)
+        if gone:
+            for file in list(diff.unchanged):
+                if gone.intersection(self.entries[file].get("duplicate_of", ())):
+                    diff.unchanged.remove(file)
+                    diff.changed.append(file)
+        return diff
+
+    def record(
+        self,
+        file: str,
+        doc_ids: Sequence[str],
+        node_ids: Sequence[str],
+        duplicate_of: Iterable[str] = (),
+    ):
+        """
+        `duplicate_of` lists the files whose documents replaced near
+        duplicate documents of `file`, see DuplicateFilter.
+        """
+        stat = os.stat(file)
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_digest(file),
+            "doc_ids": list(doc_ids),
+            "node_ids": list(node_ids),
+        }
+        duplicate_of = sorted(duplicate_of)
+        if duplicate_of:
+            entry["duplicate_of"] = duplicate_of
+        self.entries[str(file)] = entry
+
+    def remove(self, file: str) -> Optional[dict]:
+        return self.entries.pop(str(file), None)
+
+    def bootstrap(
+        self,
+        index: BaseIndex,
+        built_at: Optional[float] = None,
+        duplicate_of: Optional[Dict[str, Iterable[str]]] = None,
+    ):
+        """
+        Builds the entries of an index created without a manifest, from the
+        `file_path` metadata of its documents. Files modified after
+        `built_at` are left out, so the next sync ingests them again.
+        """
+        by_file: Dict[str, dict] = {}
+        for doc_id, info in index.ref_doc_info.items():
+            file = (info.metadata or {}).get("file_path")
+            if not file:
+                continue
+            entry = by_file.setdefault(file, {"doc_ids": [], "node_ids": []})
+            entry["doc_ids"].append(doc_id)
+            entry["node_ids"].extend(info.node_ids)
+
+        for file, entry in by_file.items():
+            if not os.path.exists(file):
+                # Removed since, keep the ids so the next sync deletes them
+                self.entries[file] = {**entry, "size": None, "mtime": None}
+            elif built_at is not None and os.stat(file).st_mtime > built_at:
+                self.entries[file] = {**entry, "size": None, "mtime": None}
+            else:
+                self.record(
+                    file,
+                    entry["doc_ids"],
+                    entry["node_ids"],
+                    (duplicate_of or {}).get(file, ()),
+                )
+        logger.info("Bootstrapped the ingestion manifest with %d files", len(by_file))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+    def _is_current(self, file: str, entry: dict) -> bool:
+        stat = os.stat(file)
+        if entry.get("size") != stat.st_size:
+            return False
+        if entry.get("mtime") == stat.st_mtime:
+            return True
+        # Touched but maybe not modified, compare the content
+        if entry.get("sha256") != file_digest(file):
+            return False
+        entry["mtime"] = stat.st_mtime
+        return True
+
+
+def file_digest(file: str) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,197 @@
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.indices.utils import embed_nodes
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, Document, TransformComponent
+
+from rag.lib.dedupe import DuplicateFilter
+
+# Files waiting between two stages
+STAGE_QUEUE_SIZE = 4
+# Seconds a blocked stage waits before checking whether it was stopped
+_POLL_SECONDS = 0.1
+
+
+@dataclass
+class IngestedFile:
+    """
+    A file, or a part of a streamed file, on its way through the pipeline.
+    Once split, its documents are only kept as `doc_hashes`, id -> hash,
+    their text lives on in the nodes.
+    """
+
+    file: str
+    nodes: List[BaseNode]
+    doc_hashes: Dict[str, str]
+    duplicate_of: Set[str] = field(default_factory=set)
+
+
+class StreamingIngestion:
+    """
+    Parses, splits and embeds files as a pipeline of stages, each running in
+    its own thread. The caller consumes the embedded files, inserting and
+    persisting them, while the next files are still parsed and embedded.
+
+    At most `queue_size` files wait between two stages, so the memory used
+    does not grow with the corpus. Nodes of consecutive files are embedded
+    together in batches of about `embed_batch_size`, the batch size of
+    `embed_model` by default. With `dedupe`, near duplicate documents are
+    dropped before they are split.
+    """
+
+    def __init__(
+        self,
+        transformations: List[TransformComponent],
+        embed_model: BaseEmbedding,
+        dedupe: Optional[DuplicateFilter] = None,
+        embed_batch_size: Optional[int] = None,
+        queue_size: int = STAGE_QUEUE_SIZE,
+    ):
+        self.transformations = transformations
+        self.embed_model = embed_model
+        self.dedupe = dedupe
+        self.embed_batch_size = embed_batch_size or embed_model.embed_batch_size
+        self.queue_size = queue_size
+
+    def run(
+        self, files: Iterable[Tuple[str, List[Document]]]
+    ) -> Iterator[IngestedFile]:
+        """
+        Yields the files of `files`, file -> documents, split and embedded,
+        in order. `files` is iterated in the parse stage thread.
+        """
+        return staged(files, self._split, self._embed, maxsize=self.queue_size)
+
+    def _split(
+        self, files: Iterator[Tuple[str, List[Document]]]
+    ) -> Iterator[IngestedFile]:
+        for file, documents in files:
+            if self.dedupe is not None:
+                documents = self.dedupe.filter(documents)
+            ingested = IngestedFile(
+                file=file,
+                nodes=run_transformations(documents, self.transformations),
+                doc_hashes={document.id_: document.hash for document in documents},
+                duplicate_of=(
+                    set(self.dedupe.duplicate_of.get(file, ()))
+                    if self.dedupe
+                    else set()
+                ),
+            )
+            # Release the full texts while this file waits for the embed stage
+            del documents
+            yield ingested
+
+    def _embed(self, files: Iterator[IngestedFile]) -> Iterator[IngestedFile]:
+        pending: List[IngestedFile] = []
+        count = 0
+        for ingested in files:
+            pending.append(ingested)
+            count += len(ingested.nodes)
+            if count >= self.embed_batch_size:
+                self._embed_nodes(pending)
+                yield from pending
+                pending, count = [], 0
+        if pending:
+            self._embed_nodes(pending)
+            yield from pending
+
+    def _embed_nodes(self, files: List[IngestedFile]):
+        nodes = [node for ingested in files for node in ingested.nodes]
+        embeddings = embed_nodes(nodes, self.embed_model)
+        for node in nodes:
+            node.embedding = embeddings[node.node_id]
+
+
+def staged(
+    source: Iterable,
+    *stages: Callable[[Iterator], Iterator],
+    maxsize: int = STAGE_QUEUE_SIZE,
+) -> Iterator:
+    """
+    Chains `stages`, generator functions taking the items of the stage
+    before, after `source`. The source and every stage run in their own
+    daemon thread, connected by queues of `maxsize` items, so a fast stage
+    waits for a slow one instead of buffering everything.
+
+    An error in any stage is raised to the consumer. Closing the returned
+    iterator, or an error, stops all stages after their current item.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=max(1, maxsize)) for _ in range(len(stages) + 1)]
+    threads = [
+        threading.Thread(
+            target=_pump, args=(source, queues[0], stop), name="stage-0", daemon=True
+        )
+    ]
+    for number, stage in enumerate(stages, start=1):
+        items = stage(_drain(queues[number - 1], stop))
+        threads.append(
+            threading.Thread(
+                target=_pump,
+                args=(items, queues[number], stop),
+                name=f"stage-{number}",
+                daemon=True,
+            )
+        )
+    for thread in threads:
+        thread.start()
+    return _consume(queues[-1], stop)
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+def _consume(items: queue.Queue, stop: threading.Event) -> Iterator:
+    try:
+        yield from _drain(items, stop)
+    finally:
+        stop.set()
+
+
+def _pump(items: Iterable, out: queue.Queue, stop: threading.Event):
+    iterator = iter(items)
+    try:
+        for item in iterator:
+            if not _put(out, item, stop):
+                return
+        _put(out, _DONE, stop)
+    except BaseException as e:
+        _put(out, _Failure(e), stop)
+    finally:
+        # Lets generators release their resources, e.g. worker processes
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def _put(out: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(items: queue.Queue, stop: threading.Event) -> Iterator:
+    while not stop.is_set():
+        try:
+            item = items.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
@@ -1,4 +1,4 @@
-from typing import Optional, Type
+from typing import Iterator, List, Optional, Tuple, Type
 
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.schema import Document
@@ -19,3 +19,26 @@ class DocumentReader:
             self.reader = self.reader_cls(self.directory)
         self.documents = self.reader.load_data(show_progress=True)
         return self.documents
+
+    def list_files(self) -> List[str]:
+        try:
+            reader = self.reader_cls(self.directory)
+        except ValueError:
+            # Missing or empty directory
+            return []
+        return [str(file) for file in reader.input_files]
+
+    def iter_files(self, files: List[str]) -> Iterator[Tuple[str, List[Document]]]:
+        """
+        Yields the files with their documents. Readers with an `iter_files`
+        of their own, like GenericReader, may yield a file in several parts.
+        """
+        if not files:
+            return
+        if hasattr(self.reader_cls, "iter_files"):
+            reader = self.reader_cls(input_files=files)
+            for file, documents in reader.iter_files():
+                yield str(file), documents
+            return
+        for file in files:
+            yield file, self.reader_cls(input_files=[file]).load_data()
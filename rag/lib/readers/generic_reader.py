@@ -1,17 +1,37 @@
-from typing import Dict
+import copy
+import logging
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.readers.base import BaseReader
+from llama_index.core.readers.file.base import is_default_fs
 from llama_index.core.schema import Document
+from tqdm import tqdm
 
 from .. import types as t
-from .parsers import PDFParser
+from .parsers import PDFParser, StreamingTextReader
+
+logger = logging.getLogger(__name__)
+
+# Documents per part of a streamed file
+STREAMED_PART_DOCUMENTS = 8
+# Text files from this size on are streamed, smaller ones read at once
+STREAM_MIN_BYTES = 32 << 20
 
 
 class GenericReader(t.BaseDocumentReader, SimpleDirectoryReader):
     file_extractors: Dict[str, BaseReader] = {
         ".pdf": PDFParser(),
     }
+    # Readers of the files of at least `stream_min_bytes` without an extractor
+    streamed_extractors: Dict[str, StreamingTextReader] = {
+        ".txt": StreamingTextReader(),
+        ".md": StreamingTextReader(),
+        ".log": StreamingTextReader(),
+    }
 
     def __init__(
         self,
@@ -30,8 +50,16 @@ class GenericReader(t.BaseDocumentReader, SimpleDirectoryReader):
         file_metadata=None,
         raise_on_error=False,
         fs=None,
+        num_workers: Optional[int] = None,
+        stream_min_bytes: int = STREAM_MIN_BYTES,
     ):
-        file_extractor = (file_extractor or {}) | self.file_extractors
+        """
+        With `num_workers` > 1 files are loaded by a pool of processes.
+        A file that fails to load is skipped and reported in `failures`.
+        Text files of `stream_min_bytes` or more are streamed, see
+        `iter_files`, smaller ones keep the readers of SimpleDirectoryReader.
+        """
+        file_extractor = self.file_extractors | (file_extractor or {})
         super().__init__(
             input_dir,
             input_files,
@@ -50,10 +78,168 @@ class GenericReader(t.BaseDocumentReader, SimpleDirectoryReader):
             fs,
         )
         self.documents = None
+        self.num_workers = num_workers or 1
+        self.failures: Dict[str, str] = {}
+        self.stream_min_bytes = stream_min_bytes
 
     def read(self):
-        self.documents = self.load_data(show_progress=True)
+        if self.num_workers > 1:
+            self.documents = [
+                doc for _, docs in self.iter_files(show_progress=True) for doc in docs
+            ]
+        else:
+            self.documents = self.load_data(show_progress=True)
         return self.documents
 
     def get_documents(self) -> list[Document]:
         return self.documents or self.read()
+
+    def iter_files(
+        self, show_progress: bool = False
+    ) -> Iterator[Tuple[Union[Path, PurePosixPath], List[Document]]]:
+        """
+        Yields every input file with its documents, in input order, as soon
+        as it and the files before it are loaded.
+        Text files of `stream_min_bytes` or more are read by a
+        StreamingTextReader in the calling process, and yielded in parts of
+        STREAMED_PART_DOCUMENTS documents as they are read, one after the
+        other.
+        """
+        self.failures = {}
+        files = list(self.input_files)
+        workers = min(self.num_workers, len(files))
+        progress = tqdm(
+            total=len(files),
+            desc="Loading files",
+            unit="file",
+            disable=not show_progress,
+        )
+        start = time.perf_counter()
+        try:
+            if workers <= 1:
+                results = (
+                    None if self._streams(file) else self._load_file(file)
+                    for file in files
+                )
+                yield from self._collect(files, results, progress)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = self._submit(executor, files, workers)
+                    yield from self._collect(files, results, progress)
+        finally:
+            progress.close()
+
+        elapsed = time.perf_counter() - start
+        logger.info(
+            "Loaded %d files (%d failed) in %.1fs, %.2f files/s",
+            len(files),
+            len(self.failures),
+            elapsed,
+            len(files) / elapsed if elapsed else 0,
+        )
+
+    def _submit(
+        self, executor: ProcessPoolExecutor, files: List, workers: int
+    ) -> Iterator[Optional[Tuple[List[Document], Optional[str]]]]:
+        # Keep a bounded number of files in flight, so finished documents
+        # waiting for an earlier file don't pile up. Streamed files are read
+        # by the calling process, None holds their place.
+        reader = self._for_workers(workers)
+        window = workers * 2
+        futures: List[Optional[Future]] = []
+        for i, file in enumerate(files):
+            if self._streams(file):
+                futures.append(None)
+            else:
+                futures.append(executor.submit(reader._load_file, file))
+            if i + 1 >= window:
+                future = futures.pop(0)
+                yield future and future.result()
+        for future in futures:
+            yield future and future.result()
+
+    def _collect(self, files, results, progress):
+        for file, result in zip(files, results):
+            progress.update()
+            if result is None:
+                yield from self._stream_file(file)
+                continue
+            documents, error = result
+            if error is not None:
+                self.failures[str(file)] = error
+                logger.warning("Failed to load file %s: %s", file, error)
+                if self.raise_on_error:
+                    raise RuntimeError(f"Error loading file {file}: {error}")
+                continue
+            yield file, self._exclude_metadata(documents)
+
+    def _load_file(self, file) -> Tuple[List[Document], Optional[str]]:
+        try:
+            documents = SimpleDirectoryReader.load_file(
+                input_file=file,
+                file_metadata=self.file_metadata,
+                file_extractor=self.file_extractor,
+                filename_as_id=self.filename_as_id,
+                encoding=self.encoding,
+                errors=self.errors,
+                raise_on_error=True,
+                fs=self.fs,
+            )
+        except ImportError:
+            raise
+        except Exception as e:
+            error = e.__cause__ or e
+            return [], f"{type(error).__name__}: {error}"
+        return documents, None
+
+    def _streams(self, file) -> bool:
+        suffix = Path(file).suffix.lower()
+        if suffix not in self.streamed_extractors or suffix in self.file_extractor:
+            return False
+        try:
+            return self.fs.size(str(file)) >= self.stream_min_bytes
+        except OSError:
+            return False
+
+    def _stream_file(self, file) -> Iterator[Tuple[Any, List[Document]]]:
+        reader = self.streamed_extractors[Path(file).suffix.lower()]
+        kwargs: Dict[str, Any] = {"extra_info": self.file_metadata(str(file))}
+        if self.fs and not is_default_fs(self.fs):
+            kwargs["fs"] = self.fs
+        part: List[Document] = []
+        parts = 0
+        try:
+            for i, document in enumerate(reader.lazy_load_data(file, **kwargs)):
+                if self.filename_as_id:
+                    document.id_ = f"{file!s}_part_{i}"
+                part.append(document)
+                if len(part) == STREAMED_PART_DOCUMENTS:
+                    yield file, self._exclude_metadata(part)
+                    part, parts = [], parts + 1
+        except Exception as e:
+            if parts:
+                # Its first parts are already out, it can't be skipped
+                raise
+            self.failures[str(file)] = f"{type(e).__name__}: {e}"
+            logger.warning("Failed to load file %s: %s", file, e)
+            if self.raise_on_error:
+                raise RuntimeError(f"Error loading file {file}: {e}")
+            return
+        if part or not parts:
+            yield file, self._exclude_metadata(part)
+
+    def _for_workers(self, workers: int) -> "GenericReader":
+        """
+        A copy of the reader for the worker processes, its pdf parser shares
+        the cpus and the vision budget with the other workers.
+        """
+        reader = copy.copy(self)
+        reader.file_extractor = {
+            suffix: (
+                extractor.split(workers)
+                if isinstance(extractor, PDFParser)
+                else extractor
+            )
+            for suffix, extractor in self.file_extractor.items()
+        }
+        return reader
@@ -1 +1,2 @@
 from .pdf_parser import PDFParser
+from .text_parser import StreamingTextReader
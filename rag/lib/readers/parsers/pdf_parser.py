@@ -1,7 +1,37 @@
+import copy
+import hashlib
 import io
+import json
+import logging
 import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import ChainMap, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path, PurePosixPath
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 from fsspec import AbstractFileSystem
 from llama_index.core.readers.base import BaseReader
@@ -9,12 +39,100 @@ from llama_index.core.readers.file.base import get_default_fs, is_default_fs
 from llama_index.core.schema import Document
 from PIL import Image
 from PIL.ImageFile import ImageFile
-from regex import T
-from tenacity import retry, stop_after_attempt
+from tenacity import (
+    RetryCallState,
+    Retrying,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+from rag.lib.utils.boilerplate import BoilerplateFilter, BoilerplateStats
+from rag.lib.utils.disk_cache import DiskCache
+from rag.lib.utils.ocr import OCRCache, OCRService
+from rag.lib.utils.ocr_router import SKIPPED, TESSERACT, VISION, OCRRouter, OCRStats
 
-from rag.lib.utils.ocr import ocr
+logger = logging.getLogger(__name__)
 
+# Attempts per page, waits grow exponentially up to the maximum
 RETRY_TIMES = 3
+RETRY_WAIT_SECONDS = 1
+RETRY_MAX_WAIT_SECONDS = 30
+PAGES_PER_TASK = 8
+CHECKPOINT_PATH = ".cache/pages.sqlite"
+# Pages read upfront to detect boilerplate in low memory mode
+BOILERPLATE_SAMPLE_PAGES = 64
+
+TEXT_ENGINES = ("pdfplumber", "pymupdf")
+# Vector paths on a page above which it is treated as a table/form
+LAYOUT_DRAWINGS_THRESHOLD = 20
+
+
+class PendingImage(NamedTuple):
+    """An image left for the vision model, with its ocr cache key."""
+
+    key: str
+    data: bytes
+
+
+@dataclass
+class ParseStats:
+    """
+    How a document was parsed: how its images were handled, the boilerplate
+    removed from its pages and the seconds spent per stage. Stage times are
+    summed over the worker processes, `peak_rss_mb` is the largest peak RSS
+    of the processes that parsed it.
+    """
+
+    ocr: OCRStats = field(default_factory=OCRStats)
+    boilerplate: BoilerplateStats = field(default_factory=BoilerplateStats)
+    text_seconds: float = 0.0
+    image_seconds: float = 0.0
+    tesseract_seconds: float = 0.0
+    vision_seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+
+    def merge(self, other: "ParseStats") -> "ParseStats":
+        self.ocr.merge(other.ocr)
+        self.boilerplate.lines += other.boilerplate.lines
+        self.boilerplate.chars += other.boilerplate.chars
+        self.text_seconds += other.text_seconds
+        self.image_seconds += other.image_seconds
+        self.tesseract_seconds += other.tesseract_seconds
+        self.vision_seconds += other.vision_seconds
+        # Peaks are not additive
+        self.peak_rss_mb = max(self.peak_rss_mb, other.peak_rss_mb)
+        return self
+
+
+PagePart = Union[str, PendingImage]
+# Text engine, text layer and ocr text of the images of a page
+ParsedPage = Tuple[str, str, str]
+
+
+class PageCheckpoints:
+    """
+    The pages of a file parsed so far, saved as every page range finishes,
+    so an interrupted parse resumes after the last finished range instead
+    of starting over. Dropped once the whole file is parsed.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH):
+        self._store = DiskCache(path, table="pages")
+
+    def load(self, key: str, page_count: int) -> Dict[int, ParsedPage]:
+        keys = {f"{key}:{i}": i for i in range(page_count)}
+        return {
+            keys[page_key]: tuple(json.loads(value))
+            for page_key, value in self._store.get_many(list(keys)).items()
+        }
+
+    def save(self, key: str, pages: Dict[int, ParsedPage]):
+        self._store.set_many(
+            (f"{key}:{i}", json.dumps(page)) for i, page in pages.items()
+        )
+
+    def clear(self, key: str, page_count: int):
+        self._store.delete_many(f"{key}:{i}" for i in range(page_count))
 
 
 class PDFParser(BaseReader):
@@ -22,13 +140,76 @@ class PDFParser(BaseReader):
     def __init__(
         self,
         return_full_document: Optional[bool] = False,
+        num_workers: Optional[int] = None,
+        pages_per_task: int = PAGES_PER_TASK,
+        ocr_service: Optional[OCRService] = None,
+        ocr_cache: Optional[OCRCache] = None,
+        text_engine: str = "pdfplumber",
+        ocr_router: Optional[OCRRouter] = None,
+        strip_boilerplate: bool = True,
+        boilerplate_filter: Optional[BoilerplateFilter] = None,
+        retries: int = RETRY_TIMES,
+        checkpoints: Optional[PageCheckpoints] = None,
+        low_memory: bool = False,
     ) -> None:
         """
         Initialize PDFReader.
+
+        Pages are parsed by a pool of `num_workers` processes (defaults to the
+        cpu count), `pages_per_task` consecutive pages at a time.
+        Set `num_workers=1` to parse in the calling process.
+        Images that need the vision model are sent to `ocr_service` from the
+        calling process, so its concurrency and rate limits are shared.
+        Ocr results are stored in `ocr_cache`, every distinct image is only
+        ocred once, across pages, files and runs.
+        `text_engine="pymupdf"` is the fast mode: page text comes from pymupdf
+        and pdfplumber only handles pages that look like tables or multi
+        column layouts. The engine used is kept in the `text_engine` metadata.
+        `ocr_router` decides which images are skipped, read by tesseract or
+        sent to the vision model; per file counts are kept in `stats`. The
+        engines of its tesseract pool are divided between the page workers.
+        With `strip_boilerplate`, headers, footers and other lines repeated
+        across the pages of a file are removed from their text layer by
+        `boilerplate_filter`, the removed text is counted in `stats`.
+        A page that fails to parse is tried `retries` times in all, with
+        exponential backoff, vision requests are retried by `ocr_service`.
+        Finished pages are kept in `checkpoints` until the file is done, so
+        parsing a file again after a failure resumes where it stopped.
+        `low_memory` bounds the memory used by very large files: pages are
+        released as soon as they are parsed and documents are yielded by
+        `lazy_load_data` page by page, fewer page ranges are parsed ahead,
+        and files from remote filesystems are spooled to disk. The peak RSS
+        is reported in `stats`.
         """
+        if text_engine not in TEXT_ENGINES:
+            raise ValueError(f"text_engine must be one of {TEXT_ENGINES}")
         self.return_full_document = return_full_document
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.pages_per_task = max(1, pages_per_task)
+        self.ocr_service = ocr_service or OCRService()
+        self.ocr_cache = ocr_cache or OCRCache(self.ocr_service.version)
+        self.text_engine = text_engine
+        # Every page worker runs its own engines, the pool is divided between them
+        self.ocr_router = (ocr_router or OCRRouter()).split(self.num_workers)
+        self.boilerplate_filter = (
+            (boilerplate_filter or BoilerplateFilter()) if strip_boilerplate else None
+        )
+        self.retries = max(1, retries)
+        self.checkpoints = checkpoints or PageCheckpoints()
+        self.low_memory = low_memory
+        self.stats: Dict[str, ParseStats] = {}
+
+    def split(self, parts: int) -> "PDFParser":
+        """
+        A copy for one of `parts` processes parsing files side by side, the
+        cpus and the vision budget are divided between them.
+        """
+        parser = copy.copy(self)
+        parser.num_workers = max(1, self.num_workers // parts)
+        parser.ocr_service = self.ocr_service.split(parts)
+        parser.stats = {}
+        return parser
 
-    @retry(stop=stop_after_attempt(RETRY_TIMES))
     def load_data(
         self,
         file: Union[Path, PurePosixPath],
@@ -36,102 +217,530 @@ class PDFParser(BaseReader):
         fs: Optional[AbstractFileSystem] = None,
     ) -> List[Document]:
         """Parse file."""
+        return list(self.lazy_load_data(file, extra_info, fs))
+
+    def lazy_load_data(
+        self,
+        file: Union[Path, PurePosixPath],
+        extra_info: Optional[Dict] = None,
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> Iterator[Document]:
+        """
+        Parse file, yielding its documents. With `low_memory` every page is
+        yielded as soon as its page range is parsed, otherwise once all the
+        pages are, so their boilerplate is known.
+        """
         fs = fs or get_default_fs()
         _Path = Path if is_default_fs(fs) else PurePosixPath
         if not isinstance(file, (Path, PurePosixPath)):
             file = _Path(file)
 
-        try:
-            import pdfplumber
-        except ImportError:
-            raise ImportError(
-                "pdfplumber is required to read PDF files: `pip install pdfplumber`"
-            )
-
-        try:
-            import pymupdf
-        except ImportError:
-            raise ImportError(
-                "pymupdf is required to read PDF files: `pip install pymupdf`"
+        stats = ParseStats()
+        with self._open_source(file, fs) as source:
+            pages = self._strip_boilerplate(
+                source, self._iter_pages(source, stats), stats
             )
-
-        with fs.open(str(file), "rb") as fp:
-            stream = io.BytesIO(fp.read())
-
-            pages: List[str] = []
-            with pdfplumber.open(stream) as pdf, pymupdf.open(
-                stream=stream, filetype="pdf"
-            ) as pdf_meta:
-                for i, page in enumerate(pdf.pages):
-                    meta_page = pdf_meta[min(i, len(pdf_meta))]
-                    text = page.extract_text()
-
-                    page_ocr = ""
-                    for image in self._extract_images(meta_page, pdf_meta):
-                        ocr = self._parse_image(image)
-                        page_ocr += ocr
-
-                    if not page_ocr and not text:
-                        # Either the page was empty or was unparseable
-                        # Try ocr again, with the entire page as image
-                        pix = meta_page.get_pixmap()  # default resolution
-                        image = Image.open(io.BytesIO(pix.tobytes("jpeg")))
-                        ocr = self._parse_image(image)
-                        page_ocr += ocr
-
-                    text += page_ocr
-                    pages.append(text)
-
-            docs = []
             # This block returns a whole PDF as a single Document
             if self.return_full_document:
-                metadata = {"file_name": file.name}
+                engines: List[str] = []
+                texts: List[str] = []
+                for engine, text in pages:
+                    engines.append(engine)
+                    texts.append(text)
+                metadata = {
+                    "file_name": file.name,
+                    "text_engine": ",".join(
+                        f"{engine}:{engines.count(engine)}"
+                        for engine in TEXT_ENGINES
+                        if engine in engines
+                    ),
+                }
                 if extra_info is not None:
                     metadata.update(extra_info)
 
                 # Join text extracted from each page
-                text = "\n".join(pages)
-                docs.append(Document(text=text, metadata=metadata))
+                yield self._document("\n".join(texts), metadata)
 
             # This block returns each page of a PDF as its own Document
             else:
                 # Iterate over every page
 
-                for i, page in enumerate(pages):
+                for i, (engine, page) in enumerate(pages):
                     page_label = str(i + 1)
-                    metadata = {"page_label": page_label, "file_name": file.name}
+                    metadata = {
+                        "page_label": page_label,
+                        "file_name": file.name,
+                        "text_engine": engine,
+                    }
                     if extra_info is not None:
                         metadata.update(extra_info)
 
-                    docs.append(Document(text=page, metadata=metadata))
+                    yield self._document(page, metadata)
 
-            return docs
+        stats.peak_rss_mb = max(stats.peak_rss_mb, _peak_rss_mb())
+        self.stats[file.name] = stats
+        logger.info("Parsed %s: %s", file.name, stats)
 
-    def _extract_images(self, page, document) -> List[ImageFile]:
-        images = []
-        for img in page.get_images(full=True):
-            xref = img[0]
-            base_image = document.extract_image(xref)
-            image_bytes = base_image["image"]
-            pil_image = Image.open(io.BytesIO(image_bytes))
-            images.append(pil_image)
-        return images
+    def _document(self, text: str, metadata: Dict) -> Document:
+        # Parser bookkeeping, not content
+        return Document(
+            text=text,
+            metadata=metadata,
+            excluded_embed_metadata_keys=["text_engine"],
+            excluded_llm_metadata_keys=["text_engine"],
+        )
 
-    def _parse_image(self, image: ImageFile) -> str:
-        text = PDFParser._parse_image_local(image)
-        if len(text) < 10:
-            return text
+    @contextmanager
+    def _open_source(self, file: Union[Path, PurePosixPath], fs: AbstractFileSystem):
+        """The path of the file, or its bytes if it is not on the local disk."""
+        if is_default_fs(fs):
+            # Workers open the file themselves, no need to ship its bytes
+            yield str(file)
+        elif self.low_memory:
+            # Spooled to a local copy instead of held in memory
+            with tempfile.TemporaryDirectory(prefix="pdf-") as directory:
+                path = os.path.join(directory, file.name)
+                with fs.open(str(file), "rb") as fp, open(path, "wb") as out:
+                    shutil.copyfileobj(fp, out)
+                yield path
         else:
-            return ocr(image) or ""
+            with fs.open(str(file), "rb") as fp:
+                yield fp.read()
 
-    @staticmethod
-    def _parse_image_local(image: ImageFile) -> str:
-        try:
-            import pytesseract
-        except ImportError:
-            raise ImportError(
-                "pytesseract is required to read PDF files: `pip install pytesseract`"
-                "Also install tesseract: `https://tesseract-ocr.github.io/tessdoc/Installation.html`"
+    def _strip_boilerplate(
+        self,
+        source: Union[str, bytes],
+        pages: Iterator[ParsedPage],
+        stats: ParseStats,
+    ) -> Iterator[Tuple[str, str]]:
+        """
+        Yields the text engine and the text of every page, without
+        boilerplate. With `low_memory` the boilerplate is detected on a
+        sample of the pages read upfront, so pages pass through one by one.
+        """
+        if self.boilerplate_filter is None:
+            for engine, text, image_text in pages:
+                yield engine, text + image_text
+            return
+
+        if self.low_memory:
+            boilerplate = self.boilerplate_filter.detect(_sample_texts(self, source))
+        else:
+            pages = list(pages)
+            boilerplate = self.boilerplate_filter.detect([text for _, text, _ in pages])
+        for engine, text, image_text in pages:
+            text = self.boilerplate_filter.remove(text, boilerplate, stats.boilerplate)
+            yield engine, text + image_text
+
+    def _iter_pages(
+        self, source: Union[str, bytes], stats: ParseStats
+    ) -> Iterator[ParsedPage]:
+        """
+        Yields the text engine used, the text layer and the ocr text of the
+        images of every page, in page order, as their page ranges finish.
+        """
+        pymupdf = _import_pymupdf()
+        with _open_pymupdf(pymupdf, source) as pdf_meta:
+            page_count = len(pdf_meta)
+
+        key = self._checkpoint_key(source)
+        done = self.checkpoints.load(key, page_count)
+        if done:
+            logger.info("Resuming after %d checkpointed pages", len(done))
+        missing = [i for i in range(page_count) if i not in done]
+
+        next_page = 0
+        for start, chunk, chunk_stats in self._parse_ranges(
+            source, _page_ranges(missing, self.pages_per_task)
+        ):
+            resolved = self._resolve_ocr(chunk, stats.merge(chunk_stats))
+            finished = dict(zip(range(start, start + len(resolved)), resolved))
+            self.checkpoints.save(key, finished)
+            done.update(finished)
+            while next_page in done:
+                yield done.pop(next_page)
+                next_page += 1
+        while next_page in done:
+            yield done.pop(next_page)
+            next_page += 1
+        self.checkpoints.clear(key, page_count)
+
+    def _parse_ranges(
+        self, source: Union[str, bytes], ranges: List[Tuple[int, int]]
+    ) -> Iterator[Tuple[int, List[Tuple[str, List[PagePart]]], ParseStats]]:
+        """Parses the page ranges, yielding them in order with their start."""
+        workers = min(self.num_workers, len(ranges))
+        if workers <= 1:
+            for start, stop in ranges:
+                yield (start, *_parse_page_range(self, source, start, stop))
+            return
+
+        # Workers keep parsing while the vision requests of a finished range
+        # are in flight, a bounded number of ranges ahead
+        ahead = workers if self.low_memory else 2 * workers
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures: Deque[Tuple[int, Future]] = deque()
+            for start, stop in ranges:
+                futures.append(
+                    (
+                        start,
+                        executor.submit(_parse_page_range, self, source, start, stop),
+                    )
+                )
+                if len(futures) >= ahead:
+                    start, future = futures.popleft()
+                    yield (start, *future.result())
+            while futures:
+                start, future = futures.popleft()
+                yield (start, *future.result())
+
+    def _checkpoint_key(self, source: Union[str, bytes]) -> str:
+        """Content hash of the file and the settings its pages depend on."""
+        settings = (self.text_engine, self.ocr_service.version, self.ocr_router.version)
+        digest = hashlib.sha256(":".join(settings).encode())
+        if isinstance(source, bytes):
+            digest.update(source)
+        else:
+            with open(source, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _retrying(self, page: int) -> Retrying:
+        def log_retry(state: RetryCallState):
+            logger.warning(
+                "Page %d failed on attempt %d, retrying in %.1fs: %s",
+                page + 1,
+                state.attempt_number,
+                state.upcoming_sleep,
+                state.outcome.exception(),
+            )
+
+        return Retrying(
+            stop=stop_after_attempt(self.retries),
+            wait=wait_exponential_jitter(RETRY_WAIT_SECONDS, RETRY_MAX_WAIT_SECONDS),
+            before_sleep=log_retry,
+            reraise=True,
+        )
+
+    def _resolve_ocr(
+        self, pages: List[Tuple[str, List[PagePart]]], stats: ParseStats
+    ) -> List[ParsedPage]:
+        """Replaces images left for the vision model by their ocr text."""
+        pending = {
+            part.key: part.data
+            for _, parts in pages
+            for part in parts
+            if isinstance(part, PendingImage)
+        }
+        # Another worker may already have resolved the same image
+        texts = self.ocr_cache.get_many(list(pending))
+        missing = [key for key in pending if key not in texts]
+        started = time.perf_counter()
+        results = self.ocr_service.ocr(
+            [Image.open(io.BytesIO(pending[key])) for key in missing]
+        )
+        stats.vision_seconds += time.perf_counter() - started
+        resolved = {key: text or "" for key, text in zip(missing, results)}
+        self.ocr_cache.set_many(resolved.items())
+        texts.update(resolved)
+
+        stats.ocr.cached += len(pending) - len(missing)
+        stats.ocr.vision += len(missing)
+        stats.ocr.upload_bytes += sum(len(pending[key]) for key in missing)
+        return [
+            (
+                engine,
+                parts[0],
+                "".join(
+                    part if isinstance(part, str) else texts[part.key]
+                    for part in parts[1:]
+                ),
             )
-        ocr = pytesseract.image_to_string(image, lang="eng")
-        return ocr.strip()
+            for engine, parts in pages
+        ]
+
+    def _parse_page(
+        self,
+        text: str,
+        meta_page,
+        pdf_meta,
+        stats: ParseStats,
+        seen: Optional[MutableMapping[int, PagePart]] = None,
+    ) -> List[PagePart]:
+        """
+        Returns the page text followed by one entry per image: its ocr text,
+        or a PendingImage if it is left for the vision model.
+        Images are parsed once per xref, `seen` carries them across pages.
+        """
+        seen = {} if seen is None else seen
+        started = time.perf_counter()
+        xrefs = []
+        new_images: Dict[int, bytes] = {}
+        for xref, _, width, height, *_ in meta_page.get_images(full=True):
+            xrefs.append(xref)
+            if xref in seen or xref in new_images:
+                continue
+            if not self.ocr_router.keep(width, height):
+                stats.ocr.skipped += 1
+                seen[xref] = ""
+            else:
+                new_images[xref] = pdf_meta.extract_image(xref)["image"]
+        stats.image_seconds += time.perf_counter() - started
+        # The page images go to the tesseract pool as one batch
+        parsed = self._parse_images(list(new_images.values()), stats)
+        seen.update(zip(new_images, parsed))
+
+        parts: List[PagePart] = [text, *(seen[xref] for xref in xrefs)]
+        if not text and not any(parts[1:]):
+            # Either the page was empty or was unparseable
+            # Try ocr again, with the entire page as image
+            started = time.perf_counter()
+            pix = meta_page.get_pixmap()  # default resolution
+            page_image = pix.tobytes("jpeg")
+            stats.image_seconds += time.perf_counter() - started
+            parts.extend(self._parse_images([page_image], stats))
+
+        return parts
+
+    def _page_engine(self, meta_page) -> str:
+        if self.text_engine == "pdfplumber" or self._needs_layout(meta_page):
+            return "pdfplumber"
+        return "pymupdf"
+
+    def _needs_layout(self, meta_page) -> bool:
+        """Tables and multi column pages read better through pdfplumber."""
+        if len(meta_page.get_drawings()) >= LAYOUT_DRAWINGS_THRESHOLD:
+            return True
+
+        middle = meta_page.rect.width / 2
+        left = right = 0
+        for block in meta_page.get_text("blocks"):
+            x0, _, x1, _, _, _, block_type = block
+            if block_type != 0:
+                continue
+            if x1 < middle:
+                left += 1
+            elif x0 > middle:
+                right += 1
+        return left >= 2 and right >= 2
+
+    def _parse_images(self, images: List[bytes], stats: ParseStats) -> List[PagePart]:
+        """
+        The ocr text of every image, or a PendingImage for the vision model.
+        The route the router took for an image is cached under its settings,
+        and the text under the engine that read it, so neither is reused
+        once the router, tesseract or the vision model changes.
+        """
+        router, cache = self.ocr_router, self.ocr_cache
+        routes = [cache.key(image_bytes, router.version) for image_bytes in images]
+        tesseract = [
+            cache.key(image_bytes, router.tesseract_pool.version)
+            for image_bytes in images
+        ]
+        vision = [cache.key(image_bytes) for image_bytes in images]
+        cached = cache.get_many(routes + tesseract + vision)
+
+        started = time.perf_counter()
+        parts: List[Optional[PagePart]] = [None] * len(images)
+        todo = []
+        for i, image_bytes in enumerate(images):
+            route = cached.get(routes[i])
+            if route == SKIPPED:
+                stats.ocr.cached += 1
+                parts[i] = ""
+            elif route == TESSERACT and tesseract[i] in cached:
+                stats.ocr.cached += 1
+                parts[i] = cached[tesseract[i]]
+            elif route == VISION and vision[i] in cached:
+                stats.ocr.cached += 1
+                parts[i] = cached[vision[i]]
+            elif route == VISION:
+                # Counted once resolved, another page may resolve it first
+                parts[i] = PendingImage(vision[i], router.prepare_upload(image_bytes))
+            elif router.is_blank(image_bytes):
+                stats.ocr.skipped += 1
+                parts[i] = ""
+                cache.set(routes[i], SKIPPED)
+            else:
+                todo.append(i)
+        stats.image_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        decisions = router.route_batch(
+            [Image.open(io.BytesIO(images[i])) for i in todo]
+        )
+        stats.tesseract_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        results = []
+        for i, (route, text) in zip(todo, decisions):
+            results.append((routes[i], route))
+            if route == TESSERACT:
+                stats.ocr.tesseract += 1
+                parts[i] = text
+                results.append((tesseract[i], text))
+            else:
+                # Counted as a vision call once resolved, it may be a duplicate
+                parts[i] = PendingImage(vision[i], router.prepare_upload(images[i]))
+        cache.set_many(results)
+        stats.image_seconds += time.perf_counter() - started
+        return parts
+
+
+def _parse_page_range(
+    parser: PDFParser,
+    source: Union[str, bytes],
+    start: int,
+    stop: int,
+) -> Tuple[List[Tuple[str, List[PagePart]]], ParseStats]:
+    """Parse pages [start, stop). Runs inside the worker processes."""
+    pymupdf = _import_pymupdf()
+    pages: List[Tuple[str, List[PagePart]]] = []
+    seen: Dict[int, PagePart] = {}
+    stats = ParseStats()
+    plumber = _PlumberPages(source, range(start, stop))
+    try:
+        with _open_pymupdf(pymupdf, source) as pdf_meta:
+            for i in range(start, stop):
+                meta_page = pdf_meta[min(i, len(pdf_meta) - 1)]
+                # A failing page is tried again alone, not its whole range.
+                # Its stats and images are kept once an attempt succeeds.
+                for attempt in parser._retrying(i):
+                    with attempt:
+                        page_stats, page_seen = ParseStats(), ChainMap({}, seen)
+                        page = _parse_one_page(
+                            parser,
+                            plumber,
+                            i,
+                            meta_page,
+                            pdf_meta,
+                            page_stats,
+                            page_seen,
+                        )
+                stats.merge(page_stats)
+                seen.update(page_seen.maps[0])
+                pages.append(page)
+                if parser.low_memory:
+                    # Drop the fonts and images mupdf keeps for later pages
+                    pymupdf.TOOLS.store_shrink(100)
+    finally:
+        plumber.close()
+    stats.peak_rss_mb = _peak_rss_mb()
+    return pages, stats
+
+
+def _parse_one_page(
+    parser: PDFParser,
+    plumber: "_PlumberPages",
+    i: int,
+    meta_page,
+    pdf_meta,
+    stats: ParseStats,
+    seen: MutableMapping[int, PagePart],
+) -> Tuple[str, List[PagePart]]:
+    started = time.perf_counter()
+    engine, text = _page_text(parser, plumber, i, meta_page)
+    stats.text_seconds += time.perf_counter() - started
+    parts = parser._parse_page(text, meta_page, pdf_meta, stats, seen)
+    if engine == "pdfplumber":
+        # Its layout objects are not needed again, unless the page is retried
+        plumber[i].close()
+    return engine, parts
+
+
+def _page_text(
+    parser: PDFParser, plumber: "_PlumberPages", i: int, meta_page
+) -> Tuple[str, str]:
+    """The text engine of page `i` and the text layer it reads."""
+    engine = parser._page_engine(meta_page)
+    if engine == "pdfplumber":
+        return engine, plumber[i].extract_text()
+    return engine, meta_page.get_text()
+
+
+def _page_ranges(pages: List[int], size: int) -> List[Tuple[int, int]]:
+    """Splits the sorted page numbers into runs of at most `size` pages."""
+    ranges: List[Tuple[int, int]] = []
+    for page in pages:
+        if ranges and ranges[-1][1] == page and page - ranges[-1][0] < size:
+            ranges[-1] = (ranges[-1][0], page + 1)
+        else:
+            ranges.append((page, page + 1))
+    return ranges
+
+
+class _PlumberPages:
+    """
+    The `pages` of the document, by number, opened with pdfplumber on first
+    access. Only these pages are loaded, not the page objects of all.
+    """
+
+    def __init__(self, source: Union[str, bytes], pages: Sequence[int]):
+        self.source = source
+        self.pages = pages
+        self._positions = {page: position for position, page in enumerate(pages)}
+        self._pdf = None
+
+    def __getitem__(self, i: int):
+        if self._pdf is None:
+            try:
+                import pdfplumber
+            except ImportError:
+                raise ImportError(
+                    "pdfplumber is required to read PDF files: `pip install pdfplumber`"
+                )
+
+            source = self.source
+            stream = source if isinstance(source, str) else io.BytesIO(source)
+            self._pdf = pdfplumber.open(stream, pages=[page + 1 for page in self.pages])
+        return self._pdf.pages[self._positions[i]]
+
+    def close(self):
+        if self._pdf is not None:
+            self._pdf.close()
+
+
+def _sample_texts(parser: PDFParser, source: Union[str, bytes]) -> List[str]:
+    """
+    Text layer of up to BOILERPLATE_SAMPLE_PAGES pages, spread evenly, read
+    by the engine that parses them, so the lines match those removed.
+    """
+    pymupdf = _import_pymupdf()
+    with _open_pymupdf(pymupdf, source) as pdf_meta:
+        count = len(pdf_meta)
+        sample = min(count, BOILERPLATE_SAMPLE_PAGES)
+        pages = sorted({i * count // sample for i in range(sample)})
+        plumber = _PlumberPages(source, pages)
+        try:
+            texts = []
+            for i in pages:
+                engine, text = _page_text(parser, plumber, i, pdf_meta[i])
+                if engine == "pdfplumber":
+                    plumber[i].close()
+                texts.append(text)
+            return texts
+        finally:
+            plumber.close()
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    scale = 1 if sys.platform == "darwin" else 1024  # bytes on macOS, else KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def _import_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        raise ImportError(
+            "pymupdf is required to read PDF files: `pip install pymupdf`"
+        )
+    return pymupdf
+
+
+def _open_pymupdf(pymupdf, source: Union[str, bytes]):
+    if isinstance(source, str):
+        return pymupdf.open(source)
+    return pymupdf.open(stream=source, filetype="pdf")
@@ -0,0 +1,112 @@
+import re
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, List, Optional, Union
+
+from fsspec import AbstractFileSystem
+from llama_index.core.readers.base import BaseReader
+from llama_index.core.readers.file.base import get_default_fs
+from llama_index.core.schema import Document
+
+WINDOW_BYTES = 1 << 20
+
+# End of a sentence or of a paragraph. Bytes below 0x80 never occur inside a
+# multibyte utf-8 character, so matching on the raw bytes is safe.
+_SENTENCE_END = re.compile(rb"[.!?][\"')\]]*\s+|\n\s*\n")
+_LINE_END = re.compile(rb"\n")
+_SPACE = re.compile(rb"\s")
+
+
+class StreamingTextReader(BaseReader):
+    """
+    Reads plain text and markdown files a window of `window_bytes` at a
+    time, so files of any size are read with bounded memory.
+
+    Every window is cut after its last sentence, the rest is carried over to
+    the next window; without a sentence end it is cut at the last line end
+    or space. Every cut is one Document, yielded by `lazy_load_data` as soon
+    as it is read, with its position in the file in the `byte_start` and
+    `byte_end` metadata. `encoding` must be ascii compatible, e.g. utf-8.
+    """
+
+    def __init__(
+        self,
+        window_bytes: int = WINDOW_BYTES,
+        encoding: str = "utf-8",
+        errors: str = "replace",
+    ):
+        self.window_bytes = max(1024, window_bytes)
+        self.encoding = encoding
+        self.errors = errors
+
+    def load_data(
+        self,
+        file: Union[Path, PurePosixPath],
+        extra_info: Optional[Dict] = None,
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> List[Document]:
+        return list(self.lazy_load_data(file, extra_info, fs))
+
+    def lazy_load_data(
+        self,
+        file: Union[Path, PurePosixPath],
+        extra_info: Optional[Dict] = None,
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> Iterator[Document]:
+        fs = fs or get_default_fs()
+        buffer = b""
+        offset = 0
+        with fs.open(str(file), "rb") as f:
+            while True:
+                block = f.read(self.window_bytes)
+                buffer += block
+                at_end = not block
+                # Cut while more than a window is buffered, at the end the rest
+                while buffer and (at_end or len(buffer) > self.window_bytes):
+                    if len(buffer) > self.window_bytes:
+                        cut = self._cut(buffer)
+                    else:
+                        cut = len(buffer)
+                    document = self._document(buffer[:cut], offset, extra_info)
+                    if document is not None:
+                        yield document
+                    buffer = buffer[cut:]
+                    offset += cut
+                if at_end:
+                    return
+
+    def _cut(self, buffer: bytes) -> int:
+        """Length of the part of the first window to emit."""
+        window = buffer[: self.window_bytes]
+        for pattern in (_SENTENCE_END, _LINE_END, _SPACE):
+            end = _last_match_end(pattern, window)
+            if end:
+                return end
+        # One long word, cut it between two characters
+        cut = self.window_bytes
+        while cut > 0 and buffer[cut] & 0xC0 == 0x80:
+            cut -= 1
+        return cut or self.window_bytes
+
+    def _document(
+        self, data: bytes, offset: int, extra_info: Optional[Dict]
+    ) -> Optional[Document]:
+        text = data.decode(self.encoding, errors=self.errors)
+        if not text.strip():
+            return None
+        metadata = {**(extra_info or {})}
+        metadata.update(byte_start=offset, byte_end=offset + len(data))
+        # Reader bookkeeping, not content
+        return Document(
+            text=text,
+            metadata=metadata,
+            excluded_embed_metadata_keys=["byte_start", "byte_end"],
+            excluded_llm_metadata_keys=["byte_start", "byte_end"],
+        )
+
+
+def _last_match_end(pattern: re.Pattern, data: bytes) -> int:
+    """End of the last match of `pattern` in the second half of `data`."""
+    end = 0
+    for match in pattern.finditer(data, len(data) // 2):
+        end = match.end()
+    return end
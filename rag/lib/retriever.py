@@ -1,9 +1,30 @@
+import asyncio
+from typing import Dict, List, Optional, Sequence, Tuple
+
 from llama_index.retrievers.bm25 import BM25Retriever
+from llama_index.core.async_utils import asyncio_run
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.instrumentation.events.retrieval import (
+    RetrievalEndEvent,
+    RetrievalStartEvent,
+)
 from llama_index.core.retrievers import QueryFusionRetriever, VectorIndexRetriever
 from llama_index.core.retrievers.fusion_retriever import FUSION_MODES
 from llama_index.core.indices.base import BaseIndex
+from llama_index.core.instrumentation import get_dispatcher
 from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.llms.llm import LLM
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import (
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+from rag.lib.stores import NumpyVectorStore
+
+dispatcher = get_dispatcher(__name__)
+
+Results = Dict[Tuple[str, int], List[NodeWithScore]]
 
 
 def hybrid_search_retriever(
@@ -11,12 +32,13 @@ def hybrid_search_retriever(
     top_k: int = 2,
     llm: LLM = None,
     queries: int = 4,
+    nprobe: Optional[int] = None,
 ) -> BaseRetriever:
-    main_retriever = default_retriever(index, top_k)
+    main_retriever = default_retriever(index, top_k, nprobe)
     bm25_retriever = BM25Retriever.from_defaults(
         docstore=index.docstore, similarity_top_k=top_k
     )
-    retriever = QueryFusionRetriever(
+    retriever = BatchedFusionRetriever(
         [main_retriever, bm25_retriever],
         llm=llm,
         similarity_top_k=top_k,
@@ -28,14 +50,166 @@ def hybrid_search_retriever(
     return retriever
 
 
-def default_retriever(index: BaseIndex, top_k: int = 2) -> BaseRetriever:
-    return index.as_retriever(similarity_top_k=top_k)
+def default_retriever(
+    index: BaseIndex, top_k: int = 2, nprobe: Optional[int] = None
+) -> BaseRetriever:
+    """
+    `nprobe` is the number of lists searched when the index has an IVF
+    index, see `rag.index.build_ann_index`: more is slower and finds more
+    of the exact top k.
+    """
+    return index.as_retriever(
+        similarity_top_k=top_k, vector_store_kwargs=_store_kwargs(nprobe)
+    )
 
 
-def vector_retriever(index: BaseIndex, top_k: int = 2, alpha: int = 1) -> BaseRetriever:
+def vector_retriever(
+    index: BaseIndex, top_k: int = 2, alpha: int = 1, nprobe: Optional[int] = None
+) -> BaseRetriever:
     return VectorIndexRetriever(
         index=index,
         similarity_top_k=top_k,
         alpha=alpha,
         node_ids=list(index.index_struct.nodes_dict.values()),
+        vector_store_kwargs=_store_kwargs(nprobe),
+    )
+
+
+def _store_kwargs(nprobe: Optional[int]) -> dict:
+    return {} if nprobe is None else {"nprobe": nprobe}
+
+
+class BatchedFusionRetriever(QueryFusionRetriever):
+    """
+    QueryFusionRetriever searching a vector index on a NumpyVectorStore
+    once for the original and all generated queries, with
+    `NumpyVectorStore.batch_query`, instead of once per query. The queries
+    are embedded concurrently and every query still reports its retrieve
+    events, as `retrieve` does. Other retrievers, e.g. BM25, still
+    run once per query.
+    """
+
+    def _run_sync_queries(self, queries: List[QueryBundle]) -> Results:
+        found = []
+        for retriever in self._retrievers:
+            if _batchable(retriever):
+                embeddings = _embeddings(retriever, queries)
+                found.append(_batch_retrieve(retriever, queries, embeddings))
+            else:
+                found.append([retriever.retrieve(query) for query in queries])
+        return _by_query(queries, found)
+
+    async def _run_async_queries(self, queries: List[QueryBundle]) -> Results:
+        tasks = []
+        for retriever in self._retrievers:
+            if _batchable(retriever):
+                tasks.append(_abatch_retrieve(retriever, queries))
+            else:
+                tasks.append(
+                    asyncio.gather(*(retriever.aretrieve(query) for query in queries))
+                )
+        return _by_query(queries, await asyncio.gather(*tasks))
+
+    def _run_nested_async_queries(self, queries: List[QueryBundle]) -> Results:
+        return asyncio_run(self._run_async_queries(queries))
+
+
+def _batchable(retriever: BaseRetriever) -> bool:
+    return (
+        isinstance(retriever, VectorIndexRetriever)
+        and isinstance(retriever._vector_store, NumpyVectorStore)
+        and retriever._vector_store_query_mode == VectorStoreQueryMode.DEFAULT
     )
+
+
+def _embeddings(
+    retriever: VectorIndexRetriever, queries: Sequence[QueryBundle]
+) -> List[List[float]]:
+    return asyncio_run(_aembeddings(retriever, queries))
+
+
+async def _aembeddings(
+    retriever: VectorIndexRetriever, queries: Sequence[QueryBundle]
+) -> List[List[float]]:
+    """
+    The embeddings of `queries`, the missing ones embedded concurrently as
+    queries, never cached with the chunks, see CachedEmbedding.
+    """
+
+    async def embedding(query: QueryBundle) -> List[float]:
+        if query.embedding is not None:
+            return query.embedding
+        return await retriever._embed_model.aget_agg_embedding_from_queries(
+            query.embedding_strs
+        )
+
+    return list(await asyncio.gather(*(embedding(query) for query in queries)))
+
+
+async def _abatch_retrieve(
+    retriever: VectorIndexRetriever, queries: List[QueryBundle]
+) -> List[List[NodeWithScore]]:
+    embeddings = await _aembeddings(retriever, queries)
+    return _batch_retrieve(retriever, queries, embeddings)
+
+
+def _batch_retrieve(
+    retriever: VectorIndexRetriever,
+    queries: Sequence[QueryBundle],
+    embeddings: Sequence[List[float]],
+) -> List[List[NodeWithScore]]:
+    store_queries = [
+        retriever._build_vector_store_query(
+            QueryBundle(query_str=query.query_str, embedding=embedding)
+        )
+        for query, embedding in zip(queries, embeddings)
+    ]
+    results = retriever._vector_store.batch_query(store_queries, **retriever._kwargs)
+    found = []
+    for query, result in zip(queries, results):
+        nodes = _scored_nodes(retriever, result)
+        found.append(retriever._handle_recursive_retrieval(query, nodes))
+    _report(retriever, queries, found)
+    return found
+
+
+def _report(
+    retriever: BaseRetriever,
+    queries: Sequence[QueryBundle],
+    found: Sequence[List[NodeWithScore]],
+):
+    """
+    The events `retrieve` sends for every query, e.g. for RagDebugger, once
+    the batch is done.
+    """
+    manager = retriever.callback_manager
+    for query, nodes in zip(queries, found):
+        dispatcher.event(RetrievalStartEvent(str_or_query_bundle=query))
+        with manager.as_trace("query"):
+            with manager.event(
+                CBEventType.RETRIEVE, payload={EventPayload.QUERY_STR: query.query_str}
+            ) as retrieve_event:
+                retrieve_event.on_end(payload={EventPayload.NODES: nodes})
+        dispatcher.event(RetrievalEndEvent(str_or_query_bundle=query, nodes=nodes))
+
+
+def _scored_nodes(
+    retriever: VectorIndexRetriever, result: VectorStoreQueryResult
+) -> List[NodeWithScore]:
+    """The nodes of `result`, as VectorIndexRetriever returns them."""
+    node_ids = retriever._determine_nodes_to_fetch(result)
+    if node_ids:
+        nodes = retriever._docstore.get_nodes(node_ids=node_ids, raise_error=False)
+        result.nodes = retriever._insert_fetched_nodes_into_query_result(result, nodes)
+    return retriever._convert_nodes_to_scored_nodes(result)
+
+
+def _by_query(
+    queries: Sequence[QueryBundle], found: Sequence[Sequence[List[NodeWithScore]]]
+) -> Results:
+    """(query, retriever number) -> nodes, from the nodes of every retriever."""
+    return {
+        (query.query_str, number): nodes
+        for number, per_query in enumerate(found)
+        for query, nodes in zip(queries, per_query)
+    }
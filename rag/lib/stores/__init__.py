@@ -0,0 +1,4 @@
+from .ivf import IVFIndex, recall_at_k
+from .numpy_store import NumpyVectorStore
+from .quantize import QuantizedVectors
+from .segmented import SegmentedStorage
@@ -0,0 +1,148 @@
+import os
+import uuid
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+# Lists probed by a query when none is given
+DEFAULT_NPROBE = 16
+# Vectors the centroids are trained on, per list and at most
+TRAIN_SAMPLES_PER_LIST = 32
+TRAIN_MAX_SAMPLES = 32768
+TRAIN_ITERATIONS = 10
+# Vectors assigned to their list at once
+ASSIGN_CHUNK_ROWS = 4096
+
+
+class IVFIndex:
+    """
+    Inverted file index: coarse centroids, trained with k-means on a sample
+    of the vectors, partition them into lists. A query only scores the
+    vectors of the `nprobe` lists whose centroids are nearest to it, so
+    more lists probed trade latency for recall.
+
+    Vectors and centroids are normalized, the nearest centroid is the one
+    with the highest dot product. `token` identifies the centroids, lists
+    assigned with other centroids are not used.
+    """
+
+    def __init__(self, centroids: np.ndarray, token: Optional[str] = None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.token = token or uuid.uuid4().hex[:12]
+
+    @property
+    def lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def train(
+        cls,
+        vectors: np.ndarray,
+        lists: Optional[int] = None,
+        iterations: int = TRAIN_ITERATIONS,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        Spherical k-means over the normalized `vectors`, into about the
+        square root of their number of lists by default.
+        """
+        if not len(vectors):
+            raise ValueError("Cannot train an IVF index without vectors")
+        rng = np.random.default_rng(seed)
+        lists = max(1, min(lists or default_lists(len(vectors)), len(vectors)))
+        centroids = vectors[np.sort(rng.choice(len(vectors), lists, replace=False))]
+        for _ in range(iterations):
+            assignments = _nearest(vectors, centroids)
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=lists)
+            filled = np.flatnonzero(counts)
+            sums = np.add.reduceat(
+                vectors[order], np.cumsum(counts)[filled] - counts[filled]
+            )
+            centroids = centroids.copy()
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids[filled] = sums / np.maximum(norms, np.finfo(np.float32).tiny)
+            # Empty lists restart from a random vector
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                centroids[empty] = vectors[rng.choice(len(vectors), len(empty))]
+        return cls(centroids)
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """The list of each of `vectors`, as int32."""
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+            chunk = vectors[start : start + ASSIGN_CHUNK_ROWS]
+            assignments[start : start + len(chunk)] = _nearest(chunk, self.centroids)
+        return assignments
+
+    def probe(self, embeddings: np.ndarray, nprobe: int) -> np.ndarray:
+        """The `nprobe` lists nearest to each of the normalized `embeddings`."""
+        nprobe = max(1, min(nprobe, self.lists))
+        scores = embeddings @ self.centroids.T
+        return np.argpartition(scores, self.lists - nprobe, axis=1)[:, -nprobe:]
+
+    def save(self, path: str):
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, centroids=self.centroids, token=np.array(self.token))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], str(data["token"]))
+
+
+class InvertedLists:
+    """
+    The rows of a block grouped by list: `order` holds the row numbers
+    sorted by list, the rows of list `i` are `order[offsets[i]:offsets[i+1]]`.
+    Rows assigned -1 are in no list.
+    """
+
+    def __init__(self, assignments: np.ndarray, ivf: IVFIndex):
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.token = ivf.token
+        self.order = np.argsort(self.assignments, kind="stable").astype(np.int32)
+        self.offsets = np.searchsorted(
+            self.assignments[self.order], np.arange(ivf.lists + 1)
+        )
+
+    def rows(self, lists: np.ndarray) -> np.ndarray:
+        """The rows of `lists`, in file order."""
+        parts = [self.order[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate(parts))
+
+
+def default_lists(count: int) -> int:
+    return max(1, int(round(np.sqrt(count))))
+
+
+def recall_at_k(
+    store: Any, embeddings: Sequence[List[float]], k: int = 10, **kwargs: Any
+) -> float:
+    """
+    Share of the exact top `k` of `store` found by its approximate search
+    with `kwargs`, e.g. `nprobe`, averaged over the query `embeddings`.
+    """
+    queries = [
+        VectorStoreQuery(query_embedding=list(embedding), similarity_top_k=k)
+        for embedding in embeddings
+    ]
+    if not queries:
+        return 1.0
+    exact = store.batch_query(queries, exact=True)
+    found = store.batch_query(queries, **kwargs)
+    hits = [
+        len(set(a.ids) & set(b.ids)) / max(1, len(a.ids)) for a, b in zip(exact, found)
+    ]
+    return float(np.mean(hits))
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
@@ -0,0 +1,795 @@
+import json
+import logging
+import os
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+import fsspec
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.indices.query.embedding_utils import (
+    get_top_k_embeddings_learner,
+    get_top_k_mmr_embeddings,
+)
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import (
+    LEARNER_MODES,
+    MMR_MODE,
+    SimpleVectorStore,
+    SimpleVectorStoreData,
+)
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import (
+    build_metadata_filter_fn,
+    node_to_metadata_dict,
+)
+
+from .ivf import (
+    ASSIGN_CHUNK_ROWS,
+    DEFAULT_NPROBE,
+    TRAIN_ITERATIONS,
+    TRAIN_MAX_SAMPLES,
+    TRAIN_SAMPLES_PER_LIST,
+    InvertedLists,
+    IVFIndex,
+    default_lists,
+)
+from .quantize import DEFAULT_RESCORE, QUANTIZATIONS, QuantizedVectors
+
+logger = logging.getLogger(__name__)
+
+# Rows allocated for vectors added since the last persist, doubled when full
+PENDING_ROWS = 256
+# Metadata filter masks kept per block
+MASK_CACHE_SIZE = 32
+# Average length of the runs of consecutive rows from which the rows of probed
+# lists are scored in place instead of gathered
+MIN_RUN_ROWS = 32
+
+
+class VectorBlock:
+    """
+    Rows of vectors, `ids[row]` is the node id of a row. Blocks read from
+    the storage are memory mapped and never change, except for `live`
+    which marks the rows of deleted nodes.
+
+    `path` is the file of a persisted block. Only the pending block, holding
+    the vectors added since the last persist, grows. Its rows are written
+    before `count` is increased, so a reader taking `count` first only sees
+    complete rows.
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        ids: List[Optional[str]],
+        path: Optional[str] = None,
+    ):
+        self.matrix = matrix
+        self.ids = ids
+        self.path = path
+        self.count = len(ids)
+        self.live = np.array([node_id is not None for node_id in ids], dtype=bool)
+        # Metadata filters -> rows matching them
+        self.masks: Dict[str, np.ndarray] = {}
+        # Rows by list of the IVF index, for persisted blocks
+        self.lists: Optional[InvertedLists] = None
+        # Quantized copy of the matrix scored instead, for persisted blocks
+        self.quantized: Optional[QuantizedVectors] = None
+
+    @classmethod
+    def pending(cls, dim: int) -> "VectorBlock":
+        block = cls(np.empty((PENDING_ROWS, dim), dtype=np.float32), [])
+        block.live = np.zeros(PENDING_ROWS, dtype=bool)
+        return block
+
+    @classmethod
+    def open(cls, path: str, ids: List[Optional[str]]) -> "VectorBlock":
+        """Maps the float32 `.npy` matrix at `path`, shared with other processes."""
+        return cls(np.load(path, mmap_mode="r"), ids, path)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def append(self, node_id: str, vector: np.ndarray) -> int:
+        row = self.count
+        if row == len(self.matrix):
+            matrix = np.empty((2 * row, self.dim), dtype=np.float32)
+            matrix[:row] = self.matrix[:row]
+            live = np.zeros(2 * row, dtype=bool)
+            live[:row] = self.live[:row]
+            self.live, self.matrix = live, matrix
+        self.matrix[row] = vector
+        self.live[row] = True
+        self.ids.append(node_id)
+        self.count = row + 1
+        return row
+
+    def rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The matrix and live mask of the complete rows."""
+        count = self.count
+        return self.matrix[:count], self.live[:count]
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    In-memory vector store keeping the embeddings as float32 matrices, read
+    from `.npy` files with `np.memmap` so the index opens without parsing
+    the vectors, and processes opening the same index share them in the
+    page cache. See SegmentedStorage for the persisted layout.
+
+    Vectors are stored normalized, so a cosine similarity is a dot product
+    and a batch of queries is scored with one matrix product per block, see
+    `batch_query`. Metadata filters and node id restrictions are applied as
+    boolean masks, cached per block. With an IVF index, see `train_ivf`,
+    queries only score the rows of the lists nearest to them. With a
+    `quantization`, see `quantize`, they score float16 or int8 copies of the
+    vectors and re-score the best candidates with the float32 vectors.
+    Changes are made in place for new arrays, so queries from other threads
+    need no lock while a single writer adds or deletes nodes.
+    Persisting it on its own writes the json of SimpleVectorStore.
+    """
+
+    stores_text: bool = False
+    # Dimensions of the vectors, of the first one added if None
+    dimensions: Optional[int] = None
+    # float16, int8 or None
+    quantization: Optional[str] = None
+    # Candidates re-scored per result of quantized scoring, 0 for none
+    rescore: int = DEFAULT_RESCORE
+
+    _blocks: List[VectorBlock] = PrivateAttr(default_factory=list)
+    # Node id -> block and row of its vector
+    _rows: Dict[str, Tuple[VectorBlock, int]] = PrivateAttr(default_factory=dict)
+    _pending: Optional[VectorBlock] = PrivateAttr(default=None)
+    _ref_doc_ids: Dict[str, str] = PrivateAttr(default_factory=dict)
+    _metadata: Dict[str, Any] = PrivateAttr(default_factory=dict)
+    # Bumped on every change, invalidates the node id masks
+    _version: int = PrivateAttr(default=0)
+    # Node ids of the last query restricted to some, their version and masks
+    _node_masks: Optional[tuple] = PrivateAttr(default=None)
+    _ivf: Optional[IVFIndex] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @classmethod
+    def from_blocks(
+        cls,
+        blocks: Sequence[VectorBlock],
+        ref_doc_ids: Dict[str, str],
+        metadata: Dict[str, Any],
+    ) -> "NumpyVectorStore":
+        store = cls()
+        store._blocks = [block for block in blocks if block.count]
+        for block in store._blocks:
+            for row, node_id in enumerate(block.ids):
+                if node_id is not None:
+                    store._rows[node_id] = (block, row)
+        store._ref_doc_ids = ref_doc_ids
+        store._metadata = metadata
+        return store
+
+    @classmethod
+    def from_simple(cls, simple: SimpleVectorStore) -> "NumpyVectorStore":
+        store = cls()
+        store._ref_doc_ids = simple.data.text_id_to_ref_doc_id
+        store._metadata = simple.data.metadata_dict
+        for node_id, embedding in simple.data.embedding_dict.items():
+            store._append(node_id, embedding)
+        return store
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def rows(self) -> Dict[str, Tuple[VectorBlock, int]]:
+        """Node id -> block and row, a new tuple whenever a vector is written."""
+        return self._rows
+
+    @property
+    def blocks(self) -> List[VectorBlock]:
+        return self._blocks
+
+    @property
+    def ivf(self) -> Optional[IVFIndex]:
+        return self._ivf
+
+    @property
+    def text_id_to_ref_doc_id(self) -> Dict[str, str]:
+        return self._ref_doc_ids
+
+    @property
+    def metadata_dict(self) -> Dict[str, Any]:
+        return self._metadata
+
+    def get(self, text_id: str) -> List[float]:
+        block, row = self._rows[text_id]
+        return block.matrix[row].tolist()
+
+    def vectors(self, node_ids: Sequence[str]) -> np.ndarray:
+        """The vectors of `node_ids` as one float32 matrix."""
+        if not node_ids:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.stack([self._vector(node_id) for node_id in node_ids])
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._blocks[0].dim if self._blocks else self.dimensions
+
+    def get_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+    ) -> List[BaseNode]:
+        raise NotImplementedError("NumpyVectorStore does not store nodes directly.")
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        for node in nodes:
+            self._append(node.node_id, node.get_embedding())
+            self._ref_doc_ids[node.node_id] = node.ref_doc_id or "None"
+            metadata = node_to_metadata_dict(
+                node, remove_text=True, flat_metadata=False
+            )
+            metadata.pop("_node_content", None)
+            self._metadata[node.node_id] = metadata
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._remove(
+            [
+                node_id
+                for node_id, ref_doc_id_ in self._ref_doc_ids.items()
+                if ref_doc_id_ == ref_doc_id
+            ]
+        )
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        filter_fn = build_metadata_filter_fn(
+            lambda node_id: self._metadata[node_id], filters
+        )
+        candidates = self._rows if node_ids is None else node_ids
+        self._remove(
+            [
+                node_id
+                for node_id in list(candidates)
+                if node_id in self._rows and filter_fn(node_id)
+            ]
+        )
+
+    def clear(self) -> None:
+        self._blocks, self._rows, self._pending = [], {}, None
+        self._ivf = None
+        self._ref_doc_ids, self._metadata = {}, {}
+        self._version += 1
+
+    def seal(
+        self,
+        path: str,
+        node_ids: Sequence[Optional[str]],
+        assignments: Optional[np.ndarray] = None,
+        quantized: Optional[QuantizedVectors] = None,
+    ) -> VectorBlock:
+        """
+        Replaces the vectors of `node_ids` with the rows of the matrix just
+        persisted at `path`, in order, releasing the pending vectors. Rows
+        of None ids are not used. With an IVF index, rows are in the lists
+        of `assignments`, by default in the list they were assigned to, new
+        ones are assigned now. With a quantization, the rows are scored from
+        `quantized`, quantized now by default.
+        """
+        block = VectorBlock.open(path, list(node_ids))
+        kind = self.quantization
+        if kind is not None:
+            if quantized is None or quantized.kind != kind:
+                quantized = QuantizedVectors.quantize(kind, block.matrix)
+            block.quantized = quantized
+        superseded = [
+            None if node_id is None else self._rows[node_id] for node_id in node_ids
+        ]
+        ivf = self._ivf
+        if ivf is not None:
+            if assignments is None:
+                assignments = self._assignments(
+                    ivf, superseded, lambda rows: block.matrix[rows]
+                )
+            block.lists = InvertedLists(assignments, ivf)
+        for row, node_id in enumerate(node_ids):
+            if node_id is not None:
+                self._rows[node_id] = (block, row)
+        # Readers see the new block before the old rows disappear
+        self._blocks = self._blocks + [block]
+        for location in superseded:
+            if location is not None:
+                location[0].live[location[1]] = False
+        if self._pending is not None and not self._pending.rows()[1].any():
+            self._pending = None
+        self._blocks = [
+            b for b in self._blocks if b is self._pending or b.rows()[1].any()
+        ]
+        self._version += 1
+        return block
+
+    def train_ivf(
+        self,
+        lists: Optional[int] = None,
+        iterations: int = TRAIN_ITERATIONS,
+        seed: int = 0,
+    ) -> IVFIndex:
+        """
+        Trains an IVF index on a sample of the vectors, with as many lists
+        as the square root of their number by default, and uses it, see
+        `use_ivf`.
+        """
+        locations = list(self._rows.values())
+        if not locations:
+            raise ValueError("Cannot train an IVF index on an empty store")
+        lists = lists or default_lists(len(locations))
+        size = min(len(locations), TRAIN_MAX_SAMPLES, lists * TRAIN_SAMPLES_PER_LIST)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(locations), size, replace=False))
+        vectors = np.stack([locations[i][0].matrix[locations[i][1]] for i in sample])
+        ivf = IVFIndex.train(vectors, lists, iterations, seed)
+        self.use_ivf(ivf)
+        return ivf
+
+    def quantize(self, kind: Optional[str]):
+        """
+        Scores the persisted blocks from their vectors quantized to `kind`,
+        float16 or int8, None for the float32 vectors. Blocks without them
+        are quantized in memory, SegmentedStorage keeps them beside their
+        matrix. Vectors added since the last persist stay float32.
+        """
+        if kind is not None and kind not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {kind}")
+        for block in self._blocks:
+            if block.path is None:
+                continue
+            if kind is None:
+                block.quantized = None
+            elif block.quantized is None or block.quantized.kind != kind:
+                block.quantized = QuantizedVectors.quantize(kind, block.rows()[0])
+        self.quantization = kind
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes of the float32 vectors, and of the vectors a query scans, the
+        quantized ones where blocks have them.
+        """
+        usage = {"float32": 0, "scanned": 0}
+        for block in self._blocks:
+            matrix = block.rows()[0]
+            usage["float32"] += matrix.nbytes
+            quantized = block.quantized
+            usage["scanned"] += quantized.nbytes if quantized else matrix.nbytes
+        return usage
+
+    def lists_of(self, node_ids: Sequence[str]) -> np.ndarray:
+        """The IVF list of the vector of each of `node_ids`."""
+        locations = [self._rows[node_id] for node_id in node_ids]
+        return self._assignments(
+            self._ivf,
+            locations,
+            lambda rows: self.vectors([node_ids[row] for row in rows]),
+        )
+
+    def use_ivf(self, ivf: Optional[IVFIndex]):
+        """
+        Searches the persisted blocks through `ivf`, assigning the rows of
+        blocks without lists of it. The pending block, vectors added since
+        the last persist, is still scored in full. None stops using it.
+        """
+        if ivf is not None:
+            for block in self._blocks:
+                lists = block.lists
+                if block.path is not None and (
+                    lists is None or lists.token != ivf.token
+                ):
+                    matrix, live = block.rows()
+                    assignments = np.where(live, ivf.assign(matrix), -1)
+                    block.lists = InvertedLists(assignments, ivf)
+        self._ivf = ivf
+        self._version += 1
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode == VectorStoreQueryMode.DEFAULT:
+            return self.batch_query([query], **kwargs)[0]
+        if query.mode not in LEARNER_MODES and query.mode != MMR_MODE:
+            raise ValueError(f"Invalid query mode: {query.mode}")
+        self._check_filters(query)
+        embeddings: List[List[float]] = []
+        node_ids: List[str] = []
+        for block in self._blocks:
+            matrix, live = block.rows()
+            for row in np.flatnonzero(self._mask(block, live, query)):
+                embeddings.append(matrix[row].tolist())
+                node_ids.append(block.ids[row])
+
+        query_embedding = cast(List[float], query.query_embedding)
+        if query.mode == MMR_MODE:
+            similarities, ids = get_top_k_mmr_embeddings(
+                query_embedding,
+                embeddings,
+                similarity_top_k=query.similarity_top_k,
+                embedding_ids=node_ids,
+                mmr_threshold=kwargs.get("mmr_threshold"),
+            )
+        else:
+            similarities, ids = get_top_k_embeddings_learner(
+                query_embedding,
+                embeddings,
+                similarity_top_k=query.similarity_top_k,
+                embedding_ids=node_ids,
+            )
+        return VectorStoreQueryResult(similarities=similarities, ids=ids)
+
+    def batch_query(
+        self, queries: Sequence[VectorStoreQuery], **kwargs: Any
+    ) -> List[VectorStoreQueryResult]:
+        """
+        Results of `queries`, all in the default mode, scored together: one
+        matrix product per block scores every query, `argpartition` keeps
+        the top k of each without sorting all the scores.
+
+        With an IVF index only the rows of the `nprobe` lists nearest to a
+        query are scored. The lists probed by any query of the batch are
+        scored together, a query only gets the rows of its own lists, so its
+        results do not depend on the batch. Quantized blocks keep `rescore`
+        candidates per result, re-scored with the float32 vectors, with 0
+        their approximate scores are returned. `exact` scores every float32
+        vector.
+        """
+        for query in queries:
+            if query.mode != VectorStoreQueryMode.DEFAULT:
+                raise ValueError(f"Invalid query mode for a batch: {query.mode}")
+            self._check_filters(query)
+        if not queries:
+            return []
+        embeddings = normalize(
+            np.asarray([query.query_embedding for query in queries], dtype=np.float32)
+        )
+        top_k = max(query.similarity_top_k for query in queries)
+        exact = kwargs.get("exact", False)
+        rescore = kwargs.get("rescore", self.rescore)
+        ivf = self._ivf
+        probes = None
+        if ivf is not None and not exact:
+            probes = ivf.probe(embeddings, kwargs.get("nprobe") or DEFAULT_NPROBE)
+        # Per block, its top k rows for every query and their scores, by query
+        candidates: List[Tuple[VectorBlock, np.ndarray, np.ndarray]] = []
+        for block in self._blocks:
+            quantized = None if exact else block.quantized
+            rescoring = quantized is not None and rescore > 0
+            wanted = top_k * rescore if rescoring else top_k
+            lists = block.lists
+            if probes is None or lists is None or lists.token != ivf.token:
+                matrix, live = block.rows()
+                valid = np.stack([self._mask(block, live, q) for q in queries])
+                # One row of scores per query, contiguous for argpartition
+                scores = _score(embeddings, matrix, quantized)
+                found = _top_k(scores, valid, wanted)
+            else:
+                found = self._probe(
+                    block, embeddings, queries, probes, wanted, quantized
+                )
+            if found is not None and rescoring:
+                found = _rescore(embeddings, block.rows()[0], *found, top_k)
+            if found is not None:
+                candidates.append((block, *found))
+
+        results = []
+        for column, query in enumerate(queries):
+            scores = [part[column] for _, _, part in candidates]
+            locations = [
+                (block, row) for block, rows, _ in candidates for row in rows[column]
+            ]
+            merged = np.concatenate(scores) if scores else np.empty(0)
+            best = np.argsort(-merged, kind="stable")[: query.similarity_top_k]
+            best = best[np.isfinite(merged[best])]
+            results.append(
+                VectorStoreQueryResult(
+                    similarities=[float(merged[i]) for i in best],
+                    ids=[locations[i][0].ids[locations[i][1]] for i in best],
+                )
+            )
+        return results
+
+    def persist(
+        self,
+        persist_path: str,
+        fs: Optional[fsspec.AbstractFileSystem] = None,
+    ) -> None:
+        fs = fs or fsspec.filesystem("file")
+        dirpath = os.path.dirname(persist_path)
+        if not fs.exists(dirpath):
+            fs.makedirs(dirpath)
+        with fs.open(persist_path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def from_persist_path(
+        cls, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None
+    ) -> "NumpyVectorStore":
+        return cls.from_simple(SimpleVectorStore.from_persist_path(persist_path, fs))
+
+    def to_dict(self, **kwargs: Any) -> Dict[str, Any]:
+        return SimpleVectorStoreData(
+            embedding_dict={node_id: self.get(node_id) for node_id in self._rows},
+            text_id_to_ref_doc_id=self._ref_doc_ids,
+            metadata_dict=self._metadata,
+        ).to_dict()
+
+    def _vector(self, node_id: str) -> np.ndarray:
+        block, row = self._rows[node_id]
+        return block.matrix[row]
+
+    def _append(self, node_id: str, embedding: Iterable[float]):
+        vector = normalize(np.asarray(embedding, dtype=np.float32))
+        dim = self.dim
+        if dim is not None and len(vector) != dim:
+            raise ValueError(
+                f"Embedding of {node_id} has {len(vector)} dimensions, "
+                f"the store has {dim}"
+            )
+        if self._pending is None:
+            self._pending = VectorBlock.pending(len(vector))
+            self._blocks = self._blocks + [self._pending]
+        previous = self._rows.get(node_id)
+        self._rows[node_id] = (self._pending, self._pending.append(node_id, vector))
+        if previous is not None:
+            previous[0].live[previous[1]] = False
+        self._version += 1
+
+    def _probe(
+        self,
+        block: VectorBlock,
+        embeddings: np.ndarray,
+        queries: Sequence[VectorStoreQuery],
+        probes: np.ndarray,
+        top_k: int,
+        quantized: Optional[QuantizedVectors],
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        The top k rows of `block` for every query among the rows of the
+        lists it probes, and their scores, from `quantized` if given.
+        Queries probing about the same lists, e.g. rephrasings of a
+        question, are scored with one matrix product over the rows of all
+        their lists, others one by one.
+        """
+        matrix, live = block.rows()
+        lists = block.lists
+        subsets = [lists.rows(probed) for probed in probes]
+        union = np.unique(np.concatenate(subsets))
+        if not len(union):
+            return None
+        total = sum(len(subset) for subset in subsets)
+        if len(union) * (len(queries) + 1) <= 2 * total:
+            # Query -> whether it probes each list
+            probing = np.zeros((len(queries), len(lists.offsets) - 1), dtype=bool)
+            np.put_along_axis(probing, probes, True, axis=1)
+            valid = np.stack([self._mask(block, live, q)[union] for q in queries])
+            valid &= probing[:, lists.assignments[union]]
+            scores = _score(embeddings, matrix, quantized, union)
+            rows, scores = _top_k(scores, valid, top_k)
+            return union[rows], scores
+
+        rows = np.zeros((len(queries), top_k), dtype=np.int64)
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for i, (query, subset) in enumerate(zip(queries, subsets)):
+            if not len(subset):
+                continue
+            valid = self._mask(block, live, query)[subset]
+            found, found_scores = _top_k(
+                _score(embeddings[i : i + 1], matrix, quantized, subset),
+                valid[None],
+                top_k,
+            )
+            k = found.shape[1]
+            rows[i, :k], scores[i, :k] = subset[found[0]], found_scores[0]
+        return rows, scores
+
+    def _assignments(
+        self,
+        ivf: IVFIndex,
+        previous: Sequence[Optional[Tuple[VectorBlock, int]]],
+        vectors: Callable[[List[int]], np.ndarray],
+    ) -> np.ndarray:
+        """
+        The lists of vectors, taken from their `previous` location when it
+        has lists, assigned otherwise from `vectors`, positions -> vectors.
+        Vectors without a location have none.
+        """
+        assignments = np.full(len(previous), -1, dtype=np.int32)
+        missing = []
+        for row, location in enumerate(previous):
+            if location is None:
+                continue
+            lists = location[0].lists
+            if lists is not None and lists.token == ivf.token:
+                assignments[row] = lists.assignments[location[1]]
+            else:
+                missing.append(row)
+        for start in range(0, len(missing), ASSIGN_CHUNK_ROWS):
+            rows = missing[start : start + ASSIGN_CHUNK_ROWS]
+            assignments[rows] = ivf.assign(vectors(rows))
+        return assignments
+
+    def _remove(self, node_ids: Iterable[str]):
+        for node_id in node_ids:
+            block, row = self._rows.pop(node_id)
+            block.live[row] = False
+            self._ref_doc_ids.pop(node_id, None)
+            self._metadata.pop(node_id, None)
+        self._version += 1
+
+    def _check_filters(self, query: VectorStoreQuery):
+        if query.filters is not None and self._rows and not self._metadata:
+            raise ValueError(
+                "Cannot filter stores that were persisted without metadata. "
+                "Please rebuild the store with metadata to enable filtering."
+            )
+
+    def _mask(
+        self, block: VectorBlock, live: np.ndarray, query: VectorStoreQuery
+    ) -> np.ndarray:
+        """The rows of `block` `query` may return, among the `live` ones."""
+        mask = live
+        if query.filters is not None:
+            mask = mask & self._filter_mask(block, query.filters, len(live))
+        if query.node_ids is not None:
+            mask = mask & self._node_mask(block, query.node_ids, len(live))
+        return mask
+
+    def _filter_mask(
+        self, block: VectorBlock, filters: MetadataFilters, count: int
+    ) -> np.ndarray:
+        """
+        The rows of `block` matching `filters`, computed once per block and
+        filters. The metadata of a row never changes, a node written again
+        gets a new row.
+        """
+        key = filters.model_dump_json()
+        mask = block.masks.get(key)
+        if mask is None or len(mask) < count:
+            filter_fn = build_metadata_filter_fn(
+                lambda node_id: self._metadata[node_id], filters
+            )
+            mask = np.fromiter(
+                (
+                    node_id is not None
+                    and node_id in self._metadata
+                    and filter_fn(node_id)
+                    for node_id in block.ids[:count]
+                ),
+                dtype=bool,
+                count=count,
+            )
+            if len(block.masks) >= MASK_CACHE_SIZE:
+                block.masks.pop(next(iter(block.masks)))
+            block.masks[key] = mask
+        return mask[:count]
+
+    def _node_mask(
+        self, block: VectorBlock, node_ids: List[str], count: int
+    ) -> np.ndarray:
+        """
+        The rows of `block` of `node_ids`. A retriever passes the same list
+        on every query, so the masks of all blocks are built once for it,
+        until the store changes.
+        """
+        cached = self._node_masks
+        if cached is None or cached[0] is not node_ids or cached[1] != self._version:
+            version = self._version
+            masks: Dict[VectorBlock, np.ndarray] = {}
+            for node_id in node_ids:
+                location = self._rows.get(node_id)
+                if location is not None:
+                    owner, row = location
+                    if owner not in masks:
+                        masks[owner] = np.zeros(len(owner.live), dtype=bool)
+                    masks[owner][row] = True
+            cached = self._node_masks = (node_ids, version, masks)
+        mask = cached[2].get(block)
+        if mask is None or len(mask) < count:
+            return np.zeros(count, dtype=bool) if mask is None else _pad(mask, count)
+        return mask[:count]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """`vectors` scaled to unit length along the last axis, zero ones kept."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _score(
+    embeddings: np.ndarray,
+    matrix: np.ndarray,
+    quantized: Optional[QuantizedVectors] = None,
+    rows: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    `embeddings @ matrix.T`, or `embeddings @ matrix[rows].T` for sorted
+    `rows`, approximated from `quantized` if given. Runs of consecutive
+    rows, the lists of a matrix laid out by list, are scored in place
+    instead of copied out of the memory map.
+    """
+    if rows is None:
+        ranges = [(0, len(matrix))]
+    else:
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        if len(rows) < MIN_RUN_ROWS * (len(breaks) + 1):
+            if quantized is not None:
+                return quantized.score_rows(embeddings, rows)
+            return embeddings @ matrix[rows].T
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(rows)]))
+        ranges = [(rows[start], rows[end - 1] + 1) for start, end in zip(starts, ends)]
+    parts = [
+        (
+            quantized.score(embeddings, start, end)
+            if quantized is not None
+            else embeddings @ matrix[start:end].T
+        )
+        for start, end in ranges
+    ]
+    return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1)
+
+
+def _rescore(
+    embeddings: np.ndarray,
+    matrix: np.ndarray,
+    rows: np.ndarray,
+    scores: np.ndarray,
+    top_k: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The `top_k` of the candidate `rows` of each query, scored again with
+    the float32 `matrix`. Candidates scored -inf stay out.
+    """
+    exact = np.einsum("md,mkd->mk", embeddings, matrix[rows])
+    columns, exact = _top_k(exact, np.isfinite(scores), top_k)
+    return np.take_along_axis(rows, columns, axis=1), exact
+
+
+def _top_k(
+    scores: np.ndarray, valid: np.ndarray, top_k: int
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    The columns of the `top_k` highest `scores` of each row, unordered, and
+    their scores, -inf where not `valid`.
+    """
+    if not scores.shape[1]:
+        return None
+    scores[~valid] = -np.inf
+    k = min(top_k, scores.shape[1])
+    rows = np.argpartition(scores, scores.shape[1] - k, axis=1)[:, -k:]
+    return rows, np.take_along_axis(scores, rows, axis=1)
+
+
+def _pad(mask: np.ndarray, count: int) -> np.ndarray:
+    padded = np.zeros(count, dtype=bool)
+    padded[: len(mask)] = mask
+    return padded
@@ -0,0 +1,124 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+QUANTIZATIONS = ("float16", "int8")
+# Candidates re-scored with the float32 vectors, per result
+DEFAULT_RESCORE = 4
+# Bytes of vectors converted to float32 at once
+CHUNK_BYTES = 1 << 24
+
+
+class QuantizedVectors:
+    """
+    A matrix of vectors stored with fewer bits, to score them approximately
+    while the float32 matrix stays on disk: float16, half the size, or int8
+    with a scale per dimension, a quarter, `vector ~ codes * scale`.
+
+    The codes are converted to float32 a chunk of rows at a time while
+    scoring, as NumPy only multiplies float32 matrices fast. Converting
+    int8 costs about as much as reading float32 from memory, converting
+    float16 several times more: float16 saves memory, not time.
+    """
+
+    def __init__(self, kind: str, codes: np.ndarray, scale: Optional[np.ndarray]):
+        self.kind = kind
+        self.codes = codes
+        self.scale = scale
+
+    @classmethod
+    def quantize(
+        cls, kind: str, vectors: np.ndarray, path: Optional[str] = None
+    ) -> "QuantizedVectors":
+        """
+        Quantizes `vectors`, a chunk at a time, in memory or to `.npy` files
+        at `path`, opened memory mapped once written. The int8 scale of a
+        dimension maps its largest absolute value to 127.
+        """
+        if kind not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {kind}")
+        count, dim = vectors.shape
+        scale = None
+        if kind == "int8":
+            peak = np.zeros(dim, dtype=np.float32)
+            for start in range(0, count, _chunk_rows(dim)):
+                chunk = vectors[start : start + _chunk_rows(dim)]
+                np.maximum(peak, np.abs(chunk).max(axis=0), out=peak)
+            scale = np.where(peak > 0, peak / 127, 1).astype(np.float32)
+        dtype = np.float16 if kind == "float16" else np.int8
+        if path is None:
+            codes = np.empty((count, dim), dtype=dtype)
+        else:
+            codes = np.lib.format.open_memmap(
+                path + ".tmp", mode="w+", dtype=dtype, shape=(count, dim)
+            )
+        for start in range(0, count, _chunk_rows(dim)):
+            chunk = np.asarray(vectors[start : start + _chunk_rows(dim)], np.float32)
+            if scale is not None:
+                chunk = np.clip(np.rint(chunk / scale), -127, 127)
+            codes[start : start + len(chunk)] = chunk
+        if path is None:
+            return cls(kind, codes, scale)
+        codes.flush()
+        del codes
+        if scale is not None:
+            _save(_scale_path(path), scale)
+        _fsync(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return cls.open(kind, path)
+
+    @classmethod
+    def open(cls, kind: str, path: str) -> "QuantizedVectors":
+        scale = np.load(_scale_path(path)) if kind == "int8" else None
+        return cls(kind, np.load(path, mmap_mode="r"), scale)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def score(self, embeddings: np.ndarray, start: int, end: int) -> np.ndarray:
+        """`embeddings @ vectors[start:end].T`, approximately."""
+        if self.scale is not None:
+            embeddings = embeddings * self.scale
+        step = _chunk_rows(self.codes.shape[1])
+        scores = np.empty((len(embeddings), end - start), dtype=np.float32)
+        # Reused for every chunk, it stays in the CPU caches
+        buffer = np.empty((min(step, end - start), self.codes.shape[1]), np.float32)
+        for row in range(start, end, step):
+            chunk = buffer[: min(step, end - row)]
+            chunk[...] = self.codes[row : row + len(chunk)]
+            scores[:, row - start : row - start + len(chunk)] = embeddings @ chunk.T
+        return scores
+
+    def score_rows(self, embeddings: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """`embeddings @ vectors[rows].T`, approximately."""
+        if self.scale is not None:
+            embeddings = embeddings * self.scale
+        return embeddings @ self.codes[rows].astype(np.float32).T
+
+
+def quantized_path(matrix_path: str, kind: str) -> str:
+    """The file of the `kind` codes of the float32 matrix at `matrix_path`."""
+    return f"{os.path.splitext(matrix_path)[0]}.{kind}.npy"
+
+
+def _scale_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}.scale.npy"
+
+
+def _chunk_rows(dim: int) -> int:
+    return max(1, CHUNK_BYTES // (4 * dim))
+
+
+def _save(path: str, array: np.ndarray):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _fsync(path: str):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
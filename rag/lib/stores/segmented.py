@@ -0,0 +1,792 @@
+import json
+import logging
+import os
+import threading
+import weakref
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core import StorageContext, load_index_from_storage
+from llama_index.core.data_structs.data_structs import IndexDict
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.storage.docstore.simple_docstore import SimpleDocumentStore
+from llama_index.core.storage.index_store.simple_index_store import (
+    SimpleIndexStore,
+)
+from llama_index.core.storage.kvstore.simple_kvstore import SimpleKVStore
+from llama_index.core.vector_stores.simple import (
+    SimpleVectorStore,
+    SimpleVectorStoreData,
+)
+
+from .ivf import InvertedLists, IVFIndex
+from .numpy_store import NumpyVectorStore, VectorBlock, normalize
+from .quantize import QUANTIZATIONS, QuantizedVectors, quantized_path
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS_DIR = "segments"
+SEGMENTS_MANIFEST = "SEGMENTS.json"
+# Centroids of the IVF index of the vectors, see IVFIndex
+IVF_FILE = "IVF.npz"
+# 2: vectors are stored normalized
+FORMAT_VERSION = 2
+# Segments listed before a persist starts a background compaction
+MAX_SEGMENTS = 8
+# Vectors gathered at once while writing a segment
+WRITE_CHUNK_ROWS = 1024
+# Files of the json storage, replaced by the segments once migrated
+LEGACY_FILES = (
+    "docstore.json",
+    "index_store.json",
+    "graph_store.json",
+    "property_graph_store.json",
+    "default__vector_store.json",
+    "image__vector_store.json",
+)
+
+_VECTOR_ROWS = "vector/rows"
+# Vectors as json lists, written before the rows and matrices
+_VECTORS = "vector/embedding_dict"
+_REF_DOC_IDS = "vector/text_id_to_ref_doc_id"
+_METADATA = "vector/metadata_dict"
+_INDEX = "index/struct"
+_INDEX_NODES = "index/nodes_dict"
+_DOCSTORE = "docstore/"
+_MISSING = object()
+
+Tables = Dict[str, dict]
+# Node ids -> their vectors as one float32 matrix
+Vectors = Callable[[Sequence[str]], np.ndarray]
+
+
+class SegmentedStorage:
+    """
+    Append-only storage of a VectorStoreIndex with in-memory stores.
+
+    The stores are kept as tables, e.g. the embeddings or the nodes of the
+    docstore. Every `save` appends one immutable segment file holding only
+    the entries added, changed or deleted since the last save or load, so
+    persisting an insert costs about the size of the insert. Segments are
+    JSON lines, `[table, key, value]` for a write and `[table, key]` for a
+    delete. The vectors a segment writes are rows of a float32 `.npy` matrix
+    next to it, the segment only holds their row numbers, and `load` maps
+    them into a NumpyVectorStore with `np.memmap` instead of parsing them.
+    SEGMENTS.json lists the live segments in the order they are
+    replayed by `load`, and is replaced atomically: a crash leaves either
+    the previous or the new list. Unlisted files are removed by the writer
+    when it replaces all segments or compacts them, never by `load`, as
+    other processes may be reading the directory while one writes it. Files
+    still mapped by a reader on Windows are left for the next of these.
+
+    Once more than `max_segments` are listed, a background thread merges
+    them into one, dropping deleted and overwritten entries.
+
+    The IVF index of the vector store, if it has one, is kept in IVF.npz,
+    and the list of every row of a matrix in a `.lists.npy` file beside it,
+    named after the index so lists of other centroids are never read. The
+    quantized vectors of a store with a quantization, see
+    NumpyVectorStore.quantize, are kept beside the matrices as well, and the
+    quantization in SEGMENTS.json, with the dimensions of the vectors.
+
+    Changes are found by comparing the tables with a shallow copy taken at
+    the last save. The stores replace an entry on every write instead of
+    changing it in place, so an entry is unchanged while it is the same
+    object, and the comparison does not depend on the size of the values.
+    """
+
+    _instances: Dict[str, "SegmentedStorage"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, persist_dir: str, max_segments: int = MAX_SEGMENTS):
+        self.persist_dir = persist_dir
+        self.directory = os.path.join(persist_dir, SEGMENTS_DIR)
+        self.max_segments = max(2, max_segments)
+        self._snapshot: Tables = {}
+        # The index the snapshot was taken from
+        self._index: Optional[weakref.ref] = None
+        self._lock = threading.RLock()
+        self._compaction: Optional[threading.Thread] = None
+        # Number of the last segment written, None until read from the disk
+        self._sequence: Optional[int] = None
+        # Matrix, vector ids and merged matrices of the last compaction
+        self._merged: Optional[Tuple[str, List[str], set]] = None
+        # Token of the IVF index on disk, None if unknown or without one
+        self._ivf_token: Optional[str] = None
+
+    @classmethod
+    def for_dir(cls, persist_dir: str) -> "SegmentedStorage":
+        """
+        The storage of `persist_dir`, shared by all callers of the process
+        so consecutive saves of an index only write their changes.
+        """
+        key = os.path.realpath(persist_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(persist_dir)
+            return cls._instances[key]
+
+    @staticmethod
+    def supports(index: BaseIndex) -> bool:
+        """Whether `index` only uses stores the segments can hold."""
+        context = index.storage_context
+        vector_stores = context.vector_stores.values()
+        return (
+            isinstance(index.index_struct, IndexDict)
+            and isinstance(index.vector_store, (SimpleVectorStore, NumpyVectorStore))
+            and all(
+                store is index.vector_store
+                or (
+                    isinstance(store, SimpleVectorStore)
+                    and not store.data.embedding_dict
+                )
+                for store in vector_stores
+            )
+            and isinstance(getattr(context.docstore, "_kvstore", None), SimpleKVStore)
+            and isinstance(context.index_store, SimpleIndexStore)
+            and sum(map(len, context.index_store._kvstore.to_dict().values())) <= 1
+        )
+
+    def exists(self) -> bool:
+        return os.path.exists(self._manifest_path())
+
+    def load(self) -> Optional[BaseIndex]:
+        """The index replayed from the segments, None without segments."""
+        with self._lock:
+            manifest = self._read_manifest()
+            if manifest is None:
+                return None
+            tables = self._replay(manifest["segments"])
+            index = _build_index(tables, self._matrix_path)
+            if isinstance(index.vector_store, NumpyVectorStore):
+                index.vector_store.dimensions = manifest.get("dimensions")
+            self._load_quantized(index, manifest.get("quantization"))
+            if _VECTORS in tables or manifest.get("version", 1) < FORMAT_VERSION:
+                logger.info("Rewriting the vectors of %s", self.persist_dir)
+                self._rewrite(index, _index_tables(index))
+            else:
+                self._remember(index, _index_tables(index))
+                self._save_quantized(index, manifest)
+            self._load_ivf(index)
+            return index
+
+    def save(self, index: BaseIndex) -> int:
+        """
+        Appends the changes of `index` since the last save or load as one
+        segment, returns the number of entries written. An index other than
+        the one last saved or loaded replaces all segments.
+        """
+        with self._lock:
+            tables = _index_tables(index)
+            manifest = self._read_manifest()
+            if manifest is None or self._index is None or self._index() is not index:
+                return self._rewrite(index, tables)
+            self._adopt_compaction(index)
+
+            written, name, vector_ids = self._append(
+                self._changes(tables), _index_vectors(index)
+            )
+            if name is not None:
+                manifest["segments"].append(name)
+                manifest["dimensions"] = _dimensions(index)
+                self._write_manifest(manifest)
+                if vector_ids:
+                    path = self._matrix_path(name)
+                    quantized = _quantize(index, path)
+                    _seal(index, path, vector_ids, quantized=quantized)
+            self._remember(index, tables)
+            self._save_ivf(index)
+            self._save_quantized(index, manifest)
+            if len(manifest["segments"]) > self.max_segments:
+                self.compact()
+            return written
+
+    def compact(self, wait: bool = False):
+        """Merges the listed segments into one, in a background thread."""
+        with self._lock:
+            if self._compaction is None or not self._compaction.is_alive():
+                manifest = self._read_manifest()
+                if manifest is None or len(manifest["segments"]) < 2:
+                    return
+                self._compaction = threading.Thread(
+                    target=self._compact,
+                    args=(list(manifest["segments"]),),
+                    name="segments-compaction",
+                    daemon=True,
+                )
+                self._compaction.start()
+            compaction = self._compaction
+        if wait:
+            compaction.join()
+
+    def wait(self):
+        """Waits for a running compaction to finish."""
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+    def truncate(self, index: BaseIndex, dimensions: int) -> int:
+        """
+        Replaces all segments with `index`, its vectors cut to their first
+        `dimensions` and normalized again, returns the number of entries
+        written. Nothing is embedded again: the prefixes of Matryoshka
+        embeddings, e.g. gemini-embedding-001, are embeddings themselves.
+        The IVF index is dropped, its centroids have the old dimensions.
+        """
+        store = index.vector_store
+        if not isinstance(store, NumpyVectorStore):
+            raise ValueError("Only the vectors of a NumpyVectorStore are truncated")
+        if store.dim is not None and not 0 < dimensions <= store.dim:
+            raise ValueError(
+                f"Cannot truncate vectors of {store.dim} dimensions to {dimensions}"
+            )
+        with self._lock:
+            store.use_ivf(None)
+            store.dimensions = dimensions
+            vectors = store.vectors
+            return self._rewrite(
+                index,
+                _index_tables(index),
+                lambda node_ids: vectors(node_ids)[:, :dimensions],
+            )
+
+    def _rewrite(
+        self, index: BaseIndex, tables: Tables, vectors: Optional[Vectors] = None
+    ) -> int:
+        """
+        Replaces all segments, and the json storage, with `tables`, and
+        the vectors of the index with `vectors` if given.
+        """
+        manifest = self._read_manifest() or {"segments": []}
+        previous = manifest["segments"]
+        self._merged = None
+        store = index.vector_store
+        ordered, lists = tables, None
+        if isinstance(store, NumpyVectorStore) and store.ivf is not None:
+            # Rows laid out by list, the rows of a list are read in place
+            rows = tables[_VECTOR_ROWS]
+            lists = dict(zip(rows, store.lists_of(list(rows)).tolist()))
+            ordered = {
+                **tables,
+                _VECTOR_ROWS: dict(
+                    sorted(rows.items(), key=lambda item: lists[item[0]])
+                ),
+            }
+        written, name, vector_ids = self._append(
+            _records(ordered), vectors or _index_vectors(index)
+        )
+        manifest = {
+            "segments": [name] if name is not None else [],
+            "dimensions": _dimensions(index),
+            "quantization": _quantization(index),
+        }
+        self._write_manifest(manifest)
+        if vector_ids:
+            path = self._matrix_path(name)
+            _seal(index, path, vector_ids, lists, _quantize(index, path))
+        self._remember(index, tables)
+        self._save_ivf(index)
+        self._save_quantized(index, manifest)
+        for old in previous:
+            self._remove_segment(old)
+        if self._compaction is None or not self._compaction.is_alive():
+            self._sweep(manifest["segments"])
+        for legacy in LEGACY_FILES:
+            _remove(os.path.join(self.persist_dir, legacy))
+        return written
+
+    def _compact(self, names: List[str]):
+        try:
+            kind = (self._read_manifest() or {}).get("quantization")
+            tables = self._replay(names)
+            rows = tables.get(_VECTOR_ROWS, {})
+            token, lists = self._replayed_lists(rows)
+            # Vectors by list, then in file order, read sequentially from the
+            # matrices
+            tables[_VECTOR_ROWS] = dict(
+                sorted(
+                    rows.items(),
+                    key=lambda item: (lists[item[0]] if lists else 0, item[1]),
+                )
+            )
+            _, merged, vector_ids = self._append(
+                _records(tables), self._replayed_vectors(rows)
+            )
+            if merged is not None and lists and vector_ids:
+                _save_array(
+                    _lists_path(self._matrix_path(merged), token),
+                    np.array([lists[node_id] for node_id in vector_ids], np.int32),
+                )
+            if merged is not None and kind is not None and vector_ids:
+                matrix_path = self._matrix_path(merged)
+                QuantizedVectors.quantize(
+                    kind,
+                    np.load(matrix_path, mmap_mode="r"),
+                    quantized_path(matrix_path, kind),
+                )
+            with self._lock:
+                manifest = self._read_manifest()
+                if manifest is None or manifest["segments"][: len(names)] != names:
+                    # Rewritten meanwhile
+                    if merged is not None:
+                        self._remove_segment(merged)
+                    return
+                rest = manifest["segments"][len(names) :]
+                manifest["segments"] = ([merged] if merged else []) + rest
+                self._write_manifest(manifest)
+                if merged is not None and vector_ids:
+                    compacted = {self._matrix_path(name) for name in names}
+                    self._merged = (self._matrix_path(merged), vector_ids, compacted)
+                # The compacted segments, and any left by an earlier writer
+                self._sweep(manifest["segments"])
+            logger.info("Compacted %d segments of %s", len(names), self.persist_dir)
+        except FileNotFoundError:
+            # Segments removed by a rewrite meanwhile
+            pass
+        except Exception:
+            logger.exception("Failed to compact the segments of %s", self.persist_dir)
+
+    def _adopt_compaction(self, index: BaseIndex):
+        """
+        Moves the vectors of `index` still read from the matrices merged by
+        the last compaction to the merged matrix, so a long running process
+        does not keep one block per save. Runs on save, in the thread that
+        changes the index, as the vector store has a single writer.
+        """
+        merged, self._merged = self._merged, None
+        store = index.vector_store
+        if merged is None or not isinstance(store, NumpyVectorStore):
+            return
+        path, vector_ids, compacted = merged
+        saved = self._snapshot.get(_VECTOR_ROWS, {})
+
+        def unchanged(node_id: str) -> bool:
+            location = store.rows.get(node_id)
+            return (
+                location is not None
+                and location is saved.get(node_id)
+                and location[0].path in compacted
+            )
+
+        adopted = [node_id if unchanged(node_id) else None for node_id in vector_ids]
+        quantized = None
+        kind = store.quantization
+        if kind is not None and os.path.exists(quantized_path(path, kind)):
+            quantized = QuantizedVectors.open(kind, quantized_path(path, kind))
+        store.seal(path, adopted, quantized=quantized)
+        for node_id in adopted:
+            if node_id is not None:
+                saved[node_id] = store.rows[node_id]
+
+    def _load_ivf(self, index: BaseIndex):
+        """
+        Restores the IVF index of the vector store of `index` with the lists
+        of its matrices, assigning the rows of matrices without any.
+        """
+        store = index.vector_store
+        path = os.path.join(self.directory, IVF_FILE)
+        if not isinstance(store, NumpyVectorStore) or not os.path.exists(path):
+            self._ivf_token = None
+            return
+        ivf = IVFIndex.load(path)
+        self._ivf_token = ivf.token
+        for block in store.blocks:
+            lists_path = _lists_path(block.path, ivf.token) if block.path else None
+            if lists_path is not None and os.path.exists(lists_path):
+                block.lists = InvertedLists(np.load(lists_path), ivf)
+        store.use_ivf(ivf)
+        self._save_ivf(index)
+
+    def _save_ivf(self, index: BaseIndex):
+        """
+        Writes the IVF index of the vector store of `index`, when it changed,
+        and the lists of its matrices not written yet.
+        """
+        store = index.vector_store
+        ivf = store.ivf if isinstance(store, NumpyVectorStore) else None
+        path = os.path.join(self.directory, IVF_FILE)
+        token = ivf.token if ivf is not None else None
+        if token != self._ivf_token or (ivf is None and os.path.exists(path)):
+            if ivf is None:
+                _remove(path)
+            else:
+                ivf.save(path)
+            self._ivf_token = token
+            for name in os.listdir(self.directory):
+                if name.endswith(".lists.npy") and name.split(".")[1] != token:
+                    _remove(os.path.join(self.directory, name))
+        if ivf is None:
+            return
+        for block in store.blocks:
+            lists = block.lists
+            if block.path is None or lists is None or lists.token != ivf.token:
+                continue
+            lists_path = _lists_path(block.path, ivf.token)
+            if not os.path.exists(lists_path):
+                _save_array(lists_path, lists.assignments)
+
+    def _load_quantized(self, index: BaseIndex, kind: Optional[str]):
+        """
+        Scores the vector store of `index` from the quantized vectors of
+        `kind` beside its matrices, quantizing the matrices without any.
+        """
+        store = index.vector_store
+        if kind is None or not isinstance(store, NumpyVectorStore):
+            return
+        for block in store.blocks:
+            path = quantized_path(block.path, kind) if block.path else None
+            if path is not None and os.path.exists(path):
+                block.quantized = QuantizedVectors.open(kind, path)
+        store.quantize(kind)
+
+    def _save_quantized(self, index: BaseIndex, manifest: dict):
+        """
+        Writes the quantized vectors of the matrices of `index` not written
+        yet, and its quantization to `manifest` when it changed. Quantized
+        vectors of other kinds are removed.
+        """
+        kind = _quantization(index)
+        if manifest.get("quantization") != kind:
+            manifest["quantization"] = kind
+            self._write_manifest(manifest)
+        for name in os.listdir(self.directory):
+            parts = name.split(".")
+            if len(parts) > 2 and parts[1] in QUANTIZATIONS and parts[1] != kind:
+                _remove(os.path.join(self.directory, name))
+        if kind is None:
+            return
+        for block in index.vector_store.blocks:
+            if block.path is None or block.quantized is None:
+                continue
+            path = quantized_path(block.path, kind)
+            if not os.path.exists(path):
+                block.quantized = QuantizedVectors.quantize(kind, block.matrix, path)
+
+    def _replayed_lists(
+        self, rows: Dict[str, Tuple[str, int]]
+    ) -> Tuple[Optional[str], Optional[Dict[str, int]]]:
+        """
+        The token of the current IVF index and the list of every vector of
+        `rows`, if all their matrices have lists of it, None otherwise.
+        """
+        token = self._ivf_token
+        if token is None:
+            return None, None
+        sources: Dict[str, np.ndarray] = {}
+        for name in {name for name, _ in rows.values()}:
+            path = _lists_path(self._matrix_path(name), token)
+            if not os.path.exists(path):
+                return None, None
+            sources[name] = np.load(path)
+        return token, {
+            node_id: int(sources[name][row]) for node_id, (name, row) in rows.items()
+        }
+
+    def _changes(self, tables: Tables) -> Iterator[list]:
+        for name in tables.keys() | self._snapshot.keys():
+            current = tables.get(name, {})
+            previous = self._snapshot.get(name, {})
+            for key, value in current.items():
+                old = previous.get(key, _MISSING)
+                if old is not value and old != value:
+                    yield [name, key, value]
+            for key in previous:
+                if key not in current:
+                    yield [name, key]
+
+    def _append(
+        self, records: Iterable[list], vectors: Vectors
+    ) -> Tuple[int, Optional[str], List[str]]:
+        """
+        Writes `records` to a new segment, returns the number written, the
+        segment name, None if there was nothing to write, and the ids of the
+        vectors written to its matrix, in row order.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            if self._sequence is None:
+                self._sequence = max(
+                    (
+                        int(name.split(".")[0])
+                        for name in os.listdir(self.directory)
+                        if name.endswith(".jsonl")
+                    ),
+                    default=0,
+                )
+            self._sequence += 1
+            name = f"{self._sequence:08d}.jsonl"
+        path = os.path.join(self.directory, name)
+        written = 0
+        vector_ids: List[str] = []
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                if record[0] == _VECTOR_ROWS and len(record) == 3:
+                    record = [_VECTOR_ROWS, record[1], len(vector_ids)]
+                    vector_ids.append(record[1])
+                f.write(json.dumps(record))
+                f.write("\n")
+                written += 1
+            f.flush()
+            os.fsync(f.fileno())
+        if not written:
+            _remove(path)
+            return 0, None, []
+        if vector_ids:
+            _write_matrix(self._matrix_path(name), vector_ids, vectors)
+        return written, name, vector_ids
+
+    def _replay(self, names: List[str]) -> Tables:
+        tables: Tables = {}
+        for name in names:
+            with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    table = tables.setdefault(record[0], {})
+                    if len(record) == 3 and record[0] == _VECTOR_ROWS:
+                        table[record[1]] = (name, record[2])
+                    elif len(record) == 3:
+                        table[record[1]] = record[2]
+                    else:
+                        table.pop(record[1], None)
+        return tables
+
+    def _remember(self, index: BaseIndex, tables: Tables):
+        self._snapshot = {name: dict(table) for name, table in tables.items()}
+        self._index = weakref.ref(index)
+
+    def _sweep(self, live: List[str]):
+        """
+        Removes the segments of saves or compactions that did not finish,
+        and those not removed before. Only called by the writer, holding
+        the lock, while no compaction is writing a segment.
+        """
+        live = {name.split(".")[0] for name in live}
+        for name in os.listdir(self.directory):
+            stem = name.split(".")[0]
+            if stem.isdigit() and stem not in live:
+                _remove(os.path.join(self.directory, name))
+
+    def _remove_segment(self, name: str):
+        """Removes the segment `name`, its matrix and the lists of its rows."""
+        stem = name.split(".")[0]
+        for file in os.listdir(self.directory):
+            if file.split(".")[0] == stem:
+                _remove(os.path.join(self.directory, file))
+
+    def _matrix_path(self, name: str) -> str:
+        return os.path.join(self.directory, name.split(".")[0] + ".npy")
+
+    def _replayed_vectors(self, rows: Dict[str, Tuple[str, int]]) -> Vectors:
+        matrices: Dict[str, np.ndarray] = {}
+
+        def vectors(node_ids: Sequence[str]) -> np.ndarray:
+            gathered = []
+            for node_id in node_ids:
+                name, row = rows[node_id]
+                if name not in matrices:
+                    matrices[name] = np.load(self._matrix_path(name), mmap_mode="r")
+                gathered.append(matrices[name][row])
+            return np.stack(gathered)
+
+        return vectors
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, SEGMENTS_MANIFEST)
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, manifest: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._manifest_path()
+        manifest["version"] = FORMAT_VERSION
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+
+def _index_tables(index: BaseIndex) -> Tables:
+    """The stores of `index` as tables, sharing their dictionaries."""
+    struct = index.index_struct
+    store = index.vector_store
+    if isinstance(store, NumpyVectorStore):
+        rows, ref_doc_ids, metadata = (
+            store.rows,
+            store.text_id_to_ref_doc_id,
+            store.metadata_dict,
+        )
+    else:
+        rows, ref_doc_ids, metadata = (
+            store.data.embedding_dict,
+            store.data.text_id_to_ref_doc_id,
+            store.data.metadata_dict,
+        )
+    tables: Tables = {
+        _VECTOR_ROWS: rows,
+        _REF_DOC_IDS: ref_doc_ids,
+        _METADATA: metadata,
+        _INDEX: {
+            struct.index_id: {"index_id": struct.index_id, "summary": struct.summary}
+        },
+        _INDEX_NODES: struct.nodes_dict,
+    }
+    kvstore = index.storage_context.docstore._kvstore
+    for collection, mapping in kvstore.to_dict().items():
+        tables[_DOCSTORE + collection] = mapping
+    return tables
+
+
+def _index_vectors(index: BaseIndex) -> Vectors:
+    store = index.vector_store
+    if isinstance(store, NumpyVectorStore):
+        return store.vectors
+    embeddings = store.data.embedding_dict
+    return lambda node_ids: np.asarray(
+        [embeddings[node_id] for node_id in node_ids], dtype=np.float32
+    )
+
+
+def _seal(
+    index: BaseIndex,
+    path: str,
+    vector_ids: List[str],
+    lists: Optional[Dict[str, int]] = None,
+    quantized: Optional[QuantizedVectors] = None,
+):
+    """
+    Points the vector store at the vectors just written to `path`, in the
+    IVF `lists` given, node id -> list, and quantized as `quantized`.
+    """
+    if vector_ids and isinstance(index.vector_store, NumpyVectorStore):
+        assignments = None
+        if lists is not None:
+            assignments = np.array([lists[i] for i in vector_ids], dtype=np.int32)
+        index.vector_store.seal(path, vector_ids, assignments, quantized)
+
+
+def _dimensions(index: BaseIndex) -> Optional[int]:
+    store = index.vector_store
+    if not isinstance(store, NumpyVectorStore):
+        return None
+    # Set before the vectors are truncated
+    return store.dimensions or store.dim
+
+
+def _quantization(index: BaseIndex) -> Optional[str]:
+    store = index.vector_store
+    return store.quantization if isinstance(store, NumpyVectorStore) else None
+
+
+def _quantize(index: BaseIndex, matrix_path: str) -> Optional[QuantizedVectors]:
+    """Writes the matrix at `matrix_path` quantized as the vector store of `index`."""
+    kind = _quantization(index)
+    if kind is None:
+        return None
+    return QuantizedVectors.quantize(
+        kind, np.load(matrix_path, mmap_mode="r"), quantized_path(matrix_path, kind)
+    )
+
+
+def _write_matrix(path: str, node_ids: List[str], vectors: Vectors):
+    """Writes the vectors of `node_ids` as one normalized float32 `.npy` matrix."""
+    first = normalize(vectors(node_ids[:WRITE_CHUNK_ROWS]))
+    matrix = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.float32, shape=(len(node_ids), first.shape[1])
+    )
+    matrix[: len(first)] = first
+    for start in range(WRITE_CHUNK_ROWS, len(node_ids), WRITE_CHUNK_ROWS):
+        chunk = node_ids[start : start + WRITE_CHUNK_ROWS]
+        matrix[start : start + len(chunk)] = normalize(vectors(chunk))
+    matrix.flush()
+    del matrix
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _lists_path(matrix_path: str, token: str) -> str:
+    return f"{os.path.splitext(matrix_path)[0]}.{token}.lists.npy"
+
+
+def _save_array(path: str, array: np.ndarray):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _records(tables: Tables) -> Iterator[list]:
+    for name, table in tables.items():
+        for key, value in table.items():
+            yield [name, key, value]
+
+
+def _build_index(tables: Tables, matrix_path: Callable[[str], str]) -> BaseIndex:
+    ref_doc_ids = tables.get(_REF_DOC_IDS, {})
+    metadata = tables.get(_METADATA, {})
+    if _VECTORS in tables:
+        vector_store = NumpyVectorStore.from_simple(
+            SimpleVectorStore(
+                data=SimpleVectorStoreData(
+                    embedding_dict=tables[_VECTORS],
+                    text_id_to_ref_doc_id=ref_doc_ids,
+                    metadata_dict=metadata,
+                )
+            )
+        )
+    else:
+        vector_store = NumpyVectorStore.from_blocks(
+            _open_blocks(tables.get(_VECTOR_ROWS, {}), matrix_path),
+            ref_doc_ids,
+            metadata,
+        )
+    docstore = SimpleDocumentStore(
+        SimpleKVStore(
+            {
+                name[len(_DOCSTORE) :]: table
+                for name, table in tables.items()
+                if name.startswith(_DOCSTORE)
+            }
+        )
+    )
+    index_store = SimpleIndexStore()
+    for header in tables.get(_INDEX, {}).values():
+        index_store.add_index_struct(
+            IndexDict(nodes_dict=tables.get(_INDEX_NODES, {}), **header)
+        )
+    storage_context = StorageContext.from_defaults(
+        docstore=docstore, index_store=index_store, vector_store=vector_store
+    )
+    return load_index_from_storage(storage_context)
+
+
+def _open_blocks(
+    rows: Dict[str, Tuple[str, int]], matrix_path: Callable[[str], str]
+) -> List[VectorBlock]:
+    matrices: Dict[str, np.ndarray] = {}
+    ids: Dict[str, List[Optional[str]]] = {}
+    for node_id, (name, row) in rows.items():
+        if name not in matrices:
+            matrices[name] = np.load(matrix_path(name), mmap_mode="r")
+            ids[name] = [None] * len(matrices[name])
+        ids[name][row] = node_id
+    return [
+        VectorBlock(matrices[name], ids[name], matrix_path(name))
+        for name in sorted(matrices)
+    ]
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        # Memory mapped by a reader on Windows, removed by a later sweep
+        logger.debug("Could not remove %s, still in use", path)
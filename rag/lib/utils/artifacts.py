@@ -0,0 +1,186 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import secrets
+import string
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+ARTIFACTS_DIR = ".logs/images"
+ARTIFACTS_MAX_MB = 256
+
+PIL_FORMAT_TO_MIME = {
+    "JPEG": "image/jpeg",
+    "JPG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+    "WEBP": "image/webp",
+}
+
+
+class ArtifactWriter:
+    """
+    Saves ocr debug artifacts, the image and its ocr text, from a background
+    thread so encoding never runs on the ingestion path.
+
+    Only `sample_rate` of the submitted images are kept, and at most
+    `queue_size` wait to be written; the rest are dropped. The oldest files
+    are deleted once `directory` grows over `max_bytes`.
+    A `sample_rate` of 0 turns it off, no thread is started.
+
+    `from_env` reads OCR_ARTIFACTS_SAMPLE_RATE, OCR_ARTIFACTS_MAX_MB and
+    OCR_ARTIFACTS_DIR.
+    """
+
+    def __init__(
+        self,
+        directory: str = ARTIFACTS_DIR,
+        sample_rate: float = 1.0,
+        max_bytes: int = ARTIFACTS_MAX_MB * 2**20,
+        queue_size: int = 32,
+    ):
+        self.directory = Path(directory)
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.max_bytes = max_bytes
+        self.queue_size = max(1, queue_size)
+        self._reset()
+
+    @classmethod
+    def from_env(cls) -> "ArtifactWriter":
+        max_mb = float(os.getenv("OCR_ARTIFACTS_MAX_MB", ARTIFACTS_MAX_MB))
+        return cls(
+            directory=os.getenv("OCR_ARTIFACTS_DIR", ARTIFACTS_DIR),
+            sample_rate=float(os.getenv("OCR_ARTIFACTS_SAMPLE_RATE", "1")),
+            max_bytes=int(max_mb * 2**20),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and self.max_bytes > 0
+
+    def submit(self, image: Image.Image, text: Optional[str] = None) -> bool:
+        """Queues the image for writing, returns False if it was dropped."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return False
+        if self._pid != os.getpid():
+            # The writer thread does not survive a fork
+            self._reset()
+        self._start()
+        try:
+            self._queue.put_nowait((image, text))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """Waits until every queued artifact is written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="ocr-artifacts", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        self._scan()
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+                self._evict()
+            except Exception:
+                logger.exception("Failed to write ocr artifact")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image: Image.Image, text: Optional[str]):
+        img_format = (image.format or "JPEG").upper()
+        if img_format not in PIL_FORMAT_TO_MIME:
+            img_format = "JPEG"
+        mime = PIL_FORMAT_TO_MIME[img_format]
+        if mime == "image/jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        # Timestamped names also keep the directory listing in write order
+        name = time.strftime("%Y%m%d-%H%M%S-") + "".join(
+            secrets.choice(string.ascii_letters + string.digits) for _ in range(6)
+        )
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{name}.{mime.split('/')[-1]}"
+        image.save(path, format="JPEG" if mime == "image/jpeg" else img_format)
+        self._track(path)
+        if text is not None:
+            text_path = path.with_suffix(".txt")
+            text_path.write_text(text, encoding="utf-8")
+            self._track(text_path)
+
+    def _scan(self):
+        """Picks up the files left by previous runs, oldest first."""
+        if not self.directory.is_dir():
+            return
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, Path(entry.path), stat.st_size))
+        for _, path, size in sorted(files):
+            self._files.append((path, size))
+            self._size += size
+
+    def _track(self, path: Path):
+        size = path.stat().st_size
+        self._files.append((path, size))
+        self._size += size
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._files:
+            path, size = self._files.popleft()
+            path.unlink(missing_ok=True)
+            self._size -= size
+
+    def _reset(self):
+        self._queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._files: Deque[Tuple[Path, int]] = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+        self.dropped = 0
+
+    def __getstate__(self):
+        # Only the configuration travels to worker processes
+        state = self.__dict__.copy()
+        for key in ("_queue", "_files", "_size", "_lock", "_thread", "_pid"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
@@ -0,0 +1,88 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Set
+
+_DIGITS = re.compile(r"\d+")
+
+
+@dataclass
+class BoilerplateStats:
+    """The boilerplate removed from the pages of a document."""
+
+    lines: int = 0
+    chars: int = 0
+
+
+class BoilerplateFilter:
+    """
+    Removes the lines a document repeats on its pages: headers, footers,
+    page numbers and legal notices.
+
+    A line is boilerplate when it is among the first or last `edge_lines`
+    non blank lines of at least `min_ratio` of the pages. Lines are compared
+    ignoring case, spacing and digits, so "Page 3 of 40" repeats "Page 4 of
+    40".
+    Documents with fewer than `min_pages` pages are left as they are.
+    """
+
+    def __init__(
+        self,
+        min_ratio: float = 0.5,
+        min_pages: int = 3,
+        edge_lines: int = 4,
+    ):
+        self.min_ratio = min_ratio
+        self.min_pages = max(2, min_pages)
+        self.edge_lines = edge_lines
+
+    def strip(
+        self, pages: Sequence[str], stats: Optional[BoilerplateStats] = None
+    ) -> List[str]:
+        """The page texts without boilerplate, removals are counted in `stats`."""
+        boilerplate = self.detect(pages)
+        return [self.remove(page, boilerplate, stats) for page in pages]
+
+    def detect(self, pages: Sequence[str]) -> Set[str]:
+        """
+        The boilerplate lines of a document, from the text of all or of a
+        sample of its pages, as compared by `remove`.
+        """
+        if len(pages) < self.min_pages:
+            return set()
+        counts: Counter = Counter()
+        for page in pages:
+            lines = page.split("\n")
+            counts.update({self._key(lines[i]) for i in self._edges(lines)})
+        threshold = max(2, math.ceil(self.min_ratio * len(pages)))
+        return {key for key, count in counts.items() if count >= threshold}
+
+    def remove(
+        self,
+        page: str,
+        boilerplate: Set[str],
+        stats: Optional[BoilerplateStats] = None,
+    ) -> str:
+        """The page text without the `boilerplate` lines at its edges."""
+        if not boilerplate:
+            return page
+        lines = page.split("\n")
+        removed = {i for i in self._edges(lines) if self._key(lines[i]) in boilerplate}
+        if not removed:
+            return page
+        stripped = "\n".join(line for i, line in enumerate(lines) if i not in removed)
+        if stats is not None:
+            stats.lines += len(removed)
+            stats.chars += len(page) - len(stripped)
+        return stripped
+
+    def _edges(self, lines: List[str]) -> List[int]:
+        """Indexes of the first and last `edge_lines` non blank lines."""
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        if len(filled) <= 2 * self.edge_lines:
+            return filled
+        return filled[: self.edge_lines] + filled[-self.edge_lines :]
+
+    def _key(self, line: str) -> str:
+        return _DIGITS.sub("#", " ".join(line.split()).lower())
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+Value = Union[str, bytes]
+
+
+class DiskCache:
+    """
+    Small key/value store backed by a local sqlite file.
+
+    Safe to share between threads and forked worker processes: every process
+    opens its own connection on first use.
+    """
+
+    def __init__(self, path: str, table: str = "cache"):
+        self.path = path
+        self.table = table
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Value]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, Value]:
+        found: Dict[str, Value] = {}
+        keys = list(dict.fromkeys(keys))
+        # Stay below sqlite's host parameter limit
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            marks = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._connection().execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({marks})",
+                    batch,
+                )
+                found.update(rows.fetchall())
+        return found
+
+    def set(self, key: str, value: Value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items: Iterable[Tuple[str, Value]]):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                    items,
+                )
+
+    def delete(self, key: str):
+        self.delete_many([key])
+
+    def delete_many(self, keys: Iterable[str]):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    f"DELETE FROM {self.table} WHERE key = ?", [(k,) for k in keys]
+                )
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(key TEXT PRIMARY KEY, value BLOB)"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def __getstate__(self):
+        # Connections and locks can't cross process boundaries
+        state = self.__dict__.copy()
+        state.update(_conn=None, _pid=None, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
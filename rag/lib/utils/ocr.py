@@ -1,13 +1,28 @@
-import os
-import secrets
-import string
-from pathlib import Path
+import asyncio
+import copy
+import hashlib
+import logging
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 from google import genai
+from llama_index.core.async_utils import asyncio_run
 from PIL.ImageFile import ImageFile
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 
 import config
 
+from .artifacts import ArtifactWriter
+from .disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
 IMAGE_PROMPT_TEMPLATE = """
 You are an AI assistant. You have been given an image of a document.
 Extract and summarize all meaningful information 
@@ -19,15 +34,36 @@ If the image is a graphic and not a document then skip and Return nothing.
 Don't add any markdown.
 """
 
-PIL_FORMAT_TO_MIME = {
-    "JPEG": "image/jpeg",
-    "JPG": "image/jpeg",
-    "PNG": "image/png",
-    "GIF": "image/gif",
-    "BMP": "image/bmp",
-    "TIFF": "image/tiff",
-    "WEBP": "image/webp",
-}
+BATCH_PROMPT_TEMPLATE = """
+You are an AI assistant. You have been given {count} images of a document,
+numbered from 1 to {count} in the order they are attached.
+For every image, extract and summarize all meaningful information.
+Transcribe text accurately.
+If it contains diagrams, tables, or charts, describe them clearly.
+If an image is a graphic and not a document then leave its section empty.
+
+Start the section of every image with a line containing only
+{marker} <number>
+followed by its description, and nothing else.
+Don't add any markdown.
+"""
+
+BATCH_MARKER = "### IMAGE"
+
+# Changes whenever the prompts change, so cached results are not reused
+PROMPT_VERSION = hashlib.sha256(
+    (IMAGE_PROMPT_TEMPLATE + BATCH_PROMPT_TEMPLATE).encode()
+).hexdigest()[:12]
+
+OCR_CACHE_PATH = ".cache/ocr.sqlite"
+
+# Attempts per vision request, waits grow exponentially up to the maximum
+RETRY_TIMES = 3
+RETRY_WAIT_SECONDS = 1
+RETRY_MAX_WAIT_SECONDS = 30
+
+# Debug copies of the images sent to the vision model
+ARTIFACT_WRITER = ArtifactWriter.from_env()
 
 
 def ocr(image: ImageFile) -> str | None:
@@ -41,13 +77,202 @@ def ocr(image: ImageFile) -> str | None:
     )
 
     text = response.text
-    filename = image.filename or "".join(
-        secrets.choice(string.ascii_letters + string.digits) for _ in range(6)
-    )
-    img_format = image.format or "JPEG"
-    mime = PIL_FORMAT_TO_MIME.get(img_format.upper(), PIL_FORMAT_TO_MIME["JPEG"])
-    ext = mime.split("/")[-1]
-    filepath = Path(f".logs/images/{filename}.{ext}")
-    filepath.parent.mkdir(parents=True, exist_ok=True)
-    image.save(filepath, format=image.format)
+    ARTIFACT_WRITER.submit(image, text)
     return text
+
+
+class RateLimiter:
+    """Spaces request starts evenly to stay within `requests_per_minute`."""
+
+    def __init__(self, requests_per_minute: Optional[int] = None):
+        self.interval = 60 / requests_per_minute if requests_per_minute else 0
+        self._next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        # Reserve the slot before sleeping, the event loop runs one coroutine
+        # at a time so no lock is needed.
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+
+class OCRService:
+    """
+    Runs vision OCR for many images concurrently.
+
+    At most `max_concurrency` requests are in flight, and request starts are
+    spaced to respect `requests_per_minute`. Images of at most
+    `small_image_pixels` pixels are packed `batch_size` at a time into a
+    single request. Results are returned per image, in input order.
+    A failed request is tried `retries` times in all, with exponential
+    backoff, before its error is raised.
+    Debug copies of the images go to `artifacts`, written in the background.
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        max_concurrency: int = 8,
+        requests_per_minute: Optional[int] = None,
+        batch_size: int = 4,
+        small_image_pixels: int = 512 * 512,
+        artifacts: Optional[ArtifactWriter] = None,
+        retries: int = RETRY_TIMES,
+    ):
+        self.model = model or config.vision_llm_model
+        self.max_concurrency = max(1, max_concurrency)
+        self.batch_size = max(1, batch_size)
+        self.small_image_pixels = small_image_pixels
+        self.requests_per_minute = requests_per_minute
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.artifacts = artifacts or ARTIFACT_WRITER
+        self.retries = max(1, retries)
+
+    @property
+    def version(self) -> str:
+        return f"{self.model}:{PROMPT_VERSION}"
+
+    def split(self, parts: int) -> "OCRService":
+        """A copy with a `parts`th of the concurrency and rate budget."""
+        service = copy.copy(self)
+        service.max_concurrency = max(1, self.max_concurrency // parts)
+        if self.requests_per_minute:
+            service.requests_per_minute = max(1, self.requests_per_minute // parts)
+        service.rate_limiter = RateLimiter(service.requests_per_minute)
+        return service
+
+    def ocr(self, images: Sequence[ImageFile]) -> List[Optional[str]]:
+        if not images:
+            return []
+        return asyncio_run(self.aocr(images))
+
+    async def aocr(self, images: Sequence[ImageFile]) -> List[Optional[str]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results: List[Optional[str]] = [None] * len(images)
+
+        async def run(indexes: List[int]):
+            async with semaphore:
+                texts = await self._request_with_retry([images[i] for i in indexes])
+            for i, text in zip(indexes, texts):
+                results[i] = text
+
+        await asyncio.gather(*[run(group) for group in self._group(images)])
+        return results
+
+    def _group(self, images: Sequence[ImageFile]) -> List[List[int]]:
+        groups: List[List[int]] = []
+        batch: List[int] = []
+        for i, image in enumerate(images):
+            if self.batch_size == 1 or self._pixels(image) > self.small_image_pixels:
+                groups.append([i])
+                continue
+            batch.append(i)
+            if len(batch) == self.batch_size:
+                groups.append(batch)
+                batch = []
+        if batch:
+            groups.append(batch)
+        return groups
+
+    async def _request_with_retry(self, images: List[ImageFile]) -> List[Optional[str]]:
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(self.retries),
+            wait=wait_exponential_jitter(RETRY_WAIT_SECONDS, RETRY_MAX_WAIT_SECONDS),
+            before_sleep=_log_retry,
+            reraise=True,
+        ):
+            with attempt:
+                # Retries wait for a slot of the rate limit too
+                await self.rate_limiter.wait()
+                return await self._request(images)
+
+    async def _request(self, images: List[ImageFile]) -> List[Optional[str]]:
+        if len(images) == 1:
+            prompt = IMAGE_PROMPT_TEMPLATE
+        else:
+            prompt = BATCH_PROMPT_TEMPLATE.format(
+                count=len(images), marker=BATCH_MARKER
+            )
+
+        response = await config.genai_client.aio.models.generate_content(
+            model=self.model,
+            contents=[genai.types.Part.from_text(text=prompt), *images],
+        )
+        if len(images) == 1:
+            texts = [response.text]
+        else:
+            texts = self._split_batch(response.text or "", len(images))
+        if texts is None:
+            # The model did not follow the format, ask for each image alone
+            texts = []
+            for image in images:
+                texts.extend(await self._request_with_retry([image]))
+            return texts
+
+        for image, text in zip(images, texts):
+            self.artifacts.submit(image, text)
+        return texts
+
+    @staticmethod
+    def _split_batch(text: str, count: int) -> Optional[List[str]]:
+        sections = re.split(
+            rf"^\s*{re.escape(BATCH_MARKER)}\s*(\d+)\s*$", text, flags=re.M
+        )
+        texts = {}
+        # re.split yields [preamble, number, body, number, body, ...]
+        for number, body in zip(sections[1::2], sections[2::2]):
+            texts[int(number)] = body.strip()
+        if sorted(texts) != list(range(1, count + 1)):
+            return None
+        return [texts[i + 1] for i in range(count)]
+
+    @staticmethod
+    def _pixels(image: ImageFile) -> int:
+        width, height = image.size
+        return width * height
+
+
+def _log_retry(state: RetryCallState):
+    logger.warning(
+        "Vision request failed on attempt %d, retrying in %.1fs: %s",
+        state.attempt_number,
+        state.upcoming_sleep,
+        state.outcome.exception(),
+    )
+
+
+class OCRCache:
+    """
+    Persistent ocr results, keyed by a hash of the encoded image bytes and
+    the engine that read them: the vision model of `version` (model and
+    prompt) by default, or e.g. the tesseract settings of
+    `TesseractPool.version`. Results of one engine are never served for
+    another. Use `path=":memory:"` to only dedupe within the current
+    process.
+    """
+
+    def __init__(self, version: str, path: str = OCR_CACHE_PATH):
+        self.version = version
+        self._store = DiskCache(path, table="ocr")
+
+    def key(self, image_bytes: bytes, engine: Optional[str] = None) -> str:
+        engine = engine or f"vision:{self.version}"
+        digest = hashlib.sha256(engine.encode())
+        digest.update(b"\0")
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        return self._store.get(key)
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, str]:
+        return self._store.get_many(keys)
+
+    def set(self, key: str, text: str):
+        self._store.set(key, text)
+
+    def set_many(self, items: Iterable[Tuple[str, str]]):
+        self._store.set_many(items)
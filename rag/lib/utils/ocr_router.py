@@ -0,0 +1,120 @@
+import copy
+import io
+from dataclasses import dataclass, fields
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from .tesseract_pool import TesseractPool
+
+SKIPPED = "skipped"
+TESSERACT = "tesseract"
+VISION = "vision"
+
+
+@dataclass
+class OCRStats:
+    """How the images of a document were handled."""
+
+    skipped: int = 0
+    cached: int = 0
+    tesseract: int = 0
+    vision: int = 0
+    upload_bytes: int = 0
+
+    def merge(self, other: "OCRStats") -> "OCRStats":
+        for field in fields(self):
+            mine, theirs = getattr(self, field.name), getattr(other, field.name)
+            setattr(self, field.name, mine + theirs)
+        return self
+
+
+class OCRRouter:
+    """
+    Decides which ocr engine handles an image.
+
+    - Images smaller than `min_side` pixels, or with an entropy under
+      `min_entropy` bits (blank, flat fills, rules), are skipped.
+    - Tesseract runs on the rest. Its text is kept when it finds fewer than
+      `min_chars` characters (a graphic) or reads them with a mean word
+      confidence of at least `min_confidence`.
+    - Otherwise the vision model is used, on a copy downscaled to
+      `max_upload_side` pixels and recompressed as JPEG.
+
+    Tesseract runs on the long lived engines of `tesseract_pool`.
+
+    Subclass and override `keep`, `is_blank` or `decide` to change the policy.
+    """
+
+    def __init__(
+        self,
+        min_side: int = 32,
+        min_entropy: float = 1.0,
+        min_chars: int = 10,
+        min_confidence: float = 85,
+        max_upload_side: int = 1600,
+        upload_quality: int = 85,
+        tesseract_pool: Optional[TesseractPool] = None,
+    ):
+        self.min_side = min_side
+        self.min_entropy = min_entropy
+        self.min_chars = min_chars
+        self.min_confidence = min_confidence
+        self.max_upload_side = max_upload_side
+        self.upload_quality = upload_quality
+        self.tesseract_pool = tesseract_pool or TesseractPool()
+
+    @property
+    def version(self) -> str:
+        """The settings its decisions depend on, see OCRCache."""
+        return (
+            f"router:{self.min_side}:{self.min_entropy}:{self.min_chars}:"
+            f"{self.min_confidence}:{self.tesseract_pool.version}"
+        )
+
+    def split(self, parts: int) -> "OCRRouter":
+        """A copy with a `parts`th of the tesseract engines."""
+        router = copy.copy(self)
+        router.tesseract_pool = self.tesseract_pool.split(parts)
+        return router
+
+    def keep(self, width: int, height: int) -> bool:
+        """Checked from the pdf image metadata, before extracting the image."""
+        return min(width, height) >= self.min_side
+
+    def is_blank(self, image_bytes: bytes) -> bool:
+        image = Image.open(io.BytesIO(image_bytes))
+        # Lets JPEG decoding downscale on the fly instead of decoding it fully
+        image.draft("L", (128, 128))
+        image = image.convert("L")
+        image.thumbnail((128, 128))
+        return image.entropy() < self.min_entropy
+
+    def route(self, image: Image.Image) -> Tuple[str, str]:
+        """Returns the engine to use and the tesseract text."""
+        return self.route_batch([image])[0]
+
+    def route_batch(self, images: Sequence[Image.Image]) -> List[Tuple[str, str]]:
+        results = self.tesseract_pool.recognize_batch(images)
+        return [self.decide(text, confidence) for text, confidence in results]
+
+    def decide(self, text: str, confidence: float) -> Tuple[str, str]:
+        if len(text) < self.min_chars or confidence >= self.min_confidence:
+            return TESSERACT, text
+        return VISION, text
+
+    def prepare_upload(self, image_bytes: bytes) -> bytes:
+        image = Image.open(io.BytesIO(image_bytes))
+        if max(image.size) <= self.max_upload_side and image.format == "JPEG":
+            return image_bytes
+
+        if image.mode not in ("RGB", "L"):
+            # Flatten transparency onto white, like the page it sits on
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        image.thumbnail((self.max_upload_side, self.max_upload_side))
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=self.upload_quality, optimize=True)
+        upload = out.getvalue()
+        return upload if len(upload) < len(image_bytes) else image_bytes
@@ -0,0 +1,174 @@
+import copy
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+# Set once the pytesseract fallback was reported
+_fallback_reported = False
+
+
+class TesseractPool:
+    """
+    Long lived tesseract engines, shared by the threads of a process.
+
+    With `tesserocr` installed every engine is a loaded libtesseract
+    instance, reused for every image, so there is no process start or temp
+    file per image. Recognition releases the GIL, batches run on up to `size`
+    engines in parallel. Engines are created on demand, per process: a pool
+    used by several processes is `split` between them.
+    Without `tesserocr` it falls back to `pytesseract`, one tesseract
+    process per image.
+
+    `tessdata` defaults to the TESSDATA_PREFIX environment variable.
+    """
+
+    def __init__(
+        self,
+        size: Optional[int] = None,
+        lang: str = "eng",
+        tessdata: Optional[str] = None,
+    ):
+        self.size = max(1, size or os.cpu_count() or 1)
+        self.lang = lang
+        self.tessdata = tessdata
+        self._reset()
+
+    @property
+    def version(self) -> str:
+        """The settings its text depends on, see OCRCache."""
+        tessdata = self.tessdata or os.environ.get("TESSDATA_PREFIX", "")
+        return f"tesseract:{self.lang}:{tessdata}"
+
+    def split(self, parts: int) -> "TesseractPool":
+        """
+        A new pool with a `parts`th of the engines, for each of `parts`
+        processes recognizing side by side.
+        """
+        # A copy keeps subclasses, its engines are created again on demand
+        pool = copy.copy(self)
+        pool.size = max(1, self.size // parts)
+        return pool
+
+    def recognize(self, image: Image.Image) -> Tuple[str, float]:
+        """Returns the text of the image and its mean word confidence."""
+        return self.recognize_batch([image])[0]
+
+    def recognize_batch(self, images: Sequence[Image.Image]) -> List[Tuple[str, float]]:
+        if self._pid != os.getpid():
+            # Engines can't be shared with a forked process
+            self._reset()
+        if len(images) <= 1 or self.size == 1:
+            return [self._recognize(image) for image in images]
+        return list(self._executor().map(self._recognize, images))
+
+    def _recognize(self, image: Image.Image) -> Tuple[str, float]:
+        if tesserocr is None:
+            return _pytesseract(image, self.lang)
+
+        engine = self._acquire()
+        try:
+            engine.SetImage(image)
+            text = engine.GetUTF8Text().strip()
+            confidences = [c for c in engine.AllWordConfidences() if c >= 0]
+            confidence = sum(confidences) / len(confidences) if confidences else 0.0
+            return text, confidence
+        finally:
+            engine.Clear()
+            self._engines.put(engine)
+
+    def _acquire(self):
+        try:
+            return self._engines.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._engines.get()
+
+        try:
+            tessdata = self.tessdata or os.environ.get("TESSDATA_PREFIX")
+            if tessdata:
+                return tesserocr.PyTessBaseAPI(path=tessdata, lang=self.lang)
+            return tesserocr.PyTessBaseAPI(lang=self.lang)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(
+                    max_workers=self.size, thread_name_prefix="tesseract"
+                )
+            return self._threads
+
+    def _reset(self):
+        self._engines: queue.Queue = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        # Only the configuration travels to worker processes
+        state = self.__dict__.copy()
+        for key in ("_engines", "_created", "_lock", "_threads", "_pid"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+
+def _pytesseract(image: Image.Image, lang: str) -> Tuple[str, float]:
+    global _fallback_reported
+    if not _fallback_reported:
+        _fallback_reported = True
+        logger.warning(
+            "tesserocr is not installed, starting a tesseract process per image"
+        )
+    try:
+        import pytesseract
+    except ImportError:
+        raise ImportError(
+            "pytesseract is required to read PDF files: `pip install pytesseract`"
+            "Also install tesseract: `https://tesseract-ocr.github.io/tessdoc/Installation.html`"
+        )
+    data = pytesseract.image_to_data(
+        image, lang=lang, output_type=pytesseract.Output.DICT
+    )
+    return tesseract_text(data)
+
+
+def tesseract_text(data: dict) -> Tuple[str, float]:
+    """Rebuilds the text of `image_to_data` output, line by line."""
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        confidence = float(data["conf"][i])
+        if confidence < 0 or not word.strip():
+            continue
+        line = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(line, []).append(word)
+        confidences.append(confidence)
+
+    text = "\n".join(" ".join(words) for words in lines.values())
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return text, confidence
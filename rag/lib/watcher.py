@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+from typing import Callable, Optional, Set
+
+from watchfiles import Change, DefaultFilter, watch
+
+logger = logging.getLogger(__name__)
+
+
+class IndexWatcher:
+    """
+    Watches `input_dir` in a background thread and calls `on_change` with the
+    changed paths once a burst of file events has settled.
+
+    Events are grouped by `watchfiles`: a batch is emitted after `step_ms`
+    without new events, or at the latest after `debounce_ms`. Batches that
+    arrive while `on_change` is still running are merged into the next call.
+    """
+
+    def __init__(
+        self,
+        input_dir: str,
+        on_change: Callable[[Set[str]], None],
+        debounce_ms: int = 2000,
+        step_ms: int = 500,
+    ):
+        self.input_dir = input_dir
+        self.on_change = on_change
+        self.debounce_ms = debounce_ms
+        self.step_ms = step_ms
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "IndexWatcher":
+        if self._thread and self._thread.is_alive():
+            return self
+        os.makedirs(self.input_dir, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="index-watcher", daemon=True
+        )
+        self._thread.start()
+        logger.info("Watching %s for changes", self.input_dir)
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self) -> "IndexWatcher":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        for changes in watch(
+            self.input_dir,
+            watch_filter=_InputFilter(),
+            debounce=self.debounce_ms,
+            step=self.step_ms,
+            stop_event=self._stop,
+            raise_interrupt=False,
+        ):
+            paths = {path for _, path in changes}
+            logger.info("Detected %d changed files in %s", len(paths), self.input_dir)
+            try:
+                self.on_change(paths)
+            except Exception:
+                # Keep watching, the files are picked up again by the next sync
+                logger.exception("Failed to apply changes of %s", self.input_dir)
+
+
+class _InputFilter(DefaultFilter):
+    """Skips editor swap files and partial downloads as well as hidden files."""
+
+    ignore_suffixes = (".tmp", ".part", ".crdownload")
+
+    def __call__(self, change: Change, path: str) -> bool:
+        name = os.path.basename(path)
+        if name.startswith(".") or name.endswith(self.ignore_suffixes):
+            return False
+        return super().__call__(change, path)
@@ -0,0 +1,31 @@
+"""
+Cuts the vectors of persisted indexes to fewer dimensions, in place.
+
+gemini-embedding-001 is trained so the first dimensions of an embedding are
+an embedding too: 768 of its 3072 keep most of the recall for a quarter of
+the memory and scoring time. The stored vectors are truncated and
+normalized again, nothing is embedded again, and queries are embedded with
+as many dimensions from then on. Set EMBEDDING_DIMENSIONS to the same value
+so new indexes match.
+
+    python -m rag.truncate data/store/indexes/essay --dimensions 768
+"""
+
+import argparse
+import logging
+
+import rag.lib as rag
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("storage", nargs="+", help="persist directories of indexes")
+    parser.add_argument("--dimensions", type=int, default=768)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    for storage in args.storage:
+        rag.index.truncate_index(storage, args.dimensions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import io
+import sys
+import types
+import unittest
+
+
+def _offline_config():
+    """Stands in for the project config, which creates the Gemini clients."""
+    if "config" in sys.modules:
+        return
+    config = types.ModuleType("config")
+    config.vision_llm_model = "test-vision"
+    config.genai_client = None
+    config.embedding = None
+    config.llm = None
+    sys.modules["config"] = config
+
+
+_offline_config()
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from rag.lib.readers.parsers.pdf_parser import (  # noqa: E402
+    PageCheckpoints,
+    ParseStats,
+    PDFParser,
+    PendingImage,
+)
+from rag.lib.utils.ocr import OCRCache, OCRService  # noqa: E402
+from rag.lib.utils.ocr_router import OCRRouter  # noqa: E402
+from rag.lib.utils.tesseract_pool import TesseractPool  # noqa: E402
+
+
+class ScriptedTesseractPool(TesseractPool):
+    """Reads every image as `text`, with `confidence`."""
+
+    def __init__(self, text: str, confidence: float, lang: str = "eng"):
+        super().__init__(size=1, lang=lang)
+        self.text = text
+        self.confidence = confidence
+        # Shared with the copies the parser splits off
+        self.calls = []
+
+    def _recognize(self, image):
+        self.calls.append(self.text)
+        return self.text, self.confidence
+
+
+def _image() -> bytes:
+    pixels = np.random.default_rng(0).integers(0, 255, (64, 64), dtype=np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, format="PNG")
+    return out.getvalue()
+
+
+class OCRCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = OCRCache(OCRService().version, path=":memory:")
+        self.image = _image()
+
+    def parse(self, pool: TesseractPool, min_confidence: float = 85):
+        parser = PDFParser(
+            num_workers=1,
+            ocr_cache=self.cache,
+            ocr_router=OCRRouter(tesseract_pool=pool, min_confidence=min_confidence),
+            checkpoints=PageCheckpoints(":memory:"),
+        )
+        return parser._parse_images([self.image], ParseStats())[0]
+
+    def test_engines_have_their_own_keys(self):
+        pool = TesseractPool()
+        keys = {
+            self.cache.key(self.image),
+            self.cache.key(self.image, pool.version),
+            self.cache.key(self.image, TesseractPool(lang="deu").version),
+            self.cache.key(self.image, OCRRouter(tesseract_pool=pool).version),
+        }
+        self.assertEqual(len(keys), 4)
+
+    def test_tesseract_text_is_not_served_for_vision(self):
+        self.assertEqual(self.parse(ScriptedTesseractPool("read", 99.0)), "read")
+
+        part = self.parse(ScriptedTesseractPool("unsure " * 4, 50.0), 60)
+        self.assertIsInstance(part, PendingImage)
+        self.assertIsNone(self.cache.get(part.key))
+
+    def test_tesseract_settings_invalidate_the_cache(self):
+        english = ScriptedTesseractPool("english", 99.0)
+        self.assertEqual(self.parse(english), "english")
+        self.assertEqual(self.parse(english), "english")
+        self.assertEqual(english.calls, ["english"])
+
+        german = ScriptedTesseractPool("deutsch", 99.0, lang="deu")
+        self.assertEqual(self.parse(german), "deutsch")
+        self.assertEqual(german.calls, ["deutsch"])
+
+
+if __name__ == "__main__":
+    unittest.main()
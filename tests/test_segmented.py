@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+
+def _offline_config():
+    """Stands in for the project config, which creates the Gemini clients."""
+    if "config" in sys.modules:
+        return
+    config = types.ModuleType("config")
+    config.vision_llm_model = "test-vision"
+    config.genai_client = None
+    config.embedding = None
+    config.llm = None
+    sys.modules["config"] = config
+
+
+_offline_config()
+
+from llama_index.core import Settings, StorageContext, VectorStoreIndex  # noqa: E402
+from llama_index.core.embeddings import MockEmbedding  # noqa: E402
+from llama_index.core.schema import Document  # noqa: E402
+
+from rag.lib.stores import NumpyVectorStore, SegmentedStorage  # noqa: E402
+from rag.lib.stores import segmented  # noqa: E402
+
+
+class SegmentedStorageTest(unittest.TestCase):
+    def setUp(self):
+        Settings.embed_model = MockEmbedding(embed_dim=8)
+        self.directory = tempfile.mkdtemp()
+
+    def build(self, quantization=None):
+        store = NumpyVectorStore()
+        store.quantize(quantization)
+        documents = [Document(text=f"document {i}", doc_id=f"d{i}") for i in range(3)]
+        return VectorStoreIndex.from_documents(
+            documents,
+            storage_context=StorageContext.from_defaults(vector_store=store),
+        )
+
+    def test_persist_of_deletes_only(self):
+        for quantization in (None, "int8"):
+            with self.subTest(quantization=quantization):
+                directory = os.path.join(self.directory, str(quantization))
+                index = self.build(quantization)
+                storage = SegmentedStorage(directory)
+                storage.save(index)
+
+                index.delete_ref_doc("d1")
+                self.assertGreater(storage.save(index), 0)
+
+                loaded = SegmentedStorage(directory).load()
+                self.assertEqual(len(loaded.vector_store.rows), 2)
+                self.assertEqual(loaded.vector_store.quantization, quantization)
+                loaded.vector_store.clear()
+                index.vector_store.clear()
+
+    def test_unlisted_segments_are_only_swept_by_the_writer(self):
+        index = self.build()
+        storage = SegmentedStorage(self.directory, max_segments=2)
+        storage.save(index)
+        # A segment another process is still writing
+        stray = os.path.join(storage.directory, "999999.npy")
+        open(stray, "wb").close()
+
+        SegmentedStorage(self.directory).load().vector_store.clear()
+        self.assertTrue(os.path.exists(stray))
+
+        for i in range(3, 6):
+            index.insert(Document(text=f"document {i}", doc_id=f"d{i}"))
+            storage.save(index)
+        storage.wait()
+        self.assertFalse(os.path.exists(stray))
+        index.vector_store.clear()
+
+    def test_files_in_use_are_left_for_the_next_sweep(self):
+        path = os.path.join(self.directory, "1.npy")
+        open(path, "wb").close()
+        with mock.patch.object(segmented.os, "remove", side_effect=PermissionError):
+            segmented._remove(path)
+        self.assertTrue(os.path.exists(path))
+        segmented._remove(path)
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import sys
+import types
+import unittest
+
+
+def _offline_config():
+    """Stands in for the project config, which creates the Gemini clients."""
+    if "config" in sys.modules:
+        return
+    config = types.ModuleType("config")
+    config.vision_llm_model = "test-vision"
+    config.genai_client = None
+    config.embedding = None
+    config.llm = None
+    sys.modules["config"] = config
+
+
+_offline_config()
+
+from rag.lib.utils.ocr_router import OCRRouter  # noqa: E402
+from rag.lib.utils.tesseract_pool import TesseractPool  # noqa: E402
+
+
+class FixedTesseractPool(TesseractPool):
+    def _recognize(self, image):
+        return "fixed", 99.0
+
+
+class TesseractPoolTest(unittest.TestCase):
+    def test_split_keeps_the_pool_class(self):
+        pool = FixedTesseractPool(size=8, lang="deu")
+        split = pool.split(3)
+        self.assertIsInstance(split, FixedTesseractPool)
+        self.assertEqual((split.size, split.lang), (2, "deu"))
+        self.assertEqual(pool.size, 8)
+        self.assertEqual(split.recognize_batch([None, None]), [("fixed", 99.0)] * 2)
+
+    def test_router_split_keeps_the_pool_class(self):
+        router = OCRRouter(tesseract_pool=FixedTesseractPool(size=4)).split(8)
+        self.assertIsInstance(router.tesseract_pool, FixedTesseractPool)
+        self.assertEqual(router.tesseract_pool.size, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,6 +16,7 @@ from llama_index.core.workflow import Context
 
 import config
 from rag.agent.run import build_agent
+from rag.lib.embedding import cached_embedding
 from rag.lib.index import default_splitter
 
 Settings.embed_model = config.embedding
@@ -24,6 +25,7 @@ Settings.embed_model = config.embedding
 def create_index(documents: List[Document] = []):
     index = VectorStoreIndex.from_documents(
         documents,
+        embed_model=cached_embedding(),
         transformations=[default_splitter()],
         show_progress=True,
     )
@@ -1,4 +1,5 @@
 import rag.lib.index as indexer
+from rag.lib.dedupe import DuplicateFilter
 from rag.lib.reader import DocumentReader
 
 
@@ -10,27 +11,50 @@ def build_reader(upload_dir: str = "uploads"):
     return DocumentReader(f"data/input/{upload_dir}")
 
 
+def duplicate_filter(reader: DocumentReader, splitter, dedupe: bool = False):
+    # Near duplicate pages are only skipped when asked for, see DuplicateFilter
+    if not dedupe:
+        return None
+    return DuplicateFilter.for_index(index_path(reader.name), splitter=splitter)
+
+
 def read_index(upload_dir: str = "uploads"):
     reader = build_reader(upload_dir)
     index = indexer.read_index(index_path(reader.name))
     return index
 
 
-def load_index(upload_dir: str = "uploads"):
+def load_index(upload_dir: str = "uploads", dedupe: bool = False):
     reader = build_reader(upload_dir)
+    splitter = indexer.default_splitter()
     index = indexer.load_index(
         reader,
         index_path(reader.name),
-        indexer.default_splitter(),
+        splitter,
+        duplicate_filter(reader, splitter, dedupe),
     )
     return index
 
 
-def create_index(upload_dir: str = "uploads"):
+def create_index(upload_dir: str = "uploads", dedupe: bool = False):
     reader = build_reader(upload_dir)
+    splitter = indexer.default_splitter()
     index = indexer.create_index(
         reader,
         index_path(reader.name),
-        indexer.default_splitter(),
+        splitter,
+        duplicate_filter(reader, splitter, dedupe),
+    )
+    return index
+
+
+def sync_index(upload_dir: str = "uploads", dedupe: bool = False):
+    reader = build_reader(upload_dir)
+    splitter = indexer.default_splitter()
+    index = indexer.sync_index(
+        reader,
+        index_path(reader.name),
+        splitter,
+        duplicate_filter(reader, splitter, dedupe),
     )
     return index
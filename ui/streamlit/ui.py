@@ -1,7 +1,7 @@
 import streamlit as st
 import os
 import shutil
-from ui.indexer import read_index, load_index, create_index, index_path
+from ui.indexer import read_index, load_index, create_index, sync_index, index_path
 from ui.engine import aquery_rag
 from ui.async_helper import run_async
 
@@ -37,6 +37,7 @@ def main():
                 new_files += 1
         if new_files:
             st.success(f"Uploaded {new_files} new file(s)!")
+            st.session_state.sync_pending = True
         else:
             st.info("All uploaded files already exist.")
 
@@ -72,6 +73,19 @@ def main():
     if st.session_state.index:
         st.write(f"✅ Index path: `{st.session_state.index_path}`")
 
+        # Index new uploads right away instead of waiting for a sync or rebuild
+        if st.session_state.get("sync_pending"):
+            with st.spinner("Indexing uploaded documents..."):
+                st.session_state.index = sync_index(UPLOAD_NAME)
+            st.session_state.sync_pending = False
+            st.success("Uploaded documents added to the index!")
+
+        if st.button("🔁 Sync Index (New & Changed Files)"):
+            with st.spinner("Indexing new and changed documents..."):
+                index = sync_index(UPLOAD_NAME)
+                st.session_state.index = index
+            st.success("Index synced successfully!")
+
         if st.button("🔄 Rebuild Index (Clear & Recreate)"):
             with st.spinner("Rebuilding index from uploaded documents..."):
                 import shutil